@@ -1,4 +1,4 @@
-from flask import Flask, render_template, Response, request, redirect, url_for, jsonify, session, send_file
+from flask import Flask, render_template, Response, request, redirect, url_for, jsonify, session
 import cv2
 import os
 import time
@@ -6,36 +6,172 @@ import threading
 import shutil
 import csv
 import io
+import zlib
 import pickle
 import uuid
 import secrets
+import atexit
 from functools import wraps
-from database import init_db, DB_PATH
+from database import init_db, DB_PATH, ConnectionPool
 import sqlite3
-from face_logic import FaceRecognizer
+from face_logic import FaceRecognizer, BackgroundTrainer, FaceTracker, MotionGate, RecognitionBatcher, ScaleAdapter, is_student_folder, load_detection_presets, make_detector
+from camera_service import CaptureService
+from attendance_writer import AttendanceWriter
+from event_bus import EventBus, format_sse
+from recognition_pool import RecognitionPool, decode_frame
+from metrics import Metrics
+from model_share import ModelCoordinator
 
 app = Flask(__name__, template_folder='Frontend', static_folder='Styles')
 app.secret_key = secrets.token_hex(16)
 
-# Initialize Face Engine
-face_engine = FaceRecognizer()
-# Load existing models if any
-face_engine.train()
+# Prometheus-style metrics on /metrics, off by default. FACEREG_METRICS=1 attaches the timing hooks;
+# otherwise every component gets metrics=None and skips them.
+metrics = Metrics(enabled=os.environ.get('FACEREG_METRICS', '').lower() in ('1', 'true', 'yes'))
+metrics_hooks = metrics if metrics.enabled else None
 
-# Global camera object and frame buffer
-camera = cv2.VideoCapture()
-last_frame = None
+# Face detector shared by the camera pipeline, uploads and enrolment captures. FACEREG_DETECTOR picks
+# the backend: cascade (default), haar, or the OpenCV DNN models yunet / ssd, whose files go in
+# models/ (see face_logic.DETECTOR_MODELS). FACEREG_DETECTOR_THREADS sizes OpenCV's thread pool.
+def make_app_detector():
+    name = os.environ.get('FACEREG_DETECTOR', 'cascade')
+    try:
+        return make_detector(name, 'models', os.environ.get('FACEREG_DETECTOR_THREADS'))
+    except (OSError, ValueError) as e:
+        print(f"Face detector '{name}' unavailable ({e}), using the cascade")
+        return make_detector('cascade')
+
+# Face engine. lazy: nothing is loaded at import; warm_up_engine() below loads the saved model in
+# the background, and a recognition that arrives first loads it itself
+face_engine = FaceRecognizer(metrics=metrics_hooks, lazy=True, detector=make_app_detector())
+# Faces from all cameras and uploads are scored together: up to RECOGNITION_BATCH faces collected
+# for at most RECOGNITION_WAIT_MS, then one vectorised pass over the gallery
+RECOGNITION_BATCH = 32
+RECOGNITION_WAIT_MS = 4
+face_engine.batcher = RecognitionBatcher(RECOGNITION_BATCH, RECOGNITION_WAIT_MS).start()
+atexit.register(face_engine.batcher.stop) # Registered first so it stops after the cameras
+# All training runs on one background worker; recognition keeps using the last published model.
+# Under a multi-process server set FACEREG_SHARED_MODEL=1: one worker trains and the others map the
+# model it saves (see model_share.py) instead of each training and holding a private copy.
+# Attendance is shared through the database (see AttendanceWriter), but the EventBus is not:
+# /events only streams the marks made by the worker that serves it, so in this mode a live view
+# is incomplete unless the server routes a session to one worker. Student pages do not rely on it;
+# they show the result of their own /api/recognize request.
+SHARED_MODEL = os.environ.get('FACEREG_SHARED_MODEL', '').lower() in ('1', 'true', 'yes')
+if SHARED_MODEL:
+    print("FACEREG_SHARED_MODEL: /events streams only the marks made by the worker serving it")
+    # The elected trainer runs the start-up sync, when one is needed
+    trainer = ModelCoordinator(face_engine).start()
+    atexit.register(trainer.stop)
+else:
+    trainer = BackgroundTrainer(face_engine)
+
+# Start-up work off the import path; /ready answers 503 until it is done
+startup = {'started': time.time(), 'ready': threading.Event(), 'warm_up_s': None, 'synced': False}
+
+def warm_up_engine():
+    try:
+        startup['warm_up_s'] = round(face_engine.warm_up(), 3)
+        # Sync with uploads/ only if a student folder changed since the model was saved
+        if not SHARED_MODEL and face_engine.dataset_changed():
+            trainer.submit('sync')
+            startup['synced'] = True
+    except Exception as e:
+        print(f"Start-up warm-up failed: {e}")
+    finally:
+        startup['ready'].set()
+
+threading.Thread(target=warm_up_engine, name='warm-up', daemon=True).start()
+
+# Camera sources by name: device index, RTSP/HTTP URL or video file.
+# Override with FACEREG_CAMERAS, e.g. "default=0,hall=rtsp://10.0.0.5/stream,demo=clips/lecture.mp4"
+CAMERA_SOURCES = {'default': 0}
+if os.environ.get('FACEREG_CAMERAS'):
+    CAMERA_SOURCES = dict(item.split('=', 1) for item in os.environ['FACEREG_CAMERAS'].split(','))
+
+# Recognition thresholds (LBPH distance): attendance sessions are slightly more relaxed than the admin view
+SESSION_THRESHOLD = 48
+ADMIN_THRESHOLD = 45
+
+# Pipeline rates: the stream stays smooth at STREAM_FPS while recognition samples the newest frame
+# at ANALYSIS_FPS on RECOGNITION_WORKERS threads, dropping frames it cannot keep up with
+STREAM_FPS = 15
+ANALYSIS_FPS = 10
+RECOGNITION_WORKERS = 2
+
+def annotator(threshold):
+    # Draws boxes/labels for one view; detection uses the loosest threshold, each view re-applies its own
+    def annotate(image, results):
+        for res in results:
+            x, y, w, h = res['box']
+            student_id = res['student_id'] if res['confidence_raw'] < threshold else "Unknown"
+            cv2.rectangle(image, (x, y), (x+w, y+h), (0, 255, 0), 2)
+            cv2.putText(image, student_id, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (36,255,12), 2)
+    return annotate
+
+# One face tracker per open camera: faces are recognised when they appear and re-verified now and then.
+# Between full rescans (every MOTION_RESCAN analysed frames) the cascade only runs where the image
+# changed and around faces already being tracked.
+MOTION_RESCAN = 30
+trackers = {} # {camera name: FaceTracker}
+
+# Cascade preset per camera (face_logic.DETECTION_PRESETS plus any saved by bench/detect_tuning.py),
+# e.g. FACEREG_DETECTION="hall=hall,desk=kiosk"; other cameras use 'default'. With ADAPTIVE_DETECTION
+# each camera narrows its preset to the face sizes it sees and coarsens it while tracking is stable.
+DETECTION_PRESETS = load_detection_presets(os.path.join(face_engine.model_dir, 'detection_presets.json'))
+CAMERA_DETECTION = {}
+if os.environ.get('FACEREG_DETECTION'):
+    CAMERA_DETECTION = dict(item.split('=', 1) for item in os.environ['FACEREG_DETECTION'].split(','))
+ADAPTIVE_DETECTION = os.environ.get('FACEREG_ADAPTIVE_DETECTION', '1').lower() not in ('0', 'false', 'no')
+
+def camera_preset(camera_name):
+    name = CAMERA_DETECTION.get(camera_name, 'default')
+    if name not in DETECTION_PRESETS:
+        print(f"Unknown detection preset '{name}' for camera '{camera_name}', using 'default'")
+        name = 'default'
+    return DETECTION_PRESETS[name]
+
+def make_detect(camera_name):
+    preset = camera_preset(camera_name)
+    tracker = FaceTracker(face_engine, gate=MotionGate(rescan_every=MOTION_RESCAN), detection=preset,
+                          scale=ScaleAdapter(preset, explore_every=MOTION_RESCAN) if ADAPTIVE_DETECTION else None)
+    trackers[camera_name] = tracker
+    # The pool's workers share the tracker; seq lets it drop a frame that finishes behind a newer one
+    return lambda frame, seq: tracker.update(frame, strict_threshold=max(SESSION_THRESHOLD, ADMIN_THRESHOLD), seq=seq)
+
+# Per camera: one reader thread, a recognition worker pool, and one JPEG encoder per view,
+# all shared by every /video_feed viewer
+capture_service = CaptureService(
+    CAMERA_SOURCES,
+    make_detect,
+    {'session': annotator(SESSION_THRESHOLD), 'admin': annotator(ADMIN_THRESHOLD)},
+    workers=RECOGNITION_WORKERS,
+    analysis_fps=ANALYSIS_FPS,
+    stream_fps=STREAM_FPS,
+    metrics=metrics_hooks
+)
+atexit.register(capture_service.stop_all)
 
 # Initialize DB on start
 init_db()
 
-# Performance Caching
-student_name_cache = {} # {student_id: name}
+# Attendance from the video feed is resolved and de-duplicated in memory and written in batches
+# by a background thread, so the video loop never touches the database
+attendance_writer = AttendanceWriter(DB_PATH)
+attendance_writer.metrics = metrics_hooks
+attendance_writer.start()
+atexit.register(attendance_writer.stop)
+
+# Reused, pre-tuned connections; conn.close() returns them to the pool
+db_pool = ConnectionPool(DB_PATH)
+atexit.register(db_pool.close_all)
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db_pool.get()
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    db_pool.release_thread()
 
 # --- Security: Authentication ---
 def login_required(f):
@@ -95,11 +231,13 @@ def create_session():
     
     conn = get_db_connection()
     # Close any existing active sessions for this lecturer
+    ended = [row['id'] for row in conn.execute('SELECT id FROM sessions WHERE lecturer_id = ? AND is_active = 1', (lecturer_id,))]
     conn.execute('UPDATE sessions SET is_active = 0 WHERE lecturer_id = ?', (lecturer_id,))
     # Create new session
     conn.execute('INSERT INTO sessions (lecturer_id, session_token) VALUES (?, ?)', (lecturer_id, token))
     conn.commit()
     conn.close()
+    end_sessions(ended)
     
     return redirect(url_for('index'))
 
@@ -146,71 +284,176 @@ def index():
         return redirect(url_for('login'))
         
     conn = get_db_connection()
+    stats = dashboard_stats(conn, lecturer_id)
+    conn.close()
     
-    total_students = conn.execute('SELECT COUNT(*) FROM students').fetchone()[0]
+    return render_template('index.html', stats=stats)
+
+def dashboard_stats(conn, lecturer_id):
+    # Served from the aggregate tables (see database.STATS_SCHEMA): a few primary-key lookups,
+    # whatever the size of the attendance history
+    counters = dict(conn.execute('SELECT name, value FROM counters').fetchall())
     
     # Get active session
     active_session = conn.execute('SELECT * FROM sessions WHERE lecturer_id = ? AND is_active = 1', (lecturer_id,)).fetchone()
     
-    today_attendance = 0
+    session_stats = None
     if active_session:
-        today_attendance = conn.execute('SELECT COUNT(DISTINCT student_id) FROM attendance WHERE session_id = ?', (active_session['id'],)).fetchone()[0]
+        session_stats = conn.execute('SELECT * FROM session_stats WHERE session_id = ?', (active_session['id'],)).fetchone()
     
+    return {
+        'total_students': counters.get('students', 0),
+        'total_sessions': lecturer_session_count(conn, lecturer_id),
+        'today_attendance': session_stats['present'] if session_stats else 0,
+        'active_session': active_session,
+        'active_session_stats': session_stats
+    }
+
+def lecturer_session_count(conn, lecturer_id):
+    # The lecturer's own sessions (idx_sessions_lecturer); counters.sessions covers every lecturer
+    return conn.execute('SELECT COUNT(*) FROM sessions WHERE lecturer_id = ?', (lecturer_id,)).fetchone()[0]
+
+def attendance_rate(count, total):
+    return round(count / float(total), 4) if total else 0.0
+
+@app.route('/api/stats')
+@login_required
+def api_stats():
+    conn = get_db_connection()
+    stats = dashboard_stats(conn, session['lecturer_id'])
     conn.close()
     
-    return render_template('index.html', stats={
-        'total_students': total_students,
-        'today_attendance': today_attendance,
-        'active_session': active_session
+    active = stats['active_session']
+    session_stats = stats['active_session_stats']
+    return jsonify({
+        'total_students': stats['total_students'],
+        'total_sessions': stats['total_sessions'],
+        'today_attendance': stats['today_attendance'],
+        'active_session': {
+            'id': active['id'],
+            'token': active['session_token'],
+            'present': stats['today_attendance'],
+            'attendance_rate': attendance_rate(stats['today_attendance'], stats['total_students']),
+            'first_seen': session_stats['first_seen'] if session_stats else None,
+            'last_seen': session_stats['last_seen'] if session_stats else None
+        } if active else None
     })
 
+@app.route('/api/stats/student/<path:student_id>')
+@login_required
+def api_student_stats(student_id):
+    # Rate over the logged-in lecturer's sessions: both counts are limited to them. The student's
+    # rows are found through idx_attendance_student_time, so this reads one student's history only.
+    # first_seen/last_seen cover all of the student's attendance.
+    conn = get_db_connection()
+    row = conn.execute('SELECT * FROM student_stats WHERE student_id = ?', (student_id,)).fetchone()
+    total_sessions = lecturer_session_count(conn, session['lecturer_id'])
+    attended = conn.execute('''
+        SELECT COUNT(DISTINCT a.session_id) FROM attendance a JOIN sessions s ON s.id = a.session_id
+        WHERE a.student_id = ? AND s.lecturer_id = ?
+    ''', (student_id, session['lecturer_id'])).fetchone()[0] if row else 0
+    conn.close()
+    
+    return jsonify({
+        'student_id': student_id,
+        'sessions_attended': attended,
+        'total_sessions': total_sessions,
+        'attendance_rate': attendance_rate(attended, total_sessions),
+        'first_seen': row['first_seen'] if row else None,
+        'last_seen': row['last_seen'] if row else None
+    })
+
+# Rows per /attendance page. Pages are keyset-paginated on (date, time, id), newest first, so a
+# page costs the same however far back it is.
+ATTENDANCE_PAGE_SIZE = 100
+EXPORT_CHUNK_ROWS = 500 # CSV rows per chunk written to the export stream
+
+ATTENDANCE_QUERY = '''
+    SELECT a.*, s.name, sess.session_token
+    FROM attendance a 
+    JOIN students s ON a.student_id = s.student_id 
+    JOIN sessions sess ON a.session_id = sess.id
+    WHERE sess.lecturer_id = ? {where}
+    ORDER BY a.date DESC, a.time DESC, a.id DESC
+'''
+
+def parse_cursor(value):
+    # "<date>,<time>,<id>" of the last row shown -> (date, time, id), or None if missing/malformed
+    try:
+        date, time_, record_id = value.split(',')
+        return (date, time_, int(record_id))
+    except (AttributeError, ValueError):
+        return None
+
 @app.route('/attendance')
 @login_required
 def view_attendance():
     lecturer_id = session['lecturer_id']
+    after = parse_cursor(request.args.get('after'))
     conn = get_db_connection()
-    records = conn.execute('''
-        SELECT a.*, s.name, sess.session_token
-        FROM attendance a 
-        JOIN students s ON a.student_id = s.student_id 
-        JOIN sessions sess ON a.session_id = sess.id
-        WHERE sess.lecturer_id = ?
-        ORDER BY a.date DESC, a.time DESC
-    ''', (lecturer_id,)).fetchall()
+    if after:
+        query = ATTENDANCE_QUERY.format(where='AND (a.date, a.time, a.id) < (?, ?, ?)')
+        params = (lecturer_id,) + after
+    else:
+        query = ATTENDANCE_QUERY.format(where='')
+        params = (lecturer_id,)
+    # One extra row tells us whether there is an older page
+    records = conn.execute(query + ' LIMIT ?', params + (ATTENDANCE_PAGE_SIZE + 1,)).fetchall()
     conn.close()
-    return render_template('attendance.html', records=records)
+
+    next_cursor = None
+    if len(records) > ATTENDANCE_PAGE_SIZE:
+        records = records[:ATTENDANCE_PAGE_SIZE]
+        last = records[-1]
+        next_cursor = f"{last['date']},{last['time']},{last['id']}"
+    return render_template('attendance.html', records=records, next_cursor=next_cursor, paged=after is not None)
 
 @app.route('/export_attendance')
 @login_required
 def export_attendance():
+    # Streams the CSV as the cursor yields rows (constant memory); ?gzip=1 compresses on the fly
     lecturer_id = session['lecturer_id']
-    conn = get_db_connection()
-    records = conn.execute('''
-        SELECT a.date, a.time, a.student_id, s.name, a.status 
-        FROM attendance a 
-        JOIN students s ON a.student_id = s.student_id 
-        JOIN sessions sess ON a.session_id = sess.id
-        WHERE sess.lecturer_id = ?
-        ORDER BY a.date DESC, a.time DESC
-    ''', (lecturer_id,)).fetchall()
-    conn.close()
+    compress = request.args.get('gzip') in ('1', 'true', 'yes')
+
+    def generate():
+        conn = get_db_connection()
+        # gzip container (wbits 31) so the download opens with any gzip tool
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        try:
+            cursor = conn.execute('''
+                SELECT a.date, a.time, a.student_id, s.name, a.status 
+                FROM attendance a 
+                JOIN students s ON a.student_id = s.student_id 
+                JOIN sessions sess ON a.session_id = sess.id
+                WHERE sess.lecturer_id = ?
+                ORDER BY a.date DESC, a.time DESC, a.id DESC
+            ''', (lecturer_id,))
+            proxy = io.StringIO()
+            writer = csv.writer(proxy)
+            writer.writerow(['Date', 'Time', 'Student ID', 'Name', 'Status'])
+            while True:
+                rows = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+                for row in rows:
+                    writer.writerow([row['date'], row['time'], row['student_id'], row['name'], row['status']])
+                chunk = proxy.getvalue().encode('utf-8')
+                proxy.seek(0)
+                proxy.truncate()
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+                if not rows:
+                    break
+            if compressor is not None:
+                yield compressor.flush()
+        finally:
+            conn.close()
 
-    proxy = io.StringIO()
-    writer = csv.writer(proxy)
-    writer.writerow(['Date', 'Time', 'Student ID', 'Name', 'Status'])
-    for row in records:
-        writer.writerow([row['date'], row['time'], row['student_id'], row['name'], row['status']])
-
-    mem = io.BytesIO()
-    mem.write(proxy.getvalue().encode('utf-8'))
-    mem.seek(0)
-    proxy.close()
-
-    return send_file(
-        mem,
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=f'attendance_{time.strftime("%Y%m%d_%H%M%S")}.csv'
+    filename = f'attendance_{time.strftime("%Y%m%d_%H%M%S")}.csv' + ('.gz' if compress else '')
+    return Response(
+        generate(),
+        mimetype='application/gzip' if compress else 'text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
     )
 
 @app.route('/students')
@@ -230,6 +473,7 @@ def delete_student(student_id):
         conn.execute('DELETE FROM attendance WHERE student_id = ?', (student_id,))
         conn.execute('DELETE FROM students WHERE student_id = ?', (student_id,))
         conn.commit()
+        attendance_writer.remove_student(student_id)
         
         # 2. Delete Images
         folder_name = student_id.replace('/', '-')
@@ -237,8 +481,8 @@ def delete_student(student_id):
         if os.path.exists(student_dir):
             shutil.rmtree(student_dir)
             
-        # 3. Retrain model
-        face_engine.train()
+        # 3. Drop the student from the model (no full retrain)
+        trainer.submit('remove', folder_name)
         
     except Exception as e:
         print(f"Error deleting student: {e}")
@@ -255,6 +499,7 @@ def delete_all_students():
         conn.execute('DELETE FROM attendance')
         conn.execute('DELETE FROM students')
         conn.commit()
+        attendance_writer.clear()
         
         # 2. Clear Uploaded Images
         if os.path.exists('uploads'):
@@ -264,7 +509,7 @@ def delete_all_students():
                     shutil.rmtree(file_path)
                     
         # 3. Retrain (to empty model)
-        face_engine.train()
+        trainer.submit('train')
     except Exception as e:
         print(f"Error resetting students: {e}")
     finally:
@@ -293,6 +538,7 @@ def register():
             try:
                 conn.execute('INSERT INTO students (name, student_id) VALUES (?, ?)', (name, student_id))
                 conn.commit()
+                attendance_writer.add_student(student_id, name)
                 
                 # Create folder for student photos
                 # Note: We replace slashes with dashes for the folder name to avoid OS issues
@@ -312,59 +558,36 @@ def register():
 def capture(student_id):
     return render_template('capture.html', student_id=student_id)
 
-def gen_frames(session_id=None):
-    global last_frame
-    if not camera.isOpened():
-        # Using CAP_DSHOW on Windows for significantly faster startup (0.5s vs 10s)
-        camera.open(0, cv2.CAP_DSHOW)
-        
-        # Optimize camera resolution for faster processing if needed
-        camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        camera.set(cv2.CAP_PROP_FPS, 30)
-        
-    frame_count = 0
-    last_results = []
-    
-    while camera.isOpened():
-        start_time = time.time()
-        success, frame = camera.read()
-        if not success:
-            break
-        
-        last_frame = frame.copy()
-        
-        # Optimization: Detect frequently for students (every frame) but skip for admin (every 2nd) to save CPU
-        should_detect = (session_id is not None) or (frame_count % 2 == 0)
-        
-        if should_detect:
-            # Use a slightly more relaxed threshold (50) for attendance recognition to speed it up,
-            # but keep it strict enough to avoid mixing.
-            current_threshold = 48 if session_id else 45
-            last_results = face_engine.detect_and_recognize(frame, strict_threshold=current_threshold)
-        
-        frame_count += 1
-        
-        # Draw results (even on skipped frames for smooth UI)
-        for res in last_results:
-            x, y, w, h = res['box']
-            cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-            cv2.putText(frame, res['student_id'], (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (36,255,12), 2)
-            
-            # Auto-mark attendance if recognized AND session_id is provided
-            if res['student_id'] != "Unknown" and session_id:
-                mark_attendance(res['student_id'], session_id)
-
-        # Optimize encoding: Use lower JPEG quality (70) for faster streaming
-        ret, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 70])
-        frame = buffer.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-        
-        # Throttle FPS to ~15 to reduce CPU load
-        elapsed_time = time.time() - start_time
-        sleep_time = max(0, (1.0 / 15.0) - elapsed_time)
-        time.sleep(sleep_time)
+def gen_frames(session_id=None, camera_name='default'):
+    stream = capture_service.open(camera_name)
+    if stream is None:
+        return
+    threshold = SESSION_THRESHOLD if session_id else ADMIN_THRESHOLD
+    if session_id:
+        attendance_writer.open_session(session_id)
+    encoder = stream.attach('session' if session_id else 'admin')
+    last_seq = 0
+    marked_seq = 0
+
+    try:
+        while stream.source.running:
+            encoded = encoder.wait(last_seq)
+            if encoded is None:
+                continue
+            last_seq = encoded.seq
+
+            # Auto-mark attendance if recognized AND session_id is provided (once per analysed frame)
+            analysis = stream.pool.analysis
+            if session_id and analysis.seq != marked_seq:
+                for res in analysis.results:
+                    if res['student_id'] != "Unknown" and res['confidence_raw'] < threshold:
+                        mark_attendance(res['student_id'], session_id)
+                marked_seq = analysis.seq
+
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + encoded.jpeg + b'\r\n')
+    finally:
+        stream.detach(encoder)
 
 @app.route('/video_feed')
 def video_feed():
@@ -378,91 +601,182 @@ def video_feed():
         if s:
             session_id = s['id']
             
-    return Response(gen_frames(session_id), mimetype='multipart/x-mixed-replace; boundary=frame')
-
-last_recognition_status = None # {'name': '...', 'status': '...'}
-
-def mark_attendance(student_id, session_id):
-    global last_recognition_status
-    # Map folder-safe ID back to real ID if necessary
-    
-    # Quick check in cache first
-    actual_id = student_id
-    student_name = student_name_cache.get(student_id)
+    camera_name = request.args.get('camera', 'default')
+    return Response(gen_frames(session_id, camera_name), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+# Recognition events per attendance session, pushed to /events subscribers
+event_bus = EventBus()
+SSE_KEEPALIVE = 15 # Seconds between keep-alive comments on an idle stream
+last_notified = {} # {(student_id, session_id): time of the last 'already_marked' event}
+
+def end_sessions(session_ids):
+    # Per-session state kept in memory while a session is active, released when it is closed
+    ended = set(session_ids)
+    if not ended:
+        return
+    for session_id in ended:
+        event_bus.close(session_id)
+        attendance_writer.close_session(session_id)
+    for key in [key for key in list(last_notified) if key[1] in ended]:
+        last_notified.pop(key, None)
+
+def mark_attendance(student_id, session_id, wait=None):
+    # In-memory only: the row itself is written by attendance_writer's thread. Returns
+    # (name, 'marked' | 'already_marked'), or None for an unregistered ID; with wait (seconds) a new
+    # mark is reported only once the database has settled it (see AttendanceWriter.mark)
+    result = attendance_writer.mark(student_id, session_id, wait)
+    if metrics_hooks is not None:
+        metrics_hooks.inc('facereg_attendance_marks_total', status=result[1] if result else 'unregistered')
+    if result is None:
+        return
+    student_name, status = result
     
+    current_time = time.time()
+    key = (student_id, session_id)
+    if status == 'marked':
+        event_bus.publish(session_id, 'recognition', {'name': student_name, 'status': 'marked'})
+        last_notified[key] = current_time
+    # Already marked: notify the student, but at most every 2 seconds to avoid spam
+    elif current_time - last_notified.get(key, 0) > 2:
+        event_bus.publish(session_id, 'recognition', {'name': student_name, 'status': 'already_marked'})
+        last_notified[key] = current_time
+    return result
+
+@app.route('/events')
+def events():
+    # Server-Sent Events for one attendance session: ?token=<session token> for the student page,
+    # or the lecturer's active session when logged in. Reconnects resume from Last-Event-ID.
+    # Events are per process: with FACEREG_SHARED_MODEL only this worker's marks arrive here.
     conn = get_db_connection()
-    if not student_name:
-        # Search DB and update cache
-        actual_student = conn.execute('''
-            SELECT student_id, name FROM students 
-            WHERE student_id = ? OR REPLACE(student_id, '/', '-') = ?
-        ''', (student_id, student_id)).fetchone()
-        
-        if not actual_student:
-            conn.close()
-            return
-            
-        actual_id = actual_student['student_id']
-        student_name = actual_student['name']
-        student_name_cache[student_id] = student_name
-        student_name_cache[actual_id] = student_name
+    token = request.args.get('token')
+    if token:
+        row = conn.execute('SELECT id FROM sessions WHERE session_token = ? AND is_active = 1', (token,)).fetchone()
+    elif session.get('logged_in'):
+        row = conn.execute('SELECT id FROM sessions WHERE lecturer_id = ? AND is_active = 1', (session['lecturer_id'],)).fetchone()
     else:
-        # If cache hit, we still need actual_id for the INSERT
-        actual_student = conn.execute('''
-            SELECT student_id FROM students 
-            WHERE student_id = ? OR REPLACE(student_id, '/', '-') = ?
-        ''', (student_id, student_id)).fetchone()
-        if actual_student:
-            actual_id = actual_student['student_id']
-        else:
-            conn.close()
-            return
-
-    student_id = actual_id
+        row = None
+    conn.close()
+    if not row:
+        # 204 tells EventSource not to reconnect
+        return Response(status=204)
 
-    # Cooldown logic (Per Session)
-    current_time = time.time()
-    cooldown_key = f"{student_id}_{session_id}"
-    if not hasattr(mark_attendance, 'cooldowns'):
-        mark_attendance.cooldowns = {}
-        
-    if cooldown_key in mark_attendance.cooldowns:
-        # If recognized again within 10 seconds, notify that they are already marked
-        # BUT only if they haven't been notified in the last 2 seconds to avoid spam
-        if current_time - mark_attendance.cooldowns[cooldown_key] < 10: 
-            if current_time - getattr(mark_attendance, 'last_notify', 0) > 2:
-                last_recognition_status = {'name': student_name, 'status': 'already_marked'}
-                mark_attendance.last_notify = current_time
-            conn.close()
-            return
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    subscriber = event_bus.subscribe(row['id'], last_event_id)
 
-    # Check if already marked in THIS session
-    exists = conn.execute('SELECT id FROM attendance WHERE student_id = ? AND session_id = ?', (student_id, session_id)).fetchone()
-    
-    if not exists:
+    def stream():
         try:
-            conn.execute('INSERT INTO attendance (student_id, session_id, date, time, status) VALUES (?, ?, date("now"), time("now"), "Present")', (student_id, session_id))
-            conn.commit()
-            last_recognition_status = {'name': student_name, 'status': 'marked'}
-            print(f"Attendance recorded: {student_id}")
-            mark_attendance.last_notify = current_time
-        except sqlite3.Error as e:
-            print(f"DB Error marking attendance: {e}")
-    else:
-        # If already marked, notify the student
-        last_recognition_status = {'name': student_name, 'status': 'already_marked'}
-        mark_attendance.last_notify = current_time
-        print(f"Student {student_id} already marked.")
-    
-    mark_attendance.cooldowns[cooldown_key] = current_time
+            yield "retry: 3000\n\n"
+            while True:
+                events = subscriber.get(SSE_KEEPALIVE)
+                if not events:
+                    # Also how a closed connection is noticed: the write fails and the generator exits
+                    yield ": keep-alive\n\n"
+                for event in events:
+                    yield format_sse(event)
+        finally:
+            event_bus.unsubscribe(subscriber)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Frames uploaded by students' own browsers (/api/recognize). Work beyond UPLOAD_MAX_PENDING
+# queued/running jobs is refused with 429 so phones back off instead of timing out.
+UPLOAD_WORKERS = 2
+UPLOAD_MAX_PENDING = 16
+UPLOAD_MAX_FRAMES = 4 # Frames per request
+UPLOAD_MAX_BYTES = 4 * 1024 * 1024
+# Enforced by Werkzeug on every request body (nothing else the app accepts comes close to it). A
+# chunked body, which has no Content-Length, is not refused but cut off at the limit: see api_recognize
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_BYTES
+UPLOAD_TIMEOUT = 10 # Seconds a request waits for its result
+UPLOAD_MARK_WAIT = 3 # Seconds a new mark waits to be written, so the phone shows what was stored
+recognition_pool = RecognitionPool(UPLOAD_WORKERS, UPLOAD_MAX_PENDING)
+atexit.register(recognition_pool.shutdown)
+
+def recognize_upload(frames, session_id):
+    # Runs on a recognition_pool worker: decode, detect (all frames in one detector call), recognise, mark
+    images = [decode_frame(data) for data in frames]
+    decoded = [image for image in images if image is not None]
+    detections = iter(face_engine.detect_faces_batch(decoded))
+    snapshot = face_engine.snapshot
+    results = []
+    for image in images:
+        if image is None:
+            results.append({'error': 'undecodable image', 'faces': []})
+            continue
+        faces = []
+        for res in face_engine.recognize_faces(image, next(detections), SESSION_THRESHOLD, snapshot):
+            face = {
+                'box': [int(v) for v in res['box']],
+                'student_id': res['student_id'],
+                'confidence': res['confidence']
+            }
+            if res['student_id'] != "Unknown":
+                # The uploading page shows its own result from this, not from the session's /events
+                marked = mark_attendance(res['student_id'], session_id, UPLOAD_MARK_WAIT)
+                if marked is not None:
+                    face['name'], face['attendance'] = marked
+            faces.append(face)
+        results.append({'faces': faces})
+    return results
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"status": "error", "message": "Upload too large"}), 413
+
+@app.route('/api/recognize', methods=['POST'])
+def api_recognize():
+    # Recognises JPEG/WebP frames posted by a student's browser for an attendance session.
+    # Either a raw image body (Content-Type image/jpeg or image/webp) or multipart "frame" fields
+    # (up to UPLOAD_MAX_FRAMES). The session token comes from ?token=, a "token" form field or
+    # the X-Session-Token header. Attendance events also go out on /events.
+    if request.content_length and request.content_length > UPLOAD_MAX_BYTES:
+        return jsonify({"status": "error", "message": "Upload too large"}), 413
+    token = request.args.get('token') or request.form.get('token') or request.headers.get('X-Session-Token')
+    if not token:
+        return jsonify({"status": "error", "message": "Missing session token"}), 400
+    conn = get_db_connection()
+    row = conn.execute('SELECT id FROM sessions WHERE session_token = ? AND is_active = 1', (token,)).fetchone()
     conn.close()
+    if not row:
+        return jsonify({"status": "error", "message": "Invalid or expired session"}), 404
+    # Load the session's existing marks, e.g. after a restart, before this upload's can be checked
+    attendance_writer.open_session(row['id'])
+
+    if request.mimetype in ('image/jpeg', 'image/webp'):
+        body = request.get_data(cache=False)
+        if len(body) >= UPLOAD_MAX_BYTES:
+            # Cut off at MAX_CONTENT_LENGTH, so the image is incomplete
+            return jsonify({"status": "error", "message": "Upload too large"}), 413
+        frames = [body]
+    else:
+        frames = [f.read() for f in request.files.getlist('frame')[:UPLOAD_MAX_FRAMES]]
+    if not frames or not any(frames):
+        return jsonify({"status": "error", "message": "No frame uploaded"}), 400
+
+    future = recognition_pool.submit(recognize_upload, frames, row['id'])
+    if future is None:
+        response = jsonify({"status": "busy", "message": "Recognition queue is full, retry shortly"})
+        response.headers['Retry-After'] = '1'
+        return response, 429
+    try:
+        results = future.result(timeout=UPLOAD_TIMEOUT)
+    except Exception as e:
+        # Timed out (the job still finishes and marks attendance) or failed
+        print(f"Upload recognition failed: {e!r}")
+        return jsonify({"status": "error", "message": "Recognition did not complete"}), 503
+    return jsonify({"status": "success", "frames": results})
 
 @app.route('/save_frame', methods=['POST'])
 def save_frame():
-    global last_frame
     data = request.json
     student_id = data.get('student_id')
     count = data.get('count')
+    last_frame = capture_service.latest_frame(data.get('camera', 'default'))
     
     if last_frame is not None:
         # RECOGNITION CHECK: Prevent re-registering an already known face
@@ -487,15 +801,11 @@ def save_frame():
                         "message": f"Security Alert: This face is already registered under Student ID: {res['student_id']}."
                     }), 400
 
-        # Optimization: Use a higher quality face detection for the final save
+        # Save the largest face found above: enrolment crops come from the same detector as the
+        # crops recognition later compares them with
         gray_frame = cv2.cvtColor(last_frame, cv2.COLOR_BGR2GRAY)
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray_frame, 1.1, 10, minSize=(100, 100))
-        
-        save_img = gray_frame
-        if len(faces) > 0:
-            (x, y, w, h) = faces[0]
-            save_img = gray_frame[y:y+h, x:x+w]
+        (x, y, w, h) = max((res['box'] for res in results), key=lambda box: box[2] * box[3])
+        save_img = gray_frame[y:y+h, x:x+w]
         
         save_img = cv2.resize(save_img, (200, 200))
 
@@ -509,9 +819,28 @@ def save_frame():
 
 @app.route('/train')
 def train_model():
-    # Synchronous training for registration to ensure data is immediately ready
-    success = face_engine.train()
-    return jsonify({"status": "training_started" if success else "error"})
+    # Queue training in the background; the client polls /train/status/<job>.
+    # With a student_id only that student is enrolled; otherwise reconcile with uploads/.
+    student_id = request.args.get('student_id')
+    if student_id:
+        # Only registered students: the ID becomes a folder name under uploads/ and models/
+        conn = get_db_connection()
+        registered = conn.execute('SELECT 1 FROM students WHERE student_id = ?', (student_id,)).fetchone()
+        conn.close()
+        folder_name = student_id.replace('/', '-')
+        if not registered or not is_student_folder(folder_name):
+            return jsonify({"status": "error", "message": "Unknown student"}), 404
+        job_id = trainer.submit('enroll', folder_name)
+    else:
+        job_id = trainer.submit('sync')
+    return jsonify({"status": "training_started", "job": job_id})
+
+@app.route('/train/status/<job_id>')
+def train_status(job_id):
+    job = trainer.status(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown training job"}), 404
+    return jsonify(job)
 
 import shutil
 
@@ -522,6 +851,7 @@ def delete_attendance_record(record_id):
     conn.execute('DELETE FROM attendance WHERE id = ?', (record_id,))
     conn.commit()
     conn.close()
+    attendance_writer.forget_sessions()
     return redirect(url_for('view_attendance'))
 
 @app.route('/reset_system', methods=['POST'])
@@ -532,6 +862,7 @@ def reset_system():
         conn.execute('DELETE FROM attendance')
         conn.execute('DELETE FROM students')
         conn.commit()
+        attendance_writer.clear()
         
         # 2. Clear Uploaded Images
         folder = 'uploads'
@@ -545,9 +876,8 @@ def reset_system():
             except Exception as e:
                 print('Failed to delete %s. Reason: %s' % (file_path, e))
         
-        # 3. Reload/Reset the Face Engine
-        face_engine.trained = False
-        face_engine.label_map = {}
+        # 3. Reset the Face Engine (training on the now-empty uploads/ clears the model)
+        trainer.submit('train')
         
         return jsonify({"status": "success", "message": "System has been completely reset. All students and records deleted."})
     except Exception as e:
@@ -566,6 +896,7 @@ def delete_all_records():
             WHERE session_id IN (SELECT id FROM sessions WHERE lecturer_id = ?)
         ''', (lecturer_id,))
         conn.commit()
+        attendance_writer.forget_sessions()
     except sqlite3.Error:
         pass
     finally:
@@ -574,16 +905,97 @@ def delete_all_records():
 
 @app.route('/stop_camera')
 def stop_camera():
-    if camera.isOpened():
-        camera.release()
+    capture_service.stop(request.args.get('camera', 'default'))
     return jsonify({"status": "camera off"})
 
-@app.route('/get_last_recognition')
-def get_last_recognition():
-    global last_recognition_status
-    status = last_recognition_status
-    last_recognition_status = None # Clear after fetching
-    return jsonify(status if status else {})
+@app.route('/ready')
+def ready():
+    # Readiness probe: 200 once the model is loaded and warmed up, 503 before
+    if not startup['ready'].is_set():
+        response = jsonify({"status": "starting", "uptime": round(time.time() - startup['started'], 3)})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    return jsonify({"status": "ready", "model_version": face_engine.snapshot.version,
+                    "students": len(face_engine.label_map), "warm_up_s": startup['warm_up_s'],
+                    "synced_on_start": startup['synced']})
+
+@app.route('/model/stats')
+@login_required
+def model_stats():
+    # Model version in this worker, and with FACEREG_SHARED_MODEL its role and generation
+    snapshot = face_engine.snapshot
+    stats = {'pid': os.getpid(), 'version': snapshot.version, 'trained': snapshot.trained,
+             'students': len(snapshot.label_map), 'shared': SHARED_MODEL}
+    if SHARED_MODEL:
+        stats.update(trainer.stats())
+    return jsonify(stats)
+
+@app.route('/pipeline/stats')
+@login_required
+def pipeline_stats():
+    # Queue depth, drops and per-stage frame counts for every open camera
+    stats = capture_service.stats()
+    for name, camera in stats.items():
+        if name in trackers:
+            camera['tracking'] = trackers[name].stats()
+    return jsonify(stats)
+
+def collect_pipeline_metrics():
+    # Scrape-time view of counters and queue depths the pipeline already keeps
+    captured, analyzed, dropped, discarded, depth, busy = [], [], [], [], [], []
+    encoded, skipped, viewers = [], [], []
+    for name, camera in capture_service.stats().items():
+        labels = {'camera': name}
+        analysis = camera['analysis']
+        captured.append((labels, camera['frames_captured']))
+        analyzed.append((labels, analysis['frames_analyzed']))
+        dropped.append((labels, analysis['frames_dropped']))
+        discarded.append((labels, analysis['results_discarded']))
+        depth.append((labels, analysis['queue_depth']))
+        busy.append((labels, analysis['busy_workers']))
+        for view, stats in camera['views'].items():
+            view_labels = {'camera': name, 'view': view}
+            encoded.append((view_labels, stats['frames_encoded']))
+            skipped.append((view_labels, stats['frames_skipped']))
+            viewers.append((view_labels, stats['viewers']))
+    uploads = recognition_pool.stats()
+    snapshot = face_engine.snapshot
+    shared = trainer.stats() if SHARED_MODEL else {}
+    return [
+        ('facereg_frames_captured_total', 'counter', "Frames read from each camera", captured),
+        ('facereg_frames_analyzed_total', 'counter', "Frames whose analysis was published", analyzed),
+        ('facereg_frames_dropped_total', 'counter', "Queued frames replaced by a newer one before analysis", dropped),
+        ('facereg_results_discarded_total', 'counter', "Analyses finished after a newer frame's", discarded),
+        ('facereg_analysis_queue_depth', 'gauge', "Frames waiting for a recognition worker", depth),
+        ('facereg_analysis_busy_workers', 'gauge', "Recognition workers currently analysing a frame", busy),
+        ('facereg_frames_encoded_total', 'counter', "Stream frames JPEG-encoded per view", encoded),
+        ('facereg_frames_skipped_total', 'counter', "Captured frames never encoded for a view", skipped),
+        ('facereg_stream_viewers', 'gauge', "Open /video_feed connections per view", viewers),
+        ('facereg_upload_pending', 'gauge', "Uploaded frame jobs queued or running", [({}, uploads['pending'])]),
+        ('facereg_upload_completed_total', 'counter', "Uploaded frame jobs finished", [({}, uploads['completed'])]),
+        ('facereg_upload_rejected_total', 'counter', "Uploads refused with 429", [({}, uploads['rejected'])]),
+        ('facereg_recognition_batches_total', 'counter', "Batched recognition passes",
+         [({}, face_engine.batcher.batches if face_engine.batcher else None)]),
+        ('facereg_recognition_batcher_fallbacks_total', 'counter', "Recognitions scored directly after the batcher failed or timed out",
+         [({}, face_engine.batcher.fallbacks if face_engine.batcher else None)]),
+        ('facereg_attendance_pending_rows', 'gauge', "Attendance rows waiting for the next write", [({}, len(attendance_writer.pending))]),
+        ('facereg_event_subscribers', 'gauge', "Open /events streams", [({}, event_bus.stats()['subscribers'])]),
+        ('facereg_model_version', 'gauge', "Version of the published model snapshot", [({}, snapshot.version)]),
+        ('facereg_model_students', 'gauge', "Students in the published model", [({}, len(snapshot.label_map))]),
+        ('facereg_model_generation', 'gauge', "Shared model generation loaded by this worker",
+         [({'role': shared.get('role')}, shared.get('loaded_generation'))]),
+        ('facereg_model_reloads_total', 'counter', "Shared model generations picked up from the trainer",
+         [({}, shared.get('reloads'))]),
+    ]
+
+metrics.add_collector(collect_pipeline_metrics)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus text exposition; 404 unless FACEREG_METRICS is set
+    if not metrics.enabled:
+        return Response("Metrics are disabled\n", status=404, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 if __name__ == '__main__':
     app.run(debug=True)
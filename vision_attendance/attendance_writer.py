@@ -0,0 +1,280 @@
+import sqlite3
+import threading
+import time
+
+from database import connect
+
+# Seconds an ID that is not in the students table is remembered as such, so a recognised but
+# unregistered face costs one lookup per interval rather than one per frame
+ROSTER_MISS_TTL = 30
+
+class AttendanceWriter:
+    # Marks attendance from the video pipeline without touching the database there: students are
+    # resolved from an in-memory roster, duplicates are caught by an in-memory set per session,
+    # and new rows are written by one background thread in a single transaction every flush_ms.
+    # Until a session's existing rows are loaded, which open_session starts, the in-memory set
+    # cannot know who is already recorded: see mark() for what its result means in that window.
+    #
+    # With several server processes (FACEREG_SHARED_MODEL) each has its own writer. A student
+    # registered through another process is not in this roster yet, so a miss is looked up in the
+    # students table once; a student marked by two processes at once is written once, because the
+    # attendance table's unique (session_id, student_id) index makes the second insert a no-op
+    # (see database.unique_attendance for databases that still hold duplicates).
+    def __init__(self, db_path, flush_ms=250):
+        self.db_path = db_path
+        self.flush_interval = flush_ms / 1000.0
+        self.lock = threading.Condition()
+        self.roster = {} # {folder name or student_id: (student_id, name)}
+        self.misses = {} # {ID not found in the students table: monotonic time of the lookup}
+        self.marked = {} # {session_id: set of student_id}, loaded per session by the writer thread
+        self.to_load = set() # Sessions whose existing attendance has not been read yet
+        self.pending = [] # [(student_id, session_id, date, time)] waiting for the next flush
+        self.waits = {} # {(student_id, session_id): [outcome or None, waiting callers]} for mark(wait=...)
+        self.running = False
+        self.thread = None
+        self.rows_written = 0
+        self.batches = 0
+        self.metrics = None # Optional metrics.Metrics: write transaction times and rows
+        self._load_roster()
+
+    def _connect(self):
+        return connect(self.db_path)
+
+    def _load_roster(self):
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT student_id, name FROM students').fetchall()
+        finally:
+            conn.close()
+        with self.lock:
+            self.roster = {}
+            self.misses = {}
+            for student_id, name in rows:
+                self._add(student_id, name)
+
+    def _add(self, student_id, name):
+        # Recognition reports the folder-safe ID (uploads/<ID with / replaced by ->), so index both
+        self.roster[student_id] = (student_id, name)
+        self.roster[student_id.replace('/', '-')] = (student_id, name)
+
+    # Roster upkeep, called by the routes that change the students table
+    def add_student(self, student_id, name):
+        with self.lock:
+            self._add(student_id, name)
+            self.misses.pop(student_id, None)
+            self.misses.pop(student_id.replace('/', '-'), None)
+
+    def remove_student(self, student_id):
+        with self.lock:
+            self.roster.pop(student_id, None)
+            self.roster.pop(student_id.replace('/', '-'), None)
+            for row in self.pending:
+                if row[0] == student_id:
+                    self._settle(row[0], row[1], 'failed')
+            self.pending = [row for row in self.pending if row[0] != student_id]
+            for marked in self.marked.values():
+                marked.discard(student_id)
+
+    def clear(self):
+        # All students and attendance deleted
+        with self.lock:
+            self.roster = {}
+            self.misses = {}
+            for row in self.pending:
+                self._settle(row[0], row[1], 'failed')
+            self.pending = []
+            self.marked = {}
+            self.to_load = set()
+
+    def forget_sessions(self):
+        # Attendance rows were deleted directly; re-read each session's marks on next use
+        with self.lock:
+            self.marked = {}
+            self.to_load = set()
+
+    def close_session(self, session_id):
+        # The session ended: no more marks are expected for it, so its set is released. Rows
+        # already queued are still written.
+        with self.lock:
+            self.marked.pop(session_id, None)
+            self.to_load.discard(session_id)
+
+    def open_session(self, session_id):
+        # Loads the session's existing marks in the background, ideally before the first face shows up
+        with self.lock:
+            if session_id not in self.marked:
+                self.marked[session_id] = set()
+                self.to_load.add(session_id)
+                self.lock.notify_all()
+
+    def _lookup(self, student_id):
+        # Roster miss: registered through another process since the roster was loaded, or not at all
+        now = time.monotonic()
+        with self.lock:
+            looked_up = self.misses.get(student_id)
+            if looked_up is not None and now - looked_up < ROSTER_MISS_TTL:
+                return None
+            self.misses[student_id] = now
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT student_id, name FROM students WHERE student_id = ? OR replace(student_id, '/', '-') = ?",
+                                   (student_id, student_id)).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"DB Error looking up student {student_id}: {e}")
+            return None
+        if row is None:
+            return None
+        with self.lock:
+            self._add(row[0], row[1])
+            self.misses.pop(student_id, None)
+        return (row[0], row[1])
+
+    def mark(self, student_id, session_id, wait=None):
+        # Returns (name, 'marked' | 'already_marked'), or None for an ID that is not a registered student.
+        #
+        # Without wait it never blocks, and 'marked' means "queued": the row can still turn out to
+        # exist already, if the session's rows have not been loaded yet (call open_session first) or
+        # another process wrote it. With wait (seconds) a new mark blocks until it is settled and
+        # reports what the database found: 'marked' once written, 'already_marked' if the row was
+        # there, None if the write failed. After the wait runs out it returns 'marked' unconfirmed.
+        with self.lock:
+            student = self.roster.get(student_id)
+        if student is None:
+            student = self._lookup(student_id)
+            if student is None:
+                return None
+        with self.lock:
+            actual_id, name = student
+            marked = self.marked.get(session_id)
+            if marked is None:
+                marked = self.marked[session_id] = set()
+                self.to_load.add(session_id)
+            key = (actual_id, session_id)
+            if actual_id in marked:
+                if wait is None or key not in self.waits:
+                    return (name, 'already_marked')
+                # Same student again while their first mark is still unsettled: share its outcome
+            else:
+                marked.add(actual_id)
+                now = time.gmtime()
+                # UTC, like SQLite's date('now') / time('now') used previously
+                self.pending.append((actual_id, session_id, time.strftime('%Y-%m-%d', now), time.strftime('%H:%M:%S', now)))
+                self.lock.notify_all()
+                if wait is None:
+                    return (name, 'marked')
+                self.waits.setdefault(key, [None, 0])
+            entry = self.waits[key]
+            entry[1] += 1
+            self.lock.wait_for(lambda: entry[0] is not None, wait)
+            entry[1] -= 1
+            outcome = entry[0]
+            if outcome is not None and not entry[1]:
+                self.waits.pop(key, None)
+        if outcome == 'failed':
+            return None
+        return (name, outcome or 'marked')
+
+    def _settle(self, student_id, session_id, outcome):
+        # Called with the lock held once a queued mark is written, found present or dropped
+        entry = self.waits.get((student_id, session_id))
+        if entry is None:
+            return
+        if entry[1]:
+            entry[0] = outcome
+            self.lock.notify_all()
+        else:
+            del self.waits[(student_id, session_id)]
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name='attendance-writer', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.lock.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while True:
+                with self.lock:
+                    self.lock.wait_for(lambda: self.pending or self.to_load or not self.running)
+                    sessions = list(self.to_load)
+                # A newly opened session is loaded at once rather than after the flush window, which
+                # keeps short the time in which an unwaited mark() can report 'marked' for a student
+                # whose row already exists
+                self._load_sessions(conn, sessions)
+                with self.lock:
+                    if not self.pending and self.running:
+                        continue
+                    # Let marks arriving close together share one transaction: wait out the whole
+                    # window, since every mark() notifies; only stop() cuts it short
+                    deadline = time.monotonic() + self.flush_interval
+                    while self.running:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self.lock.wait(remaining)
+                    stopping = not self.running
+                    sessions = list(self.to_load)
+                self._load_sessions(conn, sessions)
+                self._flush(conn)
+                if stopping:
+                    return
+        finally:
+            conn.close()
+
+    def _load_sessions(self, conn, sessions):
+        for session_id in sessions:
+            existing = set(row[0] for row in conn.execute('SELECT student_id FROM attendance WHERE session_id = ?', (session_id,)))
+            with self.lock:
+                if session_id in self.to_load:
+                    self.to_load.discard(session_id)
+                    self.marked.setdefault(session_id, set()).update(existing)
+                # Marks queued before the load finished may already be in the table
+                for row in self.pending:
+                    if row[1] == session_id and row[0] in existing:
+                        self._settle(row[0], row[1], 'already_marked')
+                self.pending = [row for row in self.pending if row[1] != session_id or row[0] not in existing]
+
+    def _flush(self, conn):
+        with self.lock:
+            rows, self.pending = self.pending, []
+        if not rows:
+            return
+        try:
+            start = time.perf_counter()
+            with conn:
+                # Rows another server process has already written for the session are skipped; one
+                # statement per row (still one transaction) tells which ones
+                inserted = [conn.execute('INSERT OR IGNORE INTO attendance (student_id, session_id, date, time, status) '
+                                         'VALUES (?, ?, ?, ?, "Present")', row).rowcount for row in rows]
+            written = sum(inserted)
+            with self.lock:
+                for row, n in zip(rows, inserted):
+                    self._settle(row[0], row[1], 'marked' if n else 'already_marked')
+            self.rows_written += written
+            self.batches += 1
+            if self.metrics is not None:
+                self.metrics.observe('facereg_db_write_seconds', time.perf_counter() - start)
+                self.metrics.inc('facereg_db_rows_written_total', written)
+            for row, n in zip(rows, inserted):
+                print(f"Attendance recorded: {row[0]}" if n else f"Attendance already recorded: {row[0]}")
+        except sqlite3.Error as e:
+            print(f"DB Error marking attendance: {e}")
+            # Forget the failed marks so the students are recorded again the next time they are seen
+            with self.lock:
+                for student_id, session_id, _, _ in rows:
+                    if session_id in self.marked:
+                        self.marked[session_id].discard(student_id)
+                    self._settle(student_id, session_id, 'failed')
@@ -0,0 +1,85 @@
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from bench.common import make_gallery
+from bench.tracking import hall_frames
+
+# Allocation/timing harness for the per-frame path (detect_faces + recognize_faces on a synthetic
+# hall of enrolled faces). tracemalloc sees NumPy/OpenCV arrays, so "peak KiB" is the transient
+# memory one frame needs on top of what was already live. --baseline REV runs the same frames
+# against face_logic.py from an older git revision for a before/after comparison.
+
+
+def load_face_logic(rev):
+    if rev is None:
+        import face_logic
+        return face_logic
+    source = subprocess.check_output(['git', 'show', f'{rev}:vision_attendance/face_logic.py'])
+    path = os.path.join(tempfile.mkdtemp(), 'face_logic_baseline.py')
+    with open(path, 'wb') as f:
+        f.write(source)
+    spec = importlib.util.spec_from_file_location('face_logic_baseline', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(module, dataset, model_dir, frames, threshold):
+    engine = module.FaceRecognizer(dataset_path=dataset, model_dir=model_dir)
+    engine.train()
+    for frame, boxes, _ in frames[:3]:
+        # Warm-up: per-thread objects and scratch buffers are created on first use
+        engine.detect_faces(frame)
+        engine.recognize_faces(frame, boxes, threshold)
+
+    peaks, times = [], []
+    tracemalloc.start()
+    for frame, boxes, _ in frames[3:]:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        engine.detect_faces(frame)
+        engine.recognize_faces(frame, boxes, threshold)
+        times.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return np.mean(peaks) / 1024, np.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-frame allocations and time of detect + recognize")
+    parser.add_argument('--faces', type=int, default=20, help="enrolled faces in the synthetic hall")
+    parser.add_argument('--frames', type=int, default=13)
+    parser.add_argument('--threshold', type=float, default=48)
+    parser.add_argument('--baseline', help="git revision to compare against, e.g. HEAD~1")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        dataset = os.path.join(root, 'uploads')
+        bases = make_gallery(dataset, args.faces, 4)
+        frames = list(hall_frames(bases, args.frames, np.random.default_rng(1)))
+
+        runs = [('current', None)]
+        if args.baseline:
+            runs.insert(0, (args.baseline, args.baseline))
+        rows = []
+        for label, rev in runs:
+            module = load_face_logic(rev)
+            peak, ms = measure(module, dataset, os.path.join(root, f'models-{len(rows)}'), frames, args.threshold)
+            rows.append((label, peak, ms))
+
+    print(f"{'version':>10} {'peak KiB/frame':>15} {'ms/frame':>9}")
+    for label, peak, ms in rows:
+        print(f"{label:>10} {peak:>15.0f} {ms:>9.1f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
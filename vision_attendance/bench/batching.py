@@ -0,0 +1,93 @@
+import argparse
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from face_logic import LBPHMatcher, ModelSnapshot, RecognitionBatcher, prepare_face
+from bench.common import student_base, synthetic_face
+
+# Direct per-call recognition vs the micro-batching scheduler under synthetic load: --callers
+# threads (camera workers / upload requests) each keep submitting 1-3 face crops. Reports faces/s
+# and per-call p50/p99 latency for each (max_batch, max_wait_ms) setting.
+
+
+def build(students, images, rng):
+    matcher = LBPHMatcher()
+    bases = [student_base(rng) for _ in range(students)]
+    faces = [synthetic_face(rng, base) for base in bases for _ in range(images)]
+    matcher.train(faces, np.repeat(np.arange(students), images))
+    label_map = {n: f"STU-{n:05d}" for n in range(students)}
+    return ModelSnapshot(1, matcher, label_map, True), bases
+
+
+def crops(rng, bases, count):
+    # Live-like crops: a random student's face at a random detection size
+    out = []
+    for _ in range(count):
+        size = int(rng.integers(80, 160))
+        out.append(cv2.resize(synthetic_face(rng, bases[rng.integers(len(bases))]), (size, size)))
+    return out
+
+
+def caller(recognize, bases, seed, deadline, latencies, faces):
+    rng = np.random.default_rng(seed)
+    pool = [crops(rng, bases, int(rng.integers(1, 4))) for _ in range(20)]
+    n = 0
+    while time.time() < deadline:
+        rois = pool[n % len(pool)]
+        n += 1
+        start = time.perf_counter()
+        recognize(rois)
+        latencies.append(time.perf_counter() - start)
+        faces.append(len(rois))
+
+
+def run(recognize, bases, callers, duration):
+    latencies, faces = [], []
+    deadline = time.time() + duration
+    threads = [threading.Thread(target=caller, args=(recognize, bases, i, deadline, latencies, faces))
+               for i in range(callers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    ms = np.array(latencies) * 1000
+    return sum(faces) / duration, np.percentile(ms, 50), np.percentile(ms, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-batched vs per-call recognition")
+    parser.add_argument('--students', type=int, default=1000)
+    parser.add_argument('--images', type=int, default=5, help="gallery images per student")
+    parser.add_argument('--callers', type=int, default=8, help="concurrent callers")
+    parser.add_argument('--duration', type=float, default=3.0, help="seconds per setting")
+    parser.add_argument('--batches', default='8,32', help="comma separated max_batch values")
+    parser.add_argument('--waits', default='1,4,10', help="comma separated max_wait_ms values")
+    args = parser.parse_args()
+
+    snapshot, bases = build(args.students, args.images, np.random.default_rng(0))
+    local = threading.local()
+
+    def direct(rois):
+        clahe = getattr(local, 'clahe', None)
+        if clahe is None:
+            clahe = local.clahe = cv2.createCLAHE(clipLimit=1.5, tileGridSize=(8, 8))
+        return snapshot.recognizer.predict_batch([prepare_face(roi, clahe) for roi in rois])
+
+    print(f"{'mode':>18} {'faces/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    throughput, p50, p99 = run(direct, bases, args.callers, args.duration)
+    print(f"{'direct':>18} {throughput:>8.0f} {p50:>8.1f} {p99:>8.1f}")
+    for max_batch in [int(n) for n in args.batches.split(',')]:
+        for max_wait in [float(n) for n in args.waits.split(',')]:
+            batcher = RecognitionBatcher(max_batch, max_wait).start()
+            throughput, p50, p99 = run(lambda rois: batcher.submit(rois, snapshot).result(), bases,
+                                       args.callers, args.duration)
+            batcher.stop()
+            label = f"batch {max_batch}/{max_wait:g}ms"
+            print(f"{label:>18} {throughput:>8.0f} {p50:>8.1f} {p99:>8.1f}   (avg {batcher.faces / max(batcher.batches, 1):.1f} faces/batch)")
+
+
+if __name__ == '__main__':
+    main()
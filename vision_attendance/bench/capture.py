@@ -0,0 +1,90 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import cv2
+
+from camera_service import CaptureService
+from face_logic import FaceRecognizer
+from bench.common import make_video
+
+# Headless check of the capture pipeline: several viewers on one video-file source. Detection must
+# run at most once per analysed frame and JPEG encoding once per streamed frame, no matter how many
+# viewers there are; a slow detector must lower the analysis rate, not the stream rate. With 0
+# viewers neither detection nor encoding should run at all.
+
+
+def annotate(image, results):
+    for res in results:
+        x, y, w, h = res['box']
+        cv2.rectangle(image, (x, y), (x+w, y+h), (0, 255, 0), 2)
+
+
+def viewer(stream, duration, counts, index):
+    encoder = stream.attach('view')
+    last_seq = 0
+    deadline = time.time() + duration
+    try:
+        while time.time() < deadline and encoder.source.running:
+            encoded = encoder.wait(last_seq)
+            if encoded is None:
+                continue
+            last_seq = encoded.seq
+            counts[index] += 1
+    finally:
+        stream.detach(encoder)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-viewer capture pipeline check on a video file")
+    parser.add_argument('--video', help="video file to replay (a synthetic clip is generated if omitted)")
+    parser.add_argument('--viewers', default='0,1,4,16', help="comma separated viewer counts")
+    parser.add_argument('--workers', default='1,2', help="comma separated recognition worker counts")
+    parser.add_argument('--duration', type=float, default=3.0, help="seconds per run")
+    parser.add_argument('--analysis-fps', type=float, default=10)
+    parser.add_argument('--stream-fps', type=float, default=15)
+    parser.add_argument('--detect-delay', type=float, default=0.0,
+                        help="extra seconds per detection call, to simulate a slower machine")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        video = args.video or make_video(os.path.join(root, 'clip.avi'))
+        engine = FaceRecognizer(model_dir=os.path.join(root, 'models'))
+        calls = [0]
+
+        def detect(image, seq):
+            calls[0] += 1
+            if args.detect_delay:
+                time.sleep(args.detect_delay)
+            return engine.detect_and_recognize(image)
+
+        print(f"{'workers':>8} {'viewers':>8} {'captured':>9} {'analysed':>9} {'dropped':>8} "
+              f"{'discarded':>10} {'detect calls':>13} {'encoded':>8} {'stream fps':>11}")
+        for workers in [int(n) for n in args.workers.split(',')]:
+            for viewers in [int(n) for n in args.viewers.split(',')]:
+                calls[0] = 0
+                service = CaptureService({'clip': video}, lambda name: detect, {'view': annotate}, workers=workers,
+                                         analysis_fps=args.analysis_fps, stream_fps=args.stream_fps)
+                stream = service.open('clip')
+                encoder = stream.encoder('view')
+                counts = [0] * viewers
+                threads = [threading.Thread(target=viewer, args=(stream, args.duration, counts, i))
+                           for i in range(viewers)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                if not viewers:
+                    time.sleep(args.duration)
+                service.stop_all()
+                stats = stream.pool.stats()
+                stream_fps = sum(counts) / viewers / args.duration if viewers else 0
+                print(f"{workers:>8} {viewers:>8} {stream.source.seq:>9} {stats['frames_analyzed']:>9} "
+                      f"{stats['frames_dropped']:>8} {stats['results_discarded']:>10} {calls[0]:>13} "
+                      f"{encoder.frames_encoded:>8} {stream_fps:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+# Shared helpers for the benchmark scripts. Run them from vision_attendance/, e.g.
+#   python -m bench.enrollment --sizes 100,1000
+
+
+def synthetic_face(rng, base):
+    # One "capture" of a synthetic student: their base texture, slightly shifted, re-lit and noisy
+    dx, dy = rng.integers(-4, 5, size=2)
+    img = np.roll(base, (dy, dx), axis=(0, 1)).astype(np.float32)
+    img = img * rng.uniform(0.8, 1.2) + rng.normal(0, 8, img.shape)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def student_base(rng):
+    # Low-frequency texture so LBPH histograms differ between students but stay stable per student
+    coarse = rng.integers(0, 256, size=(25, 25)).astype(np.uint8)
+    return cv2.resize(coarse, (200, 200), interpolation=cv2.INTER_CUBIC)
+
+
+def synthetic_portrait(rng, size):
+    # A drawn frontal face (head, brows, eyes, nose, mouth) the Haar cascade detects at any size,
+    # with per-call shading so detections are not all identical
+    s = size / 200.0
+    img = np.full((size, size), int(rng.integers(70, 110)), np.uint8)
+    skin = int(rng.integers(160, 210))
+    cv2.ellipse(img, (size // 2, int(105 * s)), (int(70 * s), int(92 * s)), 0, 0, 360, skin, -1)
+    for cx in (70, 130):
+        cv2.ellipse(img, (int(cx * s), int(72 * s)), (int(20 * s), int(6 * s)), 0, 180, 360, skin - 125, -1)
+        cv2.ellipse(img, (int(cx * s), int(90 * s)), (int(15 * s), int(8 * s)), 0, 0, 360, skin - 135, -1)
+    cv2.ellipse(img, (size // 2, int(120 * s)), (int(8 * s), int(18 * s)), 0, 0, 360, skin - 35, -1)
+    cv2.ellipse(img, (size // 2, int(150 * s)), (int(25 * s), int(7 * s)), 0, 0, 360, skin - 115, -1)
+    return cv2.GaussianBlur(img, (0, 0), 3 * s)
+
+
+def make_student(dataset_path, student_dir, images, rng):
+    student_path = os.path.join(dataset_path, student_dir)
+    os.makedirs(student_path, exist_ok=True)
+    base = student_base(rng)
+    for i in range(images):
+        cv2.imwrite(os.path.join(student_path, f"{i}.jpg"), synthetic_face(rng, base))
+    return base
+
+
+def make_gallery(dataset_path, students, images, seed=0):
+    # Builds uploads/-style folders: <dataset_path>/STU-00000/0.jpg ...
+    rng = np.random.default_rng(seed)
+    bases = {}
+    for n in range(students):
+        student_dir = f"STU-{n:05d}"
+        bases[student_dir] = make_student(dataset_path, student_dir, images, rng)
+    return bases
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def latency_summary(seconds, items=None):
+    # count, throughput and p50/p95/p99 (ms) of per-call timings; items = units processed per call
+    # (faces, rows...) when throughput should be counted in those rather than in calls
+    ms = np.array(seconds, dtype=np.float64) * 1000
+    total = float(ms.sum()) / 1000
+    processed = sum(items) if items is not None else len(ms)
+    if not len(ms):
+        return {'count': 0, 'items': 0}
+    return {
+        'count': len(ms),
+        'items': int(processed),
+        'total_s': round(total, 4),
+        'per_s': round(processed / total, 2) if total > 0 and processed else None,
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'max_ms': round(float(ms.max()), 3)
+    }
+
+
+def rss_mb():
+    # (current, peak) resident set size of this process in MiB; None where the OS does not report it
+    current = peak = None
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # ru_maxrss is in bytes on macOS and KiB on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+    except ImportError:
+        pass
+    return (round(current, 1) if current is not None else None, round(peak, 1) if peak is not None else None)
+
+
+def make_video(path, frames=150, fps=30, size=(640, 480), seed=0):
+    # Synthetic clip for headless capture tests: a few moving textured patches on a noisy background
+    rng = np.random.default_rng(seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    patches = [cv2.cvtColor(student_base(rng), cv2.COLOR_GRAY2BGR) for _ in range(3)]
+    for i in range(frames):
+        frame = rng.integers(0, 40, size=(size[1], size[0], 3), dtype=np.uint8)
+        for n, patch in enumerate(patches):
+            x = (40 + n * 200 + i * 2) % (size[0] - 200)
+            frame[100:300, x:x + 200] = patch
+        writer.write(frame)
+    writer.release()
+    return path
@@ -0,0 +1,133 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from database import init_db, ConnectionPool
+
+# Attendance load: --students threads mark attendance at once (lookup, duplicate check, INSERT,
+# commit, as the per-request routes do) while --lecturers threads page through /attendance-style
+# joins. Compares a fresh default connection per operation with the pooled, WAL-tuned layer and
+# reports p50/p99 latency per operation type.
+
+PAGE_QUERY = '''
+    SELECT a.*, s.name, sess.session_token
+    FROM attendance a
+    JOIN students s ON a.student_id = s.student_id
+    JOIN sessions sess ON a.session_id = sess.id
+    WHERE sess.lecturer_id = ?
+    ORDER BY a.date DESC, a.time DESC
+    LIMIT 50 OFFSET ?
+'''
+
+
+def seed(path, students, history, lecturers):
+    init_db(path)
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO students (name, student_id) VALUES (?, ?)',
+                     [(f"Student {n}", f"STU/{n:05d}") for n in range(students)])
+    conn.executemany('INSERT INTO sessions (lecturer_id, session_token, is_active) VALUES (?, ?, 0)',
+                     [(f"L{n % lecturers}", f"old-{n}") for n in range(history)])
+    conn.executemany('INSERT INTO attendance (student_id, session_id, date, time) VALUES (?, ?, ?, ?)',
+                     [(f"STU/{n % students:05d}", n // students + 1, f"2026-{1 + n % 12:02d}-{1 + n % 28:02d}", f"{n % 24:02d}:00:00")
+                      for n in range(history * 20)])
+    conn.execute("INSERT INTO sessions (lecturer_id, session_token) VALUES ('L0', 'live')")
+    live = conn.execute("SELECT id FROM sessions WHERE session_token = 'live'").fetchone()[0]
+    conn.commit()
+    conn.close()
+    return live
+
+
+def fresh_connection(path):
+    def get():
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        return conn
+    return get
+
+
+def mark(get, student_id, session_id, latencies):
+    start = time.perf_counter()
+    conn = get()
+    try:
+        conn.execute('SELECT student_id, name FROM students WHERE student_id = ?', (student_id,)).fetchone()
+        exists = conn.execute('SELECT id FROM attendance WHERE student_id = ? AND session_id = ?', (student_id, session_id)).fetchone()
+        if not exists:
+            conn.execute('INSERT INTO attendance (student_id, session_id, date, time, status) VALUES (?, ?, date("now"), time("now"), "Present")', (student_id, session_id))
+            conn.commit()
+    except sqlite3.Error as e:
+        latencies.append(None)
+        print(f"mark failed: {e}")
+        return
+    finally:
+        conn.close()
+    latencies.append(time.perf_counter() - start)
+
+
+def lecturer(get, lecturer_id, pages, latencies):
+    for page in range(pages):
+        start = time.perf_counter()
+        conn = get()
+        try:
+            conn.execute(PAGE_QUERY, (lecturer_id, page * 50)).fetchall()
+        finally:
+            conn.close()
+        latencies.append(time.perf_counter() - start)
+
+
+def run(get, students, session_id, lecturers, pages):
+    marks, reads = [], []
+    threads = [threading.Thread(target=lecturer, args=(get, f"L{n}", pages, reads)) for n in range(lecturers)]
+    threads += [threading.Thread(target=mark, args=(get, f"STU/{n:05d}", session_id, marks)) for n in range(students)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return marks, reads, time.perf_counter() - start
+
+
+def summary(latencies):
+    ok = [l for l in latencies if l is not None]
+    if not ok:
+        return "-", "-", len(latencies)
+    ms = np.array(ok) * 1000
+    return f"{np.percentile(ms, 50):.1f}", f"{np.percentile(ms, 99):.1f}", len(latencies) - len(ok)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent attendance marking while lecturers page records")
+    parser.add_argument('--students', type=int, default=200, help="students marking at once")
+    parser.add_argument('--lecturers', type=int, default=4, help="lecturers paging /attendance")
+    parser.add_argument('--pages', type=int, default=20, help="pages read per lecturer")
+    parser.add_argument('--history', type=int, default=500, help="past sessions (20 rows each)")
+    args = parser.parse_args()
+
+    print(f"{'mode':>8} {'mark p50':>9} {'mark p99':>9} {'page p50':>9} {'page p99':>9} {'errors':>7} {'wall s':>7}")
+    for mode in ('fresh', 'pooled'):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'attendance.db')
+            live = seed(path, args.students, args.history, args.lecturers)
+            if mode == 'fresh':
+                # Baseline: what the app did before, rollback journal and a new connection every time
+                conn = sqlite3.connect(path)
+                conn.execute('PRAGMA journal_mode = DELETE')
+                conn.close()
+                get, pool = fresh_connection(path), None
+            else:
+                pool = ConnectionPool(path)
+                get = pool.get
+            marks, reads, wall = run(get, args.students, live, args.lecturers, args.pages)
+            if pool is not None:
+                pool.close_all()
+            m50, m99, m_err = summary(marks)
+            r50, r99, r_err = summary(reads)
+            print(f"{mode:>8} {m50:>9} {m99:>9} {r50:>9} {r99:>9} {m_err + r_err:>7} {wall:>7.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from face_logic import DETECTION_PRESETS, DetectionParams, FaceRecognizer, FaceTracker, ScaleAdapter, box_iou, save_detection_preset
+from bench.common import synthetic_portrait
+
+# Offline tuner for the face cascade: sweeps detection width, scale factor, min neighbours and
+# minimum face size over a clip and reports recall, precision and detection time per frame, then
+# replays the best setting with and without the ScaleAdapter (narrowed size range, coarser factor
+# while tracking is stable). --save NAME stores the recommendation as a preset in
+# models/detection_presets.json, which app.py loads; assign it to a camera with FACEREG_DETECTION.
+#
+# Clips: --video recordings, scored against the detections of a --reference preset (so recall is
+# relative to that setting), or a synthetic --scene with known face boxes: 'hall' (rows of faces,
+# 26 px at the back to 64 px at the front, some coming and going) or 'kiosk' (one close face).
+#
+#   python -m bench.detect_tuning --scene hall
+#   python -m bench.detect_tuning --video hall.mp4 --reference default --save hall
+
+
+def scene_frames(scene, frames, rng, size=(640, 480), tilt=0):
+    # (frame, true boxes) of a synthetic scene; tilt rolls every other face by +-tilt degrees
+    if scene == 'hall':
+        people = []
+        for row, face in enumerate((26, 34, 46, 64)):
+            for col in range(7 - row):
+                x = 20 + col * (size[0] - 80) // (7 - row) + int(rng.integers(0, 20))
+                people.append((x, 30 + row * 105, face))
+    else:
+        people = [(220, 100, 220)]
+    portraits = [synthetic_portrait(rng, face) for _, _, face in people]
+    if tilt:
+        portraits = [cv2.warpAffine(p, cv2.getRotationMatrix2D((p.shape[1] / 2, p.shape[0] / 2), tilt if n % 2 else -tilt, 1.0),
+                                    p.shape[::-1], borderMode=cv2.BORDER_REPLICATE) for n, p in enumerate(portraits)]
+    for i in range(frames):
+        frame = rng.integers(0, 40, size=(size[1], size[0], 3), dtype=np.uint8)
+        boxes = []
+        for n, ((x, y, face), portrait) in enumerate(zip(people, portraits)):
+            # Every fourth person leaves for a while now and then, so new faces keep arriving
+            if n % 4 == 0 and (i + 13 * n) % 120 >= 100:
+                continue
+            x += int(6 * np.sin(i / 8.0 + n))
+            y += int(3 * np.cos(i / 11.0 + n))
+            frame[y:y + face, x:x + face] = portrait[:, :, None]
+            boxes.append((x, y, face, face))
+        yield frame, boxes
+
+
+def recorded_frames(paths, limit):
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise SystemExit(f"Cannot open video {path}")
+        read = 0
+        while read < limit:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            read += 1
+            yield frame
+        cap.release()
+
+
+def score(found, truth, iou=0.4):
+    # (true positives, false positives) of one frame, greedy one-to-one matching
+    unmatched = list(truth)
+    hits = 0
+    for box in found:
+        best = max(unmatched, key=lambda t: box_iou(box, t), default=None)
+        if best is not None and box_iou(box, best) >= iou:
+            unmatched.remove(best)
+            hits += 1
+    return hits, len(found) - hits
+
+
+def summarize(name, params, detections, truths, seconds):
+    hits = false = 0
+    for found, truth in zip(detections, truths):
+        h, f = score(found, truth)
+        hits += h
+        false += f
+    faces = sum(len(t) for t in truths)
+    found = hits + false
+    return {
+        'name': name,
+        'params': params._asdict(),
+        'recall': round(hits / float(faces), 4) if faces else None,
+        'precision': round(hits / float(found), 4) if found else None,
+        'ms_per_frame': round(float(np.mean(seconds)) * 1000, 2)
+    }
+
+
+def sweep(engine, frames, truths, grid):
+    rows = []
+    for params in grid:
+        detections, seconds = [], []
+        for frame in frames:
+            start = time.perf_counter()
+            detections.append(engine.detect_faces(frame, params=params))
+            seconds.append(time.perf_counter() - start)
+        rows.append(summarize('fixed', params, detections, truths, seconds))
+    return rows
+
+
+def replay(engine, frames, truths, params, adaptive):
+    # Frames in order through a FaceTracker, as a camera would run them (no motion gate)
+    scale = ScaleAdapter(params) if adaptive else None
+    tracker = FaceTracker(engine, detection=params, scale=scale)
+    detections, seconds = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        results = tracker.update(frame)
+        seconds.append(time.perf_counter() - start)
+        detections.append([r['box'] for r in results])
+    row = summarize('adaptive' if adaptive else 'fixed', params, detections, truths, seconds)
+    if scale is not None:
+        stats = scale.stats()
+        row['scale'] = {k: stats[k] for k in ('frames', 'explored', 'narrowed', 'coarse')}
+    return row
+
+
+def pareto(rows):
+    # Rows no other row beats on both recall and time
+    front = []
+    for row in rows:
+        if not any(o['recall'] >= row['recall'] and o['ms_per_frame'] < row['ms_per_frame']
+                   for o in rows if o is not row and o['recall'] is not None):
+            front.append(row)
+    return front
+
+
+def print_row(row, mark=''):
+    p = row['params']
+    recall = f"{row['recall']:.3f}" if row['recall'] is not None else '-'
+    precision = f"{row['precision']:.3f}" if row['precision'] is not None else '-'
+    print(f"{row['name']:>9} {p['target_width']:>6} {p['scale_factor']:>7} {p['min_neighbors']:>10} "
+          f"{p['min_size']:>5} {p['max_size']:>5} {recall:>7} {precision:>9} {row['ms_per_frame']:>9.2f} {mark}")
+
+
+def floats(value):
+    return [float(v) for v in value.split(',')]
+
+
+def ints(value):
+    return [int(v) for v in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep face cascade settings: recall vs detection time")
+    parser.add_argument('--video', action='append', default=[], help="recorded clip (repeatable)")
+    parser.add_argument('--scene', choices=('hall', 'kiosk'), default='hall', help="synthetic scene without --video")
+    parser.add_argument('--reference', default='default', help="preset whose detections are the truth for --video")
+    parser.add_argument('--frames', type=int, default=40)
+    parser.add_argument('--widths', type=ints, default=[320, 400, 480, 640])
+    parser.add_argument('--factors', type=floats, default=[1.05, 1.1, 1.15, 1.2])
+    parser.add_argument('--neighbors', type=ints, default=[6, 10])
+    parser.add_argument('--min-sizes', type=ints, default=[24, 40, 64])
+    parser.add_argument('--min-recall', type=float, default=0.95)
+    parser.add_argument('--min-precision', type=float, default=0.9)
+    parser.add_argument('--json', help="write all rows to this file")
+    parser.add_argument('--save', metavar='NAME', help="save the recommended setting as preset NAME")
+    parser.add_argument('--presets', default=os.path.join('models', 'detection_presets.json'))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        engine = FaceRecognizer(dataset_path=os.path.join(root, 'uploads'), model_dir=os.path.join(root, 'models'), lazy=True)
+        if args.video:
+            frames = list(recorded_frames(args.video, args.frames))
+            reference = DETECTION_PRESETS[args.reference]
+            truths = [engine.detect_faces(frame, params=reference) for frame in frames]
+            source = f"{len(frames)} frames of {', '.join(args.video)}, truth = preset '{args.reference}'"
+        else:
+            scene = list(scene_frames(args.scene, args.frames, np.random.default_rng(0)))
+            frames = [frame for frame, _ in scene]
+            truths = [boxes for _, boxes in scene]
+            source = f"{len(frames)} frames of the synthetic {args.scene}"
+        print(f"{source}, {sum(len(t) for t in truths)} faces")
+
+        grid = [DetectionParams(w, f, n, m) for w, f, n, m in
+                itertools.product(args.widths, args.factors, args.neighbors, args.min_sizes)]
+        engine.detect_faces(frames[0]) # Parse the cascade outside the timings
+        rows = sweep(engine, frames, truths, grid)
+        front = pareto(rows)
+
+        print(f"{'':>9} {'width':>6} {'factor':>7} {'neighbors':>10} {'min':>5} {'max':>5} {'recall':>7} "
+              f"{'precision':>9} {'ms/frame':>9}")
+        for row in sorted(rows, key=lambda r: r['ms_per_frame']):
+            print_row(row, '*' if row in front else '')
+        print("* = no faster setting has the same or better recall")
+
+        presets = [(name, row) for name, preset in DETECTION_PRESETS.items()
+                   for row in rows if row['params'] == preset._asdict()]
+        for name, row in presets:
+            print(f"preset '{name}': recall {row['recall']}, {row['ms_per_frame']:.2f} ms/frame")
+
+        good = [r for r in rows if (r['recall'] or 0) >= args.min_recall and (r['precision'] or 0) >= args.min_precision]
+        if not good:
+            print(f"No setting reaches recall {args.min_recall} at precision {args.min_precision}")
+            best = None
+        else:
+            best = min(good, key=lambda r: r['ms_per_frame'])
+            params = DetectionParams(**best['params'])
+            print(f"\nRecommended: {params}")
+            print("Replayed through the face tracker:")
+            replays = [replay(engine, frames, truths, params, adaptive) for adaptive in (False, True)]
+            for row in replays:
+                print_row(row)
+            if 'scale' in replays[1]:
+                print(f"scale adapter: {replays[1]['scale']}")
+            best['replay'] = replays
+            if args.save:
+                save_detection_preset(args.presets, args.save, params)
+                print(f"Saved as preset '{args.save}' in {args.presets}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'source': source, 'rows': rows, 'recommended': best}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
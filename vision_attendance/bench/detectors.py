@@ -0,0 +1,98 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from face_logic import DETECTION_PRESETS, FaceRecognizer, make_detector
+from bench.detect_tuning import recorded_frames, scene_frames, score
+
+# Face detector backends on the same clip: frames/s, faces/s and recall/precision of each, at one or
+# more batch sizes (frames per detector call, as detect_faces_batch does for uploads). Backends
+# whose model files are missing from --model-dir are skipped (see face_logic.DETECTOR_MODELS).
+#
+# Clips: --video recordings, scored against the --reference backend's detections, or a synthetic
+# --scene with known boxes; --tilt rolls every other face, which the frontal cascades miss.
+#
+#   python -m bench.detectors --scene hall --preset hall --tilt 20
+#   python -m bench.detectors --video lecture.mp4 --reference yunet --backends cascade,yunet,ssd --batch 1,4
+
+
+def run(engine, frames, truths, params, batch):
+    hits = false = found = 0
+    elapsed = 0.0
+    for start in range(0, len(frames), batch):
+        chunk = frames[start:start + batch]
+        began = time.perf_counter()
+        detections = engine.detect_faces_batch(chunk, params)
+        elapsed += time.perf_counter() - began
+        for boxes, truth in zip(detections, truths[start:start + batch]):
+            h, f = score(boxes, truth)
+            hits += h
+            false += f
+            found += len(boxes)
+    faces = sum(len(t) for t in truths)
+    return {
+        'fps': len(frames) / elapsed,
+        'faces_per_s': found / elapsed,
+        'ms_per_frame': elapsed / len(frames) * 1000,
+        'recall': hits / float(faces) if faces else None,
+        'precision': hits / float(found) if found else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face detector backends: throughput and recall on one clip")
+    parser.add_argument('--backends', default='cascade,haar,yunet,ssd')
+    parser.add_argument('--model-dir', default='models')
+    parser.add_argument('--threads', type=int, help="OpenCV threads (default: OpenCV's choice)")
+    parser.add_argument('--batch', default='1', help="comma separated frames per detector call")
+    parser.add_argument('--preset', default='default', help="DetectionParams preset (width, size range)")
+    parser.add_argument('--video', action='append', default=[], help="recorded clip (repeatable)")
+    parser.add_argument('--reference', default='cascade', help="backend whose detections are the truth for --video")
+    parser.add_argument('--scene', choices=('hall', 'kiosk'), default='hall')
+    parser.add_argument('--tilt', type=float, default=0, help="synthetic scene: degrees every other face is rolled")
+    parser.add_argument('--frames', type=int, default=30)
+    args = parser.parse_args()
+
+    params = DETECTION_PRESETS[args.preset]
+    batches = [int(n) for n in args.batch.split(',')]
+    engines = {}
+    with tempfile.TemporaryDirectory() as root:
+        for name in args.backends.split(','):
+            try:
+                detector = make_detector(name, args.model_dir, args.threads)
+                detector.load()
+            except (OSError, ValueError, RuntimeError) as e:
+                print(f"skipping {name}: {e}")
+                continue
+            engines[name] = FaceRecognizer(dataset_path=os.path.join(root, 'uploads'), model_dir=os.path.join(root, 'models'),
+                                           lazy=True, detector=detector)
+
+        if args.video:
+            frames = list(recorded_frames(args.video, args.frames))
+            if args.reference not in engines:
+                raise SystemExit(f"Reference backend {args.reference} is not available")
+            truths = engines[args.reference].detect_faces_batch(frames, params)
+            source = f"{len(frames)} frames of {', '.join(args.video)}, truth = {args.reference}"
+        else:
+            scene = list(scene_frames(args.scene, args.frames, np.random.default_rng(0), tilt=args.tilt))
+            frames = [frame for frame, _ in scene]
+            truths = [boxes for _, boxes in scene]
+            source = f"{len(frames)} frames of the synthetic {args.scene}, tilt {args.tilt:g} deg"
+        print(f"{source}, {sum(len(t) for t in truths)} faces, preset '{args.preset}'")
+
+        print(f"{'backend':>8} {'batch':>6} {'ms/frame':>9} {'frames/s':>9} {'faces/s':>9} {'recall':>7} {'precision':>9}")
+        for name, engine in engines.items():
+            engine.detect_faces(frames[0], params=params) # Warm-up outside the timings
+            for batch in batches:
+                r = run(engine, frames, truths, params, batch)
+                recall = f"{r['recall']:.3f}" if r['recall'] is not None else '-'
+                precision = f"{r['precision']:.3f}" if r['precision'] is not None else '-'
+                print(f"{name:>8} {batch:>6} {r['ms_per_frame']:>9.2f} {r['fps']:>9.1f} {r['faces_per_s']:>9.1f} "
+                      f"{recall:>7} {precision:>9}")
+
+
+if __name__ == '__main__':
+    main()
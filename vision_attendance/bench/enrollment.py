@@ -0,0 +1,41 @@
+import argparse
+import os
+import tempfile
+
+import numpy as np
+
+from face_logic import FaceRecognizer
+from bench.common import make_gallery, make_student, timed
+
+# Full retrain vs incremental enroll/remove of a single student on galleries of growing size.
+
+
+def run(students, images):
+    with tempfile.TemporaryDirectory() as root:
+        dataset_path = os.path.join(root, 'uploads')
+        make_gallery(dataset_path, students, images)
+        engine = FaceRecognizer(dataset_path=dataset_path, model_dir=os.path.join(root, 'models'))
+
+        _, full = timed(engine.train)
+
+        make_student(dataset_path, 'NEW-STUDENT', images, np.random.default_rng(students))
+        _, incremental = timed(engine.enroll, 'NEW-STUDENT')
+        _, removal = timed(engine.remove, 'NEW-STUDENT')
+
+    return full, incremental, removal
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full vs incremental enrollment time")
+    parser.add_argument('--sizes', default='100,1000,5000', help="comma separated student counts")
+    parser.add_argument('--images', type=int, default=20, help="images per student")
+    args = parser.parse_args()
+
+    print(f"{'students':>9} {'full train':>12} {'enroll':>10} {'remove':>10} {'speedup':>9}")
+    for students in [int(n) for n in args.sizes.split(',')]:
+        full, incremental, removal = run(students, args.images)
+        print(f"{students:>9} {full:>11.2f}s {incremental:>9.2f}s {removal:>9.2f}s {full / incremental:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from face_logic import LBPHMatcher
+from bench.common import student_base, synthetic_face
+
+# Per-face recognition latency vs gallery size: OpenCV LBPH predict() vs the NumPy LBPHMatcher,
+# with a parity check of labels and distances on the same gallery.
+
+
+def build_gallery(rows, rng, matcher):
+    # A few hundred real histograms, re-weighted to fill the requested number of gallery rows
+    bases = [student_base(rng) for _ in range(50)]
+    faces = [synthetic_face(rng, bases[i % len(bases)]) for i in range(min(rows, 200))]
+    real = matcher.compute_histograms(faces)
+    idx = np.arange(rows) % len(real)
+    histograms = real[idx] * rng.uniform(0.9, 1.1, size=(rows, 1)).astype(np.float32)
+    histograms[:len(real)] = real
+    return histograms.astype(np.float32), (idx % len(bases)).astype(np.int32), bases
+
+
+def per_face(fn, probes, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(probes)
+    return (time.perf_counter() - start) / (repeat * len(probes)) * 1000
+
+
+def run(rows, probes_count, batch, repeat, rng):
+    matcher = LBPHMatcher()
+    histograms, labels, bases = build_gallery(rows, rng, matcher)
+    matcher.set_gallery(histograms, labels)
+    probes = [synthetic_face(rng, bases[i % len(bases)]) for i in range(probes_count)]
+
+    # Round-trip through the shared YAML format so OpenCV scores exactly the same gallery
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'model.yml')
+        matcher.write(path)
+        opencv = cv2.face.LBPHFaceRecognizer_create()
+        opencv.read(path)
+
+    reference = [opencv.predict(p) for p in probes]
+    native = matcher.predict_batch(probes)
+    agree = sum(r[0] == n[0] for r, n in zip(reference, native))
+    max_delta = max(abs(r[1] - n[1]) for r, n in zip(reference, native))
+
+    opencv_ms = per_face(lambda ps: [opencv.predict(p) for p in ps], probes, repeat)
+    single_ms = per_face(lambda ps: [matcher.predict(p) for p in ps], probes, repeat)
+    batched_ms = per_face(lambda ps: [matcher.predict_batch(ps[i:i + batch]) for i in range(0, len(ps), batch)],
+                          probes, repeat)
+    return opencv_ms, single_ms, batched_ms, agree, max_delta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LBPH per-face latency vs gallery size")
+    parser.add_argument('--sizes', default='100,1000,5000', help="comma separated gallery sizes (histograms)")
+    parser.add_argument('--probes', type=int, default=16)
+    parser.add_argument('--batch', type=int, default=8, help="faces per predict_batch call")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'gallery':>8} {'opencv ms':>10} {'numpy ms':>9} {'batch ms':>9} {'labels':>8} {'max |d|':>9}")
+    for rows in [int(n) for n in args.sizes.split(',')]:
+        opencv_ms, single_ms, batched_ms, agree, max_delta = run(rows, args.probes, args.batch, args.repeat, rng)
+        print(f"{rows:>8} {opencv_ms:>10.2f} {single_ms:>9.2f} {batched_ms:>9.2f} "
+              f"{agree:>3}/{args.probes:<4} {max_delta:>9.1e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from face_logic import FaceRecognizer
+from metrics import Metrics
+from bench.common import make_gallery
+from bench.tracking import hall_frames
+
+# Cost of the /metrics timing hooks: detect_faces + recognize_faces on a synthetic hall with the
+# hooks off (metrics=None) and on, alternating rounds so drift affects both alike. Also reports
+# the raw cost of one Metrics.observe() call.
+
+
+def run_frames(engine, frames, threshold):
+    start = time.perf_counter()
+    for frame, boxes, _ in frames:
+        engine.detect_faces(frame)
+        engine.recognize_faces(frame, boxes, threshold)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Overhead of the metrics hooks on the frame path")
+    parser.add_argument('--faces', type=int, default=20)
+    parser.add_argument('--frames', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--threshold', type=float, default=48)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        dataset = os.path.join(root, 'uploads')
+        bases = make_gallery(dataset, args.faces, 4)
+        engine = FaceRecognizer(dataset_path=dataset, model_dir=os.path.join(root, 'models'))
+        engine.train()
+        frames = list(hall_frames(bases, args.frames, np.random.default_rng(1)))
+        metrics = Metrics(enabled=True)
+
+        run_frames(engine, frames[:3], args.threshold) # Warm-up
+        off, on = [], []
+        for _ in range(args.rounds):
+            engine.metrics = None
+            off.append(run_frames(engine, frames, args.threshold))
+            engine.metrics = metrics
+            on.append(run_frames(engine, frames, args.threshold))
+
+    calls = 100000
+    start = time.perf_counter()
+    for n in range(calls):
+        metrics.observe('facereg_detect_seconds', 0.01)
+    observe_us = (time.perf_counter() - start) / calls * 1e6
+
+    off_ms = np.median(off) / args.frames * 1000
+    on_ms = np.median(on) / args.frames * 1000
+    print(f"{'hooks':>6} {'ms/frame':>9}")
+    print(f"{'off':>6} {off_ms:>9.2f}")
+    print(f"{'on':>6} {on_ms:>9.2f}")
+    print(f"overhead {100 * (on_ms - off_ms) / off_ms:+.2f}% (observe() {observe_us:.2f} us per call)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+
+from face_logic import LBPHMatcher
+from bench.common import synthetic_face
+from bench.matcher import build_gallery
+
+# Model file size and load time: OpenCV YAML + pickled label map (the old format) vs the binary
+# format, read into memory or memory-mapped. "first predict" is one face scored right after the
+# load, which is where a memory-mapped gallery pays for reading its pages.
+
+
+def timed_load(load, probe, repeat):
+    loads, predicts = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        matcher = load()
+        loads.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        matcher.predict(probe)
+        predicts.append(time.perf_counter() - start)
+        del matcher
+    return np.median(loads) * 1000, np.median(predicts) * 1000
+
+
+def run(students, images, repeat, rng):
+    matcher = LBPHMatcher()
+    histograms, labels, bases = build_gallery(students * images, rng, matcher)
+    matcher.set_gallery(histograms, labels)
+    label_map = {n: f"STU-{n:05d}" for n in range(len(bases))}
+    probe = synthetic_face(rng, bases[0])
+
+    with tempfile.TemporaryDirectory() as root:
+        yaml_path = os.path.join(root, 'trained_model.yml')
+        pickle_path = os.path.join(root, 'label_map.pkl')
+        binary_path = os.path.join(root, 'trained_model.bin')
+        matcher.write(yaml_path)
+        with open(pickle_path, 'wb') as f:
+            pickle.dump(label_map, f)
+        start = time.perf_counter()
+        matcher.write_binary(binary_path, label_map)
+        write_ms = (time.perf_counter() - start) * 1000
+
+        def load_yaml():
+            loaded = LBPHMatcher.read(yaml_path)
+            with open(pickle_path, 'rb') as f:
+                pickle.load(f)
+            return loaded
+
+        rows = [
+            ('yaml', (os.path.getsize(yaml_path) + os.path.getsize(pickle_path)) / 2 ** 20,
+             timed_load(load_yaml, probe, min(repeat, 2))),
+            ('binary', os.path.getsize(binary_path) / 2 ** 20,
+             timed_load(lambda: LBPHMatcher.read_binary(binary_path, mmap=False)[0], probe, repeat)),
+            ('mmap', os.path.getsize(binary_path) / 2 ** 20,
+             timed_load(lambda: LBPHMatcher.read_binary(binary_path, mmap=True)[0], probe, repeat))
+        ]
+    return rows, write_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model file size and load time, YAML vs binary")
+    parser.add_argument('--sizes', default='100,1000', help="comma separated student counts")
+    parser.add_argument('--images', type=int, default=10, help="histograms per student")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'students':>9} {'format':>7} {'MiB':>8} {'load ms':>9} {'first predict ms':>17}")
+    for students in [int(n) for n in args.sizes.split(',')]:
+        rows, write_ms = run(students, args.images, args.repeat, rng)
+        for name, size, (load_ms, predict_ms) in rows:
+            print(f"{students:>9} {name:>7} {size:>8.1f} {load_ms:>9.1f} {predict_ms:>17.2f}")
+        print(f"{'':>9} binary write {write_ms:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
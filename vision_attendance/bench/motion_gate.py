@@ -0,0 +1,79 @@
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from face_logic import FaceRecognizer, MotionGate, box_iou
+from bench.common import student_base
+
+# Full-frame detection vs motion-gated detection: ms per frame, fraction of the detection image
+# scanned, and how many full-scan faces the gated pass also found (use --video with a real
+# classroom clip for a meaningful recall figure; the synthetic scene has no real faces).
+
+
+def static_scene(frames, size=(640, 480), movers=1, seed=0):
+    # Still classroom: fixed background with sensor noise, plus a few patches walking across
+    rng = np.random.default_rng(seed)
+    background = cv2.resize(rng.integers(0, 255, size=(48, 64, 3), dtype=np.uint8), size,
+                            interpolation=cv2.INTER_CUBIC)
+    patches = [cv2.cvtColor(cv2.resize(student_base(rng), (80, 80)), cv2.COLOR_GRAY2BGR) for _ in range(movers)]
+    for i in range(frames):
+        frame = cv2.add(background, rng.integers(0, 4, size=background.shape, dtype=np.uint8))
+        for n, patch in enumerate(patches):
+            x = (40 + n * 150 + i * 4) % (size[0] - 80)
+            y = 100 + n * 100
+            frame[y:y + 80, x:x + 80] = patch
+        yield frame
+
+
+def video_frames(path, frames):
+    capture = cv2.VideoCapture(path)
+    for _ in range(frames):
+        ok, frame = capture.read()
+        if not ok:
+            break
+        yield frame
+    capture.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Motion-gated vs full-frame face detection")
+    parser.add_argument('--video', help="video file to use instead of the synthetic static scene")
+    parser.add_argument('--frames', type=int, default=150)
+    parser.add_argument('--movers', type=int, default=1, help="moving patches in the synthetic scene")
+    parser.add_argument('--rescan', type=int, default=30, help="full rescan interval in frames")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        engine = FaceRecognizer(dataset_path=os.path.join(root, 'uploads'), model_dir=os.path.join(root, 'models'))
+        gate = MotionGate(rescan_every=args.rescan)
+        frames = video_frames(args.video, args.frames) if args.video else static_scene(args.frames, movers=args.movers)
+
+        full_time = gated_time = 0.0
+        full_faces = found = n = 0
+        hints = []
+        for frame in frames:
+            n += 1
+            start = time.perf_counter()
+            full = engine.detect_faces(frame)
+            full_time += time.perf_counter() - start
+            start = time.perf_counter()
+            gated = engine.detect_faces(frame, gate, hints)
+            gated_time += time.perf_counter() - start
+            hints = gated
+            full_faces += len(full)
+            found += sum(1 for box in full if any(box_iou(box, g) > 0.5 for g in gated))
+
+        stats = gate.stats()
+        print(f"frames: {n}, full scans: {stats['full_scans']}, scanned fraction: {stats['scanned_fraction']:.3f}")
+        print(f"full  {full_time / n * 1000:6.2f} ms/frame")
+        print(f"gated {gated_time / n * 1000:6.2f} ms/frame ({full_time / max(gated_time, 1e-9):.1f}x)")
+        if full_faces:
+            print(f"recall vs full scan: {found / float(full_faces):.3f} ({found}/{full_faces} faces)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import argparse
+import os
+import shutil
+import tempfile
+
+from face_logic import FaceRecognizer
+from bench.common import make_gallery, timed
+
+# Cold-cache preprocessing time of a full gallery for growing worker counts.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Training preprocessing scaling with worker count")
+    parser.add_argument('--students', type=int, default=500)
+    parser.add_argument('--images', type=int, default=20, help="images per student")
+    parser.add_argument('--workers', default='1,2,4,8,16', help="comma separated worker counts")
+    parser.add_argument('--pool', choices=['thread', 'process'], default='thread')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        dataset_path = os.path.join(root, 'uploads')
+        make_gallery(dataset_path, args.students, args.images)
+        student_dirs = sorted(os.listdir(dataset_path))
+
+        print(f"{'workers':>8} {'preprocess':>11} {'images/s':>10} {'speedup':>8}")
+        baseline = None
+        for workers in [int(n) for n in args.workers.split(',')]:
+            model_dir = os.path.join(root, f'models-{workers}')
+            engine = FaceRecognizer(dataset_path=dataset_path, model_dir=model_dir, workers=workers, pool=args.pool)
+            _, elapsed = timed(engine._preload_templates, student_dirs)
+            shutil.rmtree(model_dir)
+            baseline = baseline or elapsed
+            rate = args.students * args.images / elapsed
+            print(f"{workers:>8} {elapsed:>10.2f}s {rate:>10.0f} {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import argparse
+import time
+
+import numpy as np
+
+from face_logic import LBPHMatcher, PrototypeIndex
+from bench.common import student_base, synthetic_face
+
+# Full gallery search vs the two-stage prototype index: build time, per-face latency and the
+# accuracy delta (top-1 on held-out captures, and agreement with the full search).
+
+
+def build(students, images, rng):
+    matcher = LBPHMatcher()
+    bases = [student_base(rng) for _ in range(students)]
+    faces = [synthetic_face(rng, base) for base in bases for _ in range(images)]
+    matcher.train(faces, np.repeat(np.arange(students), images))
+    return matcher, bases
+
+
+def per_face(index, probes, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = index.predict_batch(probes)
+    return results, (time.perf_counter() - start) / (repeat * len(probes)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prototype index vs full LBPH search")
+    parser.add_argument('--sizes', default='500,2000', help="comma separated student counts")
+    parser.add_argument('--images', type=int, default=10, help="training images per student")
+    parser.add_argument('--prototypes', type=int, default=3, help="prototypes per student")
+    parser.add_argument('--shortlist', type=int, default=8, help="students re-ranked on full samples")
+    parser.add_argument('--probes', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"{'students':>9} {'build s':>8} {'full ms':>8} {'proto ms':>9} {'full acc':>9} {'proto acc':>10} {'agree':>7}")
+    for students in [int(n) for n in args.sizes.split(',')]:
+        rng = np.random.default_rng(students)
+        matcher, bases = build(students, args.images, rng)
+        truth = rng.integers(0, students, size=args.probes)
+        probes = [synthetic_face(rng, bases[t]) for t in truth]
+
+        start = time.perf_counter()
+        index = PrototypeIndex.build(matcher, args.prototypes, args.shortlist)
+        build_s = time.perf_counter() - start
+
+        full, full_ms = per_face(matcher, probes, args.repeat)
+        compact, proto_ms = per_face(index, probes, args.repeat)
+        full_acc = np.mean([label == t for (label, _), t in zip(full, truth)])
+        proto_acc = np.mean([label == t for (label, _), t in zip(compact, truth)])
+        agree = np.mean([a[0] == b[0] for a, b in zip(full, compact)])
+        print(f"{students:>9} {build_s:>8.2f} {full_ms:>8.2f} {proto_ms:>9.2f} "
+              f"{full_acc:>9.1%} {proto_acc:>10.1%} {agree:>7.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import argparse
+import contextlib
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import face_logic
+from face_logic import FaceRecognizer, LBPHMatcher
+from model_share import ModelCoordinator, ModelGeneration, fcntl
+from bench.common import synthetic_face
+from bench.matcher import build_gallery
+
+# Memory of N worker processes serving one model, and how fast they pick up a new one. Each worker
+# loads the model the way app.py does under FACEREG_SHARED_MODEL, scores a few faces, and reports
+# its RSS and PSS (proportional set size: shared pages are split between the processes mapping
+# them, so summed PSS is the real total). "private" reads the gallery into each process instead of
+# mapping it. This process plays the trainer: it publishes a bigger model and bumps the generation,
+# and every worker reports when it has switched.
+
+
+def memory_mb():
+    # (RSS, PSS) of this process in MiB from /proc (Linux)
+    values = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if parts[0] in ('Rss:', 'Pss:'):
+                    values[parts[0]] = int(parts[1]) / 1024
+    except OSError:
+        pass
+    return values.get('Rss:'), values.get('Pss:')
+
+
+def worker(mmap, model_dir, probes, results, done):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        serve(mmap, model_dir, probes, results, done)
+
+
+def serve(mmap, model_dir, probes, results, done):
+    face_logic.MODEL_MMAP = mmap
+    engine = FaceRecognizer(dataset_path=os.path.join(model_dir, 'no-dataset'), model_dir=model_dir)
+    coordinator = ModelCoordinator(engine, poll_interval=0.05).start()
+    engine.recognizer.predict_batch(probes)
+    students = len(engine.label_map)
+    results.put(('loaded', os.getpid()) + memory_mb())
+    while len(engine.label_map) == students and not done.is_set():
+        time.sleep(0.005)
+    results.put(('switched', os.getpid(), time.time(), coordinator.is_trainer))
+    done.wait()
+
+
+def publish(matcher, model_dir, students, generation):
+    matcher.write_binary(os.path.join(model_dir, 'trained_model.bin'), {n: f"STU-{n:05d}" for n in range(students)})
+    return generation.bump()
+
+
+def run(mmap, workers, students, images, rng):
+    matcher = LBPHMatcher()
+    histograms, labels, bases = build_gallery(students * images, rng, matcher)
+    labels = np.repeat(np.arange(students), images).astype(np.int32)
+    matcher.set_gallery(histograms, labels)
+    probes = np.stack([synthetic_face(rng, bases[i % len(bases)]) for i in range(8)])
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        generation = ModelGeneration(os.path.join(model_dir, 'generation'))
+        publish(matcher, model_dir, students, generation)
+        # Hold the trainer lock so no worker elects itself and starts training
+        lock = open(os.path.join(model_dir, 'trainer.lock'), 'a')
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+
+        ctx = multiprocessing.get_context('spawn')
+        results, done = ctx.Queue(), ctx.Event()
+        procs = [ctx.Process(target=worker, args=(mmap, model_dir, probes, results, done)) for _ in range(workers)]
+        for p in procs:
+            p.start()
+        loaded = [results.get(timeout=300) for _ in procs]
+
+        # Ten more students
+        bigger = LBPHMatcher()
+        bigger.set_gallery(np.vstack([histograms, histograms[:images * 10]]),
+                           np.concatenate([labels, np.arange(students, students + 10).repeat(images)]))
+        start = time.time()
+        publish(bigger, model_dir, students + 10, generation)
+        switched = [results.get(timeout=60) for _ in procs]
+        done.set()
+        for p in procs:
+            p.join()
+
+    rss = sum(r[2] or 0 for r in loaded)
+    pss = sum(r[3] or 0 for r in loaded)
+    pickup = max(r[2] for r in switched) - start
+    trainers = sum(r[3] for r in switched)
+    return rss, pss, pickup * 1000, trainers, matcher.gallery.nbytes / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory and model pickup of worker processes sharing one model")
+    parser.add_argument('--workers', default='1,2,4', help="comma separated worker counts")
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--images', type=int, default=10, help="histograms per student")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'mode':>8} {'workers':>8} {'gallery MiB':>12} {'sum RSS':>9} {'sum PSS':>9} {'pickup ms':>10}")
+    for workers in [int(n) for n in args.workers.split(',')]:
+        for mode, mmap in (('private', False), ('mmap', True)):
+            rss, pss, pickup_ms, trainers, gallery = run(mmap, workers, args.students, args.images, rng)
+            print(f"{mode:>8} {workers:>8} {gallery:>12.1f} {rss:>9.0f} {pss:>9.0f} {pickup_ms:>10.0f}")
+            if trainers:
+                print(f"warning: {trainers} worker(s) elected themselves trainer")
+
+
+if __name__ == '__main__':
+    main()
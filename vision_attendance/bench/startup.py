@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+import numpy as np
+
+from bench.common import make_gallery
+
+# Application start-up on an enrolled roster: each run is a fresh `import app` in its own process,
+# timing the import, the first HTTP request, readiness (/ready, when the app has it), the first
+# recognition and the moment start-up work in the background (model sync) has finished.
+# --baseline REV runs the same against the app from an older git revision.
+
+CHILD = r'''
+import json, os, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+client.get('/login')
+first_request = time.perf_counter()
+
+ready = None
+if client.get('/ready').status_code != 404:
+    while client.get('/ready').status_code != 200 and time.perf_counter() - start < 600:
+        time.sleep(0.01)
+    ready = time.perf_counter()
+
+import cv2, numpy as np
+face = cv2.imread(os.path.join('uploads', sorted(os.listdir('uploads'))[0], '0.jpg'))
+frame = np.zeros((480, 640, 3), np.uint8)
+frame[100:300, 200:400] = face
+before = time.perf_counter()
+result = app.face_engine.recognize_faces(frame, [(200, 100, 200, 200)], 48)
+recognized = time.perf_counter()
+
+jobs = getattr(app.trainer, 'jobs', {})
+while any(job['status'] in ('queued', 'running') for job in list(jobs.values())) and time.perf_counter() - start < 600:
+    time.sleep(0.01)
+settled = time.perf_counter()
+print(json.dumps({
+    'import_s': imported - start,
+    'first_request_s': first_request - start,
+    'ready_s': ready - start if ready else None,
+    'first_recognition_ms': (recognized - before) * 1000,
+    'first_recognition_s': recognized - start,
+    'background_s': settled - start,
+    'boot_jobs': len(jobs),
+    'student_id': result[0]['student_id'] if result else None
+}))
+'''
+
+
+def export_tree(rev, root):
+    # vision_attendance/ as of a git revision
+    os.makedirs(root)
+    archive = os.path.join(root, 'tree.tar')
+    top = subprocess.check_output(['git', 'rev-parse', '--show-toplevel']).decode().strip()
+    subprocess.check_call(['git', 'archive', '--prefix=vision_attendance/', '-o', archive, f'{rev}:vision_attendance'], cwd=top)
+    with tarfile.open(archive) as tar:
+        tar.extractall(root)
+    return os.path.join(root, 'vision_attendance')
+
+
+def prepare(workdir, source, students, images):
+    # An enrolled installation: uploads/, a trained model and the students table
+    make_gallery(os.path.join(workdir, 'uploads'), students, images)
+    subprocess.check_call([sys.executable, '-c',
+                           'from database import init_db; from face_logic import FaceRecognizer; '
+                           'init_db(); FaceRecognizer().train()'],
+                          cwd=workdir, env=dict(os.environ, PYTHONPATH=source), stdout=subprocess.DEVNULL)
+    conn = sqlite3.connect(os.path.join(workdir, 'attendance.db'))
+    with conn:
+        conn.executemany('INSERT OR IGNORE INTO students (name, student_id) VALUES (?, ?)',
+                         [(f"Student {n}", f"STU/{n:05d}") for n in range(students)])
+    conn.close()
+
+
+def run_once(workdir, source):
+    output = subprocess.check_output([sys.executable, '-c', CHILD], cwd=workdir,
+                                     env=dict(os.environ, PYTHONPATH=source, FACEREG_CAMERAS='default=none.avi'),
+                                     stderr=subprocess.DEVNULL)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start-up time: import, first request, readiness, first recognition")
+    parser.add_argument('--students', type=int, default=500)
+    parser.add_argument('--images', type=int, default=5)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--baseline', help="git revision to compare against, e.g. HEAD~1")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as root:
+        trees = [('current', here)]
+        if args.baseline:
+            trees.insert(0, (args.baseline, export_tree(args.baseline, os.path.join(root, 'baseline'))))
+
+        keys = ['import_s', 'first_request_s', 'ready_s', 'first_recognition_s', 'first_recognition_ms', 'background_s']
+        print(f"{'version':>10} " + ' '.join(f"{k:>20}" for k in keys) + f" {'boot jobs':>10}")
+        for label, source in trees:
+            workdir = os.path.join(root, f'work-{label.replace("/", "_")}')
+            os.makedirs(workdir)
+            prepare(workdir, source, args.students, args.images)
+            runs = [run_once(workdir, source) for _ in range(args.runs)]
+            cells = []
+            for key in keys:
+                values = [r[key] for r in runs if r[key] is not None]
+                cells.append(f"{np.median(values):>20.3f}" if values else f"{'-':>20}")
+            print(f"{label:>10} " + ' '.join(cells) + f" {runs[-1]['boot_jobs']:>10}")
+            if any(r['student_id'] != 'STU-00000' for r in runs):
+                print(f"warning: first recognition returned {[r['student_id'] for r in runs]}")
+            shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
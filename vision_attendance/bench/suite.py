@@ -0,0 +1,290 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from attendance_writer import AttendanceWriter
+from database import init_db, connect
+from face_logic import FaceRecognizer, TEMPLATE_SIZE, folder_entries, load_training_face, prepare_face, thread_clahe, thread_stack
+from bench.common import latency_summary, make_gallery, rss_mb
+from bench.tracking import hall_frames
+
+# End-to-end benchmark of the recognition stack, one stage at a time: train, model load, and per
+# frame detection, preprocessing, predict and full recognition, then attendance marking through
+# the AttendanceWriter. Each stage reports throughput, p50/p95/p99 latency and process RSS, and
+# --json writes the lot (plus versions and settings) for comparing releases with --compare.
+#
+# Datasets: a synthetic gallery (--students x --images) by default, or a recorded uploads/-style
+# folder with --dataset. Frames come from --video files (recorded lectures, boxes from the
+# detector), or else from a synthetic hall of enrolled faces with known boxes.
+#
+#   python -m bench.suite --json results.json
+#   python -m bench.suite --video lecture.mp4 --dataset uploads --compare results.json
+
+
+@contextlib.contextmanager
+def quiet():
+    # Training and model loading print progress lines that would drown the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def count_images(dataset):
+    return sum(len(folder_entries(os.path.join(dataset, d))) for d in os.listdir(dataset)
+               if os.path.isdir(os.path.join(dataset, d)))
+
+
+def bench_train(dataset, root, runs):
+    # Cold trains: a fresh model directory each time, so nothing comes from the template cache
+    images = count_images(dataset)
+    times = []
+    for n in range(runs):
+        model_dir = os.path.join(root, f'models-train-{n}')
+        with quiet():
+            engine = FaceRecognizer(dataset_path=dataset, model_dir=model_dir)
+            start = time.perf_counter()
+            engine.train()
+            times.append(time.perf_counter() - start)
+    return latency_summary(times, [images] * runs), engine
+
+
+def bench_load(engine, runs):
+    times = []
+    for _ in range(runs):
+        with quiet():
+            start = time.perf_counter()
+            engine.load_model()
+            times.append(time.perf_counter() - start)
+    return latency_summary(times)
+
+
+def recorded_frames(paths, limit):
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise SystemExit(f"Cannot open video {path}")
+        read = 0
+        while read < limit:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            read += 1
+            yield frame, None, None
+        cap.release()
+
+
+def hall_bases(dataset, faces):
+    # One 200x200 face per student to paint into the synthetic hall (works for recorded galleries too)
+    bases = {}
+    clahe = thread_clahe(2.0)
+    for student_dir in sorted(os.listdir(dataset)):
+        entries = folder_entries(os.path.join(dataset, student_dir)) if os.path.isdir(os.path.join(dataset, student_dir)) else []
+        face = load_training_face(os.path.join(dataset, student_dir, entries[0][0]), clahe) if entries else None
+        if face is not None:
+            bases[student_dir] = face
+        if len(bases) == faces:
+            break
+    return bases
+
+
+def bench_frames(engine, frames, threshold):
+    # Per frame: detection, then the recognition of the boxes split into preprocessing and predict
+    # (the same steps recognize_faces takes), and recognize_faces itself as a whole
+    detect, preprocess, predict, recognize, total = [], [], [], [], []
+    faces, correct, known = [], 0, 0
+    clahe = thread_clahe(1.5)
+    snapshot = engine.snapshot
+    matcher = snapshot.index if snapshot.index is not None else snapshot.recognizer
+    for frame, boxes, students in frames:
+        start = time.perf_counter()
+        detected = engine.detect_faces(frame)
+        detect.append(time.perf_counter() - start)
+        if boxes is None:
+            boxes = detected
+
+        start = time.perf_counter()
+        results = engine.recognize_faces(frame, boxes, threshold, snapshot)
+        recognize.append(time.perf_counter() - start)
+        total.append(detect[-1] + recognize[-1])
+        faces.append(len(boxes))
+        if students is not None:
+            correct += sum(r['student_id'] == s for r, s in zip(results, students))
+            known += len(students)
+
+        start = time.perf_counter()
+        prepared = thread_stack('bench_faces', len(boxes), (TEMPLATE_SIZE[1], TEMPLATE_SIZE[0]))
+        for (x, y, w, h), out in zip(boxes, prepared):
+            prepare_face(cv2.cvtColor(frame[y:y+h, x:x+w], cv2.COLOR_BGR2GRAY), clahe, out)
+        preprocess.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        if len(prepared):
+            matcher.predict_batch(prepared)
+        predict.append(time.perf_counter() - start)
+
+    stages = {
+        'detect': latency_summary(detect),
+        'preprocess': latency_summary(preprocess, faces),
+        'predict': latency_summary(predict, faces),
+        'recognize': latency_summary(recognize, faces),
+        'frame': latency_summary(total)
+    }
+    accuracy = round(correct / float(known), 4) if known else None
+    return stages, accuracy
+
+
+def bench_marking(dataset, root, sessions):
+    # Every student marked once in each of `sessions` sessions: mark() latency as the video
+    # pipeline sees it, and how long until the writer thread has committed every row
+    db_path = os.path.join(root, 'attendance.db')
+    with quiet():
+        init_db(db_path)
+    student_dirs = sorted(d for d in os.listdir(dataset) if os.path.isdir(os.path.join(dataset, d)))
+    conn = connect(db_path)
+    with conn:
+        conn.executemany('INSERT INTO students (name, student_id) VALUES (?, ?)', [(d, d) for d in student_dirs])
+        conn.executemany('INSERT INTO sessions (lecturer_id, session_token) VALUES (?, ?)',
+                         [('bench', f'bench-{n}') for n in range(sessions)])
+        session_ids = [row[0] for row in conn.execute('SELECT id FROM sessions ORDER BY id')]
+    conn.close()
+
+    writer = AttendanceWriter(db_path)
+    writer.start()
+    marks = []
+    with quiet():
+        first = time.perf_counter()
+        for session_id in session_ids:
+            writer.open_session(session_id)
+            for student_dir in student_dirs:
+                start = time.perf_counter()
+                writer.mark(student_dir, session_id)
+                marks.append(time.perf_counter() - start)
+        expected = len(session_ids) * len(student_dirs)
+        deadline = time.time() + 60
+        while writer.rows_written < expected and time.time() < deadline:
+            time.sleep(0.005)
+        committed = time.perf_counter() - first
+        writer.stop()
+    return latency_summary(marks), latency_summary([committed], [writer.rows_written])
+
+
+def report(result):
+    print(f"{'stage':>11} {'count':>7} {'per s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'RSS MiB':>8}")
+    for name, stage in result['stages'].items():
+        if not stage.get('count'):
+            continue
+        print(f"{name:>11} {stage['count']:>7} {stage['per_s'] or 0:>9.1f} {stage['p50_ms']:>9.3f} "
+              f"{stage['p95_ms']:>9.3f} {stage['p99_ms']:>9.3f} {result['rss_mb'][name]['current'] or 0:>8.1f}")
+    if result['accuracy'] is not None:
+        print(f"accuracy on the synthetic hall: {result['accuracy']:.3f}")
+    print(f"peak RSS {result['peak_rss_mb']} MiB")
+
+
+def compare(result, path):
+    # p50 and throughput of this run relative to an earlier JSON report (>1.00 means slower / faster)
+    with open(path) as f:
+        old = json.load(f)
+    print(f"\nvs {path} ({old.get('label') or old.get('git') or 'previous'}):")
+    print(f"{'stage':>11} {'p50 ratio':>10} {'per s ratio':>12}")
+    for name, stage in result['stages'].items():
+        before = old.get('stages', {}).get(name)
+        if not before or not before.get('items') or not stage.get('items'):
+            continue
+        p50 = stage['p50_ms'] / before['p50_ms'] if before['p50_ms'] else float('nan')
+        rate = stage['per_s'] / before['per_s'] if before.get('per_s') and stage.get('per_s') else float('nan')
+        flag = '  <- slower' if p50 > 1.1 else ''
+        print(f"{name:>11} {p50:>10.2f} {rate:>12.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recognition benchmark suite with a JSON report")
+    parser.add_argument('--students', type=int, default=50, help="synthetic gallery: students")
+    parser.add_argument('--images', type=int, default=10, help="synthetic gallery: images per student")
+    parser.add_argument('--dataset', help="recorded uploads/-style gallery to use instead of a synthetic one")
+    parser.add_argument('--video', action='append', default=[], help="recorded video to replay (repeatable)")
+    parser.add_argument('--frames', type=int, default=60, help="frames per video / synthetic hall frames")
+    parser.add_argument('--faces', type=int, default=20, help="students in the synthetic hall")
+    parser.add_argument('--threshold', type=float, default=48)
+    parser.add_argument('--train-runs', type=int, default=3)
+    parser.add_argument('--load-runs', type=int, default=10)
+    parser.add_argument('--sessions', type=int, default=5, help="sessions every student is marked in")
+    parser.add_argument('--label', help="name for this run in the report, e.g. a release tag")
+    parser.add_argument('--json', help="write the report to this file ('-' for stdout)")
+    parser.add_argument('--compare', help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    result = {
+        'label': args.label,
+        'git': git_revision(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': vars(args),
+        'stages': {},
+        'rss_mb': {},
+        'accuracy': None
+    }
+
+    def record(name, stage):
+        current, peak = rss_mb()
+        result['stages'][name] = stage
+        result['rss_mb'][name] = {'current': current, 'peak': peak}
+
+    with tempfile.TemporaryDirectory() as root:
+        dataset = args.dataset
+        if dataset is None:
+            dataset = os.path.join(root, 'uploads')
+            make_gallery(dataset, args.students, args.images)
+        result['gallery'] = {'students': len([d for d in os.listdir(dataset) if os.path.isdir(os.path.join(dataset, d))]),
+                             'images': count_images(dataset), 'recorded': args.dataset is not None}
+
+        train, engine = bench_train(dataset, root, args.train_runs)
+        record('train', train)
+        record('load', bench_load(engine, args.load_runs))
+
+        if args.video:
+            frames = recorded_frames(args.video, args.frames)
+        else:
+            frames = hall_frames(hall_bases(dataset, args.faces), args.frames, np.random.default_rng(1))
+        stages, result['accuracy'] = bench_frames(engine, frames, args.threshold)
+        for name, stage in stages.items():
+            record(name, stage)
+
+        marks, committed = bench_marking(dataset, root, args.sessions)
+        record('mark', marks)
+        record('db_commit', committed)
+
+    result['peak_rss_mb'] = rss_mb()[1]
+    if args.json == '-':
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        report(result)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(result, f, indent=2)
+            print(f"wrote {args.json}")
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import argparse
+import os
+import shutil
+import tempfile
+
+from face_logic import FaceRecognizer
+from bench.common import make_gallery, timed
+
+# Full train with an empty template cache (every JPEG decoded) vs a warm cache (memory-mapped .npy).
+
+
+def run(students, images):
+    with tempfile.TemporaryDirectory() as root:
+        dataset_path = os.path.join(root, 'uploads')
+        model_dir = os.path.join(root, 'models')
+        make_gallery(dataset_path, students, images)
+
+        engine = FaceRecognizer(dataset_path=dataset_path, model_dir=model_dir)
+        _, load_cold = timed(lambda: [engine._load_student_faces(d) for d in sorted(os.listdir(dataset_path))])
+        shutil.rmtree(engine.templates.cache_dir)
+
+        engine = FaceRecognizer(dataset_path=dataset_path, model_dir=model_dir)
+        _, cold = timed(engine.train)
+
+        # Fresh process state, cache on disk: what app boot sees after a restart
+        engine = FaceRecognizer(dataset_path=dataset_path, model_dir=model_dir)
+        _, load_warm = timed(lambda: [engine._load_student_faces(d) for d in sorted(os.listdir(dataset_path))])
+        _, warm = timed(engine.train)
+
+    return load_cold, load_warm, cold, warm
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Training time with a cold vs warm template cache")
+    parser.add_argument('--sizes', default='100,1000', help="comma separated student counts")
+    parser.add_argument('--images', type=int, default=20, help="images per student")
+    args = parser.parse_args()
+
+    print(f"{'students':>9} {'load cold':>10} {'load warm':>10} {'train cold':>11} {'train warm':>11}")
+    for students in [int(n) for n in args.sizes.split(',')]:
+        load_cold, load_warm, cold, warm = run(students, args.images)
+        print(f"{students:>9} {load_cold:>9.2f}s {load_warm:>9.2f}s {cold:>10.2f}s {warm:>10.2f}s")
+
+
+if __name__ == '__main__':
+    main()
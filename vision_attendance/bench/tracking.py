@@ -0,0 +1,76 @@
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from face_logic import FaceRecognizer, FaceTracker
+from bench.common import make_gallery, synthetic_face
+
+# Per-frame recognition of every face vs the face tracker on a synthetic lecture hall: a grid of
+# enrolled students drifting slowly. Detection is replaced by the known boxes so only the
+# recognition cost is compared.
+
+
+def hall_frames(bases, frames, rng, face=100, cols=10):
+    students = sorted(bases)
+    rows = (len(students) + cols - 1) // cols
+    size = (rows * (face + 40) + 40, cols * (face + 20) + 40)
+    for i in range(frames):
+        frame = rng.integers(0, 40, size=size + (3,), dtype=np.uint8)
+        boxes = []
+        for n, student_dir in enumerate(students):
+            x = 20 + (n % cols) * (face + 20) + int(8 * np.sin(i / 10.0 + n))
+            y = 20 + (n // cols) * (face + 40) + i % 20
+            img = cv2.resize(synthetic_face(rng, bases[student_dir]), (face, face))
+            frame[y:y + face, x:x + face] = img[:, :, None]
+            # Detector jitter
+            jx, jy = rng.integers(-3, 4, size=2)
+            boxes.append((x + jx, y + jy, face, face))
+        yield frame, boxes, students
+
+
+def accuracy(results, students):
+    return sum(r['student_id'] == s for r, s in zip(results, students)) / float(len(students))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face tracker vs per-frame recognition")
+    parser.add_argument('--faces', type=int, default=50, help="students in the hall")
+    parser.add_argument('--images', type=int, default=5, help="enrolment images per student")
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--threshold', type=float, default=48)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        dataset = os.path.join(root, 'uploads')
+        bases = make_gallery(dataset, args.faces, args.images)
+        engine = FaceRecognizer(dataset_path=dataset, model_dir=os.path.join(root, 'models'))
+        engine.train()
+        tracker = FaceTracker(engine)
+
+        naive_time = tracked_time = 0.0
+        naive_acc = tracked_acc = 0.0
+        rng = np.random.default_rng(1)
+        for frame, boxes, students in hall_frames(bases, args.frames, rng):
+            start = time.perf_counter()
+            naive = engine.recognize_faces(frame, boxes, args.threshold)
+            naive_time += time.perf_counter() - start
+            start = time.perf_counter()
+            tracked = tracker.update(frame, args.threshold, boxes=boxes)
+            tracked_time += time.perf_counter() - start
+            naive_acc += accuracy(naive, students)
+            # Tracks come back in track order, which is detection order on this synthetic hall
+            tracked_acc += accuracy(tracked, students)
+
+        stats = tracker.stats()
+        print(f"{'mode':>8} {'ms/frame':>9} {'recognitions':>13} {'accuracy':>9}")
+        print(f"{'naive':>8} {naive_time / args.frames * 1000:>9.1f} {stats['faces_seen']:>13} {naive_acc / args.frames:>9.3f}")
+        print(f"{'tracked':>8} {tracked_time / args.frames * 1000:>9.1f} {stats['faces_recognized']:>13} {tracked_acc / args.frames:>9.3f}")
+        print(f"tracks: {stats['tracks']}, speed-up {naive_time / max(tracked_time, 1e-9):.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,432 @@
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+import cv2
+
+# A captured frame. image must be treated as read-only: every stage and viewer of the source shares it.
+Frame = namedtuple('Frame', ['seq', 'timestamp', 'image'])
+
+# Detection output for one frame, tagged with the frame it came from
+Analysis = namedtuple('Analysis', ['seq', 'timestamp', 'results'])
+
+# One JPEG of a view: the frame it shows and the analysis drawn on it
+Encoded = namedtuple('Encoded', ['seq', 'analysis_seq', 'jpeg'])
+
+def parse_source(value):
+    # "0" -> device index 0; anything else (RTSP/HTTP URL, video file path) is passed to OpenCV as-is
+    value = str(value).strip()
+    return int(value) if value.isdigit() else value
+
+def wait_newer(cond, get, after_seq, alive, timeout):
+    # Shared consumer wait: block until get() returns something with seq > after_seq or alive() is False
+    with cond:
+        cond.wait_for(lambda: not alive() or (get() is not None and get().seq > after_seq), timeout)
+        item = get()
+        return item if item is not None and item.seq > after_seq else None
+
+class FrameSource:
+    # Capture stage: one reader thread per camera. Frames go into a small ring buffer; any number of
+    # consumers read the newest one without blocking the reader or each other.
+    def __init__(self, source, buffer_size=4, loop=True, width=640, height=480, fps=30, name=None, metrics=None):
+        self.source = parse_source(source)
+        self.name = name if name is not None else str(source) # Camera label for metrics
+        self.metrics = metrics # Optional metrics.Metrics: frame read times
+        self.loop = loop # Video files restart at the end instead of stopping the source
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.buffer = deque(maxlen=buffer_size)
+        self.cond = threading.Condition()
+        self.seq = 0
+        self.running = False
+        self.thread = None
+        self.capture = None
+
+    @property
+    def is_file(self):
+        return isinstance(self.source, str) and os.path.isfile(self.source)
+
+    def _open(self):
+        if isinstance(self.source, int):
+            # Using CAP_DSHOW on Windows for significantly faster startup (0.5s vs 10s)
+            capture = cv2.VideoCapture(self.source, cv2.CAP_DSHOW if os.name == 'nt' else cv2.CAP_ANY)
+            # Optimize camera resolution for faster processing if needed
+            capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+            capture.set(cv2.CAP_PROP_FPS, self.fps)
+        else:
+            capture = cv2.VideoCapture(self.source)
+        return capture
+
+    def start(self):
+        with self.cond:
+            if self.running:
+                return True
+            self.capture = self._open()
+            if not self.capture.isOpened():
+                print(f"Could not open camera source {self.source!r}")
+                self.capture.release()
+                self.capture = None
+                return False
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name=f'capture-{self.source}', daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+
+    def _run(self):
+        # Files have no natural pace, so replay them at their own frame rate
+        interval = 0
+        if self.is_file:
+            file_fps = self.capture.get(cv2.CAP_PROP_FPS)
+            interval = 1.0 / file_fps if file_fps and file_fps > 0 else 1.0 / self.fps
+        next_time = time.time()
+        rewound = False
+
+        while self.running:
+            read_start = time.perf_counter()
+            success, image = self.capture.read()
+            if success and self.metrics is not None:
+                self.metrics.observe('facereg_capture_read_seconds', time.perf_counter() - read_start, camera=self.name)
+            if not success:
+                # Rewind once; a file that still yields nothing is empty or unreadable
+                if self.is_file and self.loop and not rewound:
+                    self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    rewound = True
+                    continue
+                break
+            rewound = False
+
+            with self.cond:
+                self.seq += 1
+                self.buffer.append(Frame(self.seq, time.time(), image))
+                self.cond.notify_all()
+
+            if interval:
+                next_time += interval
+                time.sleep(max(0, next_time - time.time()))
+
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.capture.release()
+
+    def latest(self):
+        # Newest frame or None; never blocks
+        buffer = self.buffer
+        return buffer[-1] if buffer else None
+
+    def wait(self, after_seq, timeout=1.0):
+        # Block until a frame newer than after_seq exists (or the source stops); returns it or None
+        return wait_newer(self.cond, self.latest, after_seq, lambda: self.running, timeout)
+
+class AnalysisPool:
+    # Recognition stage. A dispatcher samples the newest frame at analysis_fps into a short queue and
+    # N workers run detection on it. Under load the oldest queued frame is dropped, and a result that
+    # finishes after a newer one is discarded, so the published analysis only ever moves forward.
+    # Frames are only sampled while demand is set; Stream clears it when the last viewer leaves.
+    def __init__(self, source, detect, workers=2, analysis_fps=10, queue_size=None, metrics=None):
+        self.source = source
+        self.detect = detect # callable(image, seq) -> list of result dicts, or None to skip a stale frame
+        self.metrics = metrics # Optional metrics.Metrics: time per analysed frame
+        self.workers = max(1, workers)
+        self.analysis_fps = analysis_fps
+        self.queue_size = queue_size or self.workers
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.analysis = Analysis(0, None, [])
+        self.busy = 0
+        self.frames_queued = 0
+        self.frames_analyzed = 0
+        self.frames_dropped = 0 # Queued frames replaced by a newer one before a worker got to them
+        self.results_discarded = 0 # Finished after a newer frame's result was already published
+        self.demand = threading.Event()
+        self.demand.set()
+        self.threads = []
+
+    def start(self):
+        if any(t.is_alive() for t in self.threads):
+            return
+        self.threads = [threading.Thread(target=self._dispatch, name=f'dispatch-{self.source.source}', daemon=True)]
+        self.threads += [threading.Thread(target=self._work, name=f'recognize-{self.source.source}-{i}', daemon=True)
+                         for i in range(self.workers)]
+        for t in self.threads:
+            t.start()
+
+    def resume(self):
+        # Demand is back after an idle spell: results from before it describe an old scene, so the
+        # views show (and attendance marks from) nothing until the first fresh frame is analysed
+        with self.cond:
+            if not self.demand.is_set():
+                self.analysis = Analysis(self.analysis.seq, None, [])
+                self.demand.set()
+
+    def join(self, timeout=2):
+        with self.cond:
+            self.cond.notify_all()
+        for t in self.threads:
+            if t is not threading.current_thread():
+                t.join(timeout)
+
+    def _dispatch(self):
+        interval = 1.0 / self.analysis_fps if self.analysis_fps else 0
+        last_seq = 0
+        while self.source.running:
+            if not self.demand.wait(1.0):
+                continue
+            start_time = time.time()
+            frame = self.source.wait(last_seq)
+            if frame is None:
+                continue
+            last_seq = frame.seq
+            with self.cond:
+                if len(self.queue) >= self.queue_size:
+                    self.queue.popleft()
+                    self.frames_dropped += 1
+                self.queue.append(frame)
+                self.frames_queued += 1
+                self.cond.notify()
+            if interval:
+                time.sleep(max(0, interval - (time.time() - start_time)))
+        with self.cond:
+            self.cond.notify_all()
+
+    def _work(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.queue or not self.source.running, timeout=1.0)
+                if not self.source.running:
+                    return
+                if not self.queue:
+                    continue
+                frame = self.queue.popleft()
+                self.busy += 1
+            start = time.perf_counter()
+            try:
+                results = self.detect(frame.image, frame.seq)
+                if self.metrics is not None:
+                    self.metrics.observe('facereg_analysis_seconds', time.perf_counter() - start, camera=self.source.name)
+            except Exception as e:
+                print(f"Detection failed on frame {frame.seq}: {e}")
+                results = None
+            with self.cond:
+                self.busy -= 1
+                if results is None:
+                    continue
+                if frame.seq > self.analysis.seq:
+                    self.analysis = Analysis(frame.seq, frame.timestamp, results)
+                    self.frames_analyzed += 1
+                    self.cond.notify_all()
+                else:
+                    self.results_discarded += 1
+
+    def stats(self):
+        with self.cond:
+            return {
+                'workers': self.workers,
+                'analysis_fps': self.analysis_fps,
+                'queue_depth': len(self.queue),
+                'busy_workers': self.busy,
+                'frames_queued': self.frames_queued,
+                'frames_analyzed': self.frames_analyzed,
+                'frames_dropped': self.frames_dropped,
+                'results_discarded': self.results_discarded,
+                'last_analyzed_seq': self.analysis.seq
+            }
+
+class StreamEncoder:
+    # Encoding stage for one view of a source: draws the latest analysis onto the newest frame and
+    # JPEG-encodes it at stream_fps, once for all viewers of that view. Recognition speed no longer
+    # sets the stream frame rate. With no viewers it waits instead of encoding.
+    def __init__(self, source, pool, annotate, stream_fps=15, quality=70, view=None, metrics=None):
+        self.source = source
+        self.pool = pool
+        self.annotate = annotate # callable(image, results) drawing in place
+        self.view = view
+        self.metrics = metrics # Optional metrics.Metrics: annotate + encode time per frame
+        self.stream_fps = stream_fps
+        self.quality = quality
+        self.encoded = None
+        self.cond = threading.Condition()
+        self.frames_encoded = 0
+        self.frames_skipped = 0 # Captured frames never encoded because the stream runs slower than capture
+        self.viewers = 0
+        self.thread = None
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name=f'encode-{self.source.source}', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        interval = 1.0 / self.stream_fps if self.stream_fps else 0
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), self.quality]
+        last_seq = 0
+        while self.source.running:
+            with self.cond:
+                if not self.viewers:
+                    # Drop the last JPEG so a returning viewer is not shown a stale frame first
+                    self.encoded = None
+                    last_seq = 0
+                    self.cond.wait_for(lambda: self.viewers or not self.source.running, 1.0)
+                    continue
+            start_time = time.time()
+            frame = self.source.wait(last_seq)
+            if frame is None:
+                continue
+            if last_seq:
+                self.frames_skipped += frame.seq - last_seq - 1
+            last_seq = frame.seq
+
+            analysis = self.pool.analysis
+            encode_start = time.perf_counter()
+            # The captured frame is shared with the other stages, so draw on a copy
+            image = frame.image.copy()
+            self.annotate(image, analysis.results)
+            ok, buffer = cv2.imencode('.jpg', image, params)
+            if self.metrics is not None:
+                self.metrics.observe('facereg_encode_seconds', time.perf_counter() - encode_start,
+                                     camera=self.source.name, view=self.view)
+            if ok:
+                with self.cond:
+                    self.encoded = Encoded(frame.seq, analysis.seq, buffer.tobytes())
+                    self.frames_encoded += 1
+                    self.cond.notify_all()
+            if interval:
+                time.sleep(max(0, interval - (time.time() - start_time)))
+        with self.cond:
+            self.cond.notify_all()
+
+    def add_viewer(self, delta=1):
+        with self.cond:
+            self.viewers += delta
+            self.cond.notify_all()
+
+    def wait(self, after_seq, timeout=1.0):
+        return wait_newer(self.cond, lambda: self.encoded, after_seq, lambda: self.source.running, timeout)
+
+    def stats(self):
+        return {
+            'stream_fps': self.stream_fps,
+            'viewers': self.viewers,
+            'frames_encoded': self.frames_encoded,
+            'frames_skipped': self.frames_skipped
+        }
+
+class Stream:
+    # Capture -> recognition pool -> per-view encoders for one camera
+    def __init__(self, source, pool, views, stream_fps, metrics=None):
+        self.source = source
+        self.pool = pool
+        self.views = views # {view name: annotate callable}
+        self.stream_fps = stream_fps
+        self.metrics = metrics
+        self.encoders = {}
+        self.lock = threading.Lock()
+
+    def encoder(self, view):
+        with self.lock:
+            encoder = self.encoders.get(view)
+            if encoder is None:
+                encoder = StreamEncoder(self.source, self.pool, self.views[view], self.stream_fps,
+                                        view=view, metrics=self.metrics)
+                self.encoders[view] = encoder
+            encoder.start()
+            return encoder
+
+    # Viewers of a view; while no view has one, neither encoding nor recognition runs
+    def attach(self, view):
+        encoder = self.encoder(view)
+        with self.lock:
+            encoder.add_viewer()
+            self.pool.resume()
+        return encoder
+
+    def detach(self, encoder):
+        with self.lock:
+            encoder.add_viewer(-1)
+            if not any(e.viewers for e in self.encoders.values()):
+                self.pool.demand.clear()
+
+    def stop(self):
+        self.source.stop()
+        # Let in-flight detection/encoding finish so OpenCV is not torn down under it at exit
+        self.pool.join()
+        for encoder in list(self.encoders.values()):
+            if encoder.thread is not None and encoder.thread is not threading.current_thread():
+                encoder.thread.join(timeout=2)
+
+    def stats(self):
+        return {
+            'source': str(self.source.source),
+            'running': self.source.running,
+            'frames_captured': self.source.seq,
+            'buffer_depth': len(self.source.buffer),
+            'analysis': self.pool.stats(),
+            'views': {name: encoder.stats() for name, encoder in list(self.encoders.items())}
+        }
+
+class CaptureService:
+    # Registry of named camera sources, each with its own capture -> recognition -> encode pipeline.
+    # Sources are opened on first use.
+    def __init__(self, sources, make_detect, views, workers=2, analysis_fps=10, stream_fps=15, buffer_size=4,
+                 metrics=None):
+        self.sources = dict(sources) # {name: device index / URL / file path}
+        # callable(name) -> detect(image); called each time a source is (re)opened, so per-camera
+        # state such as face tracks starts fresh and is never shared between cameras
+        self.make_detect = make_detect
+        self.views = dict(views) # {view name: annotate(image, results)}
+        self.workers = workers
+        self.analysis_fps = analysis_fps
+        self.stream_fps = stream_fps
+        self.buffer_size = buffer_size
+        self.metrics = metrics # Optional metrics.Metrics handed to every stage
+        self.streams = {} # {name: Stream}
+        self.lock = threading.Lock()
+
+    def open(self, name='default'):
+        # Returns the running Stream for a source, starting it if needed; None if it will not open
+        if name not in self.sources:
+            return None
+        with self.lock:
+            stream = self.streams.get(name)
+            if stream is None or not stream.source.running:
+                source = FrameSource(self.sources[name], buffer_size=self.buffer_size, name=name, metrics=self.metrics)
+                if not source.start():
+                    return None
+                pool = AnalysisPool(source, self.make_detect(name), self.workers, self.analysis_fps, metrics=self.metrics)
+                pool.demand.clear() # Until the first viewer attaches
+                stream = Stream(source, pool, self.views, self.stream_fps, metrics=self.metrics)
+                self.streams[name] = stream
+            stream.pool.start()
+            return stream
+
+    def latest_frame(self, name='default'):
+        stream = self.streams.get(name)
+        if stream is None:
+            return None
+        frame = stream.source.latest()
+        return frame.image if frame is not None else None
+
+    def stop(self, name='default'):
+        with self.lock:
+            stream = self.streams.pop(name, None)
+        if stream is not None:
+            stream.stop()
+            return True
+        return False
+
+    def stop_all(self):
+        for name in list(self.streams):
+            self.stop(name)
+
+    def stats(self):
+        return {name: stream.stats() for name, stream in list(self.streams.items())}
@@ -1,10 +1,115 @@
+import csv
 import sqlite3
 import os
+import threading
+import time
 
 DB_PATH = 'attendance.db'
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
+# Per-connection tuning. WAL (set once in init_db, it is stored in the file) lets readers of
+# /attendance run while attendance is being written; NORMAL sync is safe with WAL and avoids an
+# fsync per commit. Negative cache_size is in KiB.
+PRAGMAS = [
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA foreign_keys = OFF'
+]
+BUSY_TIMEOUT = 5.0 # Seconds to wait for the write lock before "database is locked"
+STATEMENT_CACHE = 256 # Prepared statements kept per connection and reused for identical SQL
+
+def connect(path=DB_PATH):
+    # A tuned standalone connection (for long-lived owners such as background threads)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, cached_statements=STATEMENT_CACHE, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+class PooledConnection(sqlite3.Connection):
+    # close() hands the connection back to its pool instead of closing it, so existing
+    # "conn = get_db_connection() ... conn.close()" code keeps working unchanged
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def really_close(self):
+        super().close()
+
+class ConnectionPool:
+    # Connections are handed out per thread: nested get() calls on one thread share a connection,
+    # and once released it goes to an idle stack for the next thread (Flask's dev server starts a
+    # thread per request, so keying only on the thread would open one connection per request).
+    def __init__(self, path=DB_PATH, max_idle=8, row_factory=sqlite3.Row):
+        self.path = path
+        self.max_idle = max_idle
+        self.row_factory = row_factory
+        self.idle = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.opened = 0
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, cached_statements=STATEMENT_CACHE,
+                               check_same_thread=False, factory=PooledConnection)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.row_factory = self.row_factory
+        conn.pool = self
+        self.opened += 1
+        return conn
+
+    def get(self):
+        held = getattr(self.local, 'held', None)
+        if held is not None:
+            self.local.depth += 1
+            return held
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+        if conn is None:
+            conn = self._open()
+        self.local.held = conn
+        self.local.depth = 1
+        return conn
+
+    def release(self, conn):
+        if getattr(self.local, 'held', None) is not conn:
+            conn.really_close() # Not handed out by this thread; do not let it into the idle stack
+            return
+        self.local.depth -= 1
+        if self.local.depth > 0:
+            return
+        self.local.held = None
+        # Never hand an open transaction to the next user
+        if conn.in_transaction:
+            conn.rollback()
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(conn)
+                return
+        conn.really_close()
+
+    def release_thread(self):
+        # Returns whatever this thread still holds, e.g. after a route that returned before conn.close()
+        conn = getattr(self.local, 'held', None)
+        if conn is not None:
+            self.local.depth = 1
+            self.release(conn)
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.really_close()
+
+def init_db(path=DB_PATH):
+    conn = sqlite3.connect(path)
+    # Persistent: every later connection to the file uses the write-ahead log
+    conn.execute('PRAGMA journal_mode = WAL')
     cursor = conn.cursor()
     
     # Lecturers Table
@@ -55,14 +160,197 @@ def init_db():
     ''')
     
     # Add Index for performance
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_sid ON attendance(student_id)')
+    # (student_id, date, time) also serves lookups by student_id alone, so it replaces idx_attendance_sid
+    cursor.execute('DROP INDEX IF EXISTS idx_attendance_sid')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_student_time ON attendance(student_id, date, time)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance(date)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_session ON attendance(session_id)')
+    # Backs the newest-first listing/export (ORDER BY date, time) within each session
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_session_time ON attendance(session_id, date, time)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_token ON sessions(session_token)')
-    
+    # Per-lecturer session counts for attendance rates
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_lecturer ON sessions(lecturer_id)')
+
+    # Aggregates for the dashboard and /api/stats, kept current by the triggers below so reading
+    # them never scans attendance. Databases from before these tables, or whose stats were kept by
+    # older triggers (STATS_VERSION), get a backfill here once.
+    needs_backfill = True
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'counters'").fetchone():
+        row = cursor.execute("SELECT value FROM counters WHERE name = 'stats_version'").fetchone()
+        needs_backfill = row is None or row[0] != STATS_VERSION
+    cursor.executescript(STATS_SCHEMA)
+    unique_attendance(cursor)
     conn.commit()
     conn.close()
+    if needs_backfill:
+        backfill_stats(path)
+
+# Duplicate (session_id, student_id) rows: every row after the earliest of its pair
+DUPLICATES_QUERY = '''
+    SELECT id, session_id, student_id, date, time, status FROM attendance
+    WHERE session_id IS NOT NULL AND id NOT IN
+        (SELECT min(id) FROM attendance WHERE session_id IS NOT NULL GROUP BY session_id, student_id)
+    ORDER BY id
+'''
+
+def unique_attendance(cursor):
+    # One row per student per session, also across server processes that each keep their own
+    # AttendanceWriter (FACEREG_SHARED_MODEL). The unique index replaces idx_attendance_session_student,
+    # but older versions could write duplicates: then the plain index stays and nothing is deleted
+    # here; `python database.py --dedupe` removes them. Returns whether the unique index exists.
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'uq_attendance_session_student'").fetchone():
+        cursor.execute('DROP INDEX IF EXISTS idx_attendance_session_student')
+        return True
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_session_student ON attendance(session_id, student_id)')
+    duplicates = cursor.execute(f'SELECT COUNT(*) FROM ({DUPLICATES_QUERY})').fetchone()[0]
+    if duplicates:
+        print(f"attendance has {duplicates} duplicate (session, student) rows, so the unique index was not created; "
+              f"review and remove them with: python database.py --dedupe")
+        return False
+    cursor.execute('CREATE UNIQUE INDEX uq_attendance_session_student ON attendance(session_id, student_id)')
+    cursor.execute('DROP INDEX idx_attendance_session_student')
+    return True
+
+def dedupe_attendance(path=DB_PATH, dry_run=False):
+    # Deletes every attendance row after the earliest of its (session, student) pair, then creates
+    # the unique index. The rows are printed and saved to <db>.duplicates-<time>.csv first. Run after
+    # init_db, so the current stats triggers (which count each pair once) see the deletes.
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute(DUPLICATES_QUERY).fetchall()
+        print(f"{len(rows)} duplicate attendance rows (the earliest row of each pair is kept)")
+        for row in rows:
+            print("  id {} session {} student {} {} {} {}".format(*row))
+        if dry_run or not rows:
+            return len(rows)
+        backup = f"{path}.duplicates-{time.strftime('%Y%m%d-%H%M%S')}.csv"
+        with open(backup, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['id', 'session_id', 'student_id', 'date', 'time', 'status'])
+            writer.writerows(rows)
+        with conn:
+            conn.executemany('DELETE FROM attendance WHERE id = ?', [(row[0],) for row in rows])
+            unique_attendance(conn.cursor())
+        print(f"Deleted {len(rows)} rows; they are saved in {backup}")
+        return len(rows)
+    finally:
+        conn.close()
+
+# present / sessions_attended count distinct students / sessions, like COUNT(DISTINCT ...) did;
+# first_seen/last_seen are "YYYY-MM-DD HH:MM:SS" of the earliest/latest attendance row.
+# Bump STATS_VERSION when the triggers change what they count: init_db then re-creates them and
+# rebuilds the tables.
+STATS_VERSION = 2
+STATS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS session_stats (
+        session_id INTEGER PRIMARY KEY,
+        present INTEGER NOT NULL DEFAULT 0,
+        first_seen TEXT,
+        last_seen TEXT
+    );
+    CREATE TABLE IF NOT EXISTS student_stats (
+        student_id TEXT PRIMARY KEY,
+        sessions_attended INTEGER NOT NULL DEFAULT 0,
+        first_seen TEXT,
+        last_seen TEXT
+    );
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT OR IGNORE INTO counters (name, value) VALUES ('students', 0), ('sessions', 0);
+
+    -- A (session, student) pair counts once, however many rows it has
+    DROP TRIGGER IF EXISTS trg_attendance_insert;
+    CREATE TRIGGER trg_attendance_insert AFTER INSERT ON attendance BEGIN
+        INSERT INTO session_stats (session_id, present, first_seen, last_seen)
+            VALUES (NEW.session_id, 1, NEW.date || ' ' || NEW.time, NEW.date || ' ' || NEW.time)
+            ON CONFLICT(session_id) DO UPDATE SET
+                present = present + NOT EXISTS (SELECT 1 FROM attendance WHERE session_id = NEW.session_id
+                                                AND student_id = NEW.student_id AND id != NEW.id),
+                first_seen = min(first_seen, excluded.first_seen), last_seen = max(last_seen, excluded.last_seen);
+        INSERT INTO student_stats (student_id, sessions_attended, first_seen, last_seen)
+            VALUES (NEW.student_id, 1, NEW.date || ' ' || NEW.time, NEW.date || ' ' || NEW.time)
+            ON CONFLICT(student_id) DO UPDATE SET
+                sessions_attended = sessions_attended + NOT EXISTS (SELECT 1 FROM attendance WHERE session_id = NEW.session_id
+                                                                    AND student_id = NEW.student_id AND id != NEW.id),
+                first_seen = min(first_seen, excluded.first_seen), last_seen = max(last_seen, excluded.last_seen);
+    END;
+
+    -- Every lookup here is an index seek (uq_attendance_session_student, or idx_attendance_session_student
+    -- while duplicates remain; idx_attendance_session_time; idx_attendance_student_time), so deleting
+    -- n rows costs O(n log n) even for a whole table. The bounds are only re-derived when the deleted
+    -- row was the first or last one.
+    DROP TRIGGER IF EXISTS trg_attendance_delete;
+    CREATE TRIGGER trg_attendance_delete AFTER DELETE ON attendance BEGIN
+        UPDATE session_stats SET
+            present = present - NOT EXISTS (SELECT 1 FROM attendance WHERE session_id = OLD.session_id AND student_id = OLD.student_id),
+            first_seen = CASE WHEN first_seen = OLD.date || ' ' || OLD.time THEN
+                (SELECT date || ' ' || time FROM attendance WHERE session_id = OLD.session_id ORDER BY date, time LIMIT 1)
+                ELSE first_seen END,
+            last_seen = CASE WHEN last_seen = OLD.date || ' ' || OLD.time THEN
+                (SELECT date || ' ' || time FROM attendance WHERE session_id = OLD.session_id ORDER BY date DESC, time DESC LIMIT 1)
+                ELSE last_seen END
+            WHERE session_id = OLD.session_id;
+        UPDATE student_stats SET
+            sessions_attended = sessions_attended - NOT EXISTS (SELECT 1 FROM attendance WHERE session_id = OLD.session_id AND student_id = OLD.student_id),
+            first_seen = CASE WHEN first_seen = OLD.date || ' ' || OLD.time THEN
+                (SELECT date || ' ' || time FROM attendance WHERE student_id = OLD.student_id ORDER BY date, time LIMIT 1)
+                ELSE first_seen END,
+            last_seen = CASE WHEN last_seen = OLD.date || ' ' || OLD.time THEN
+                (SELECT date || ' ' || time FROM attendance WHERE student_id = OLD.student_id ORDER BY date DESC, time DESC LIMIT 1)
+                ELSE last_seen END
+            WHERE student_id = OLD.student_id;
+        DELETE FROM session_stats WHERE session_id = OLD.session_id AND present <= 0;
+        DELETE FROM student_stats WHERE student_id = OLD.student_id AND sessions_attended <= 0;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_students_insert AFTER INSERT ON students BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'students';
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_students_delete AFTER DELETE ON students BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'students';
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_sessions_insert AFTER INSERT ON sessions BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'sessions';
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_sessions_delete AFTER DELETE ON sessions BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'sessions';
+    END;
+'''
+
+def backfill_stats(path=DB_PATH):
+    # Rebuilds the aggregate tables from scratch out of students/sessions/attendance
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            conn.execute('DELETE FROM session_stats')
+            conn.execute('DELETE FROM student_stats')
+            conn.execute('''
+                INSERT INTO session_stats (session_id, present, first_seen, last_seen)
+                SELECT session_id, COUNT(DISTINCT student_id), min(date || ' ' || time), max(date || ' ' || time)
+                FROM attendance GROUP BY session_id
+            ''')
+            conn.execute('''
+                INSERT INTO student_stats (student_id, sessions_attended, first_seen, last_seen)
+                SELECT student_id, COUNT(DISTINCT session_id), min(date || ' ' || time), max(date || ' ' || time)
+                FROM attendance GROUP BY student_id
+            ''')
+            conn.execute("UPDATE counters SET value = (SELECT COUNT(*) FROM students) WHERE name = 'students'")
+            conn.execute("UPDATE counters SET value = (SELECT COUNT(*) FROM sessions) WHERE name = 'sessions'")
+            conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES ('stats_version', ?)", (STATS_VERSION,))
+        sessions, students = conn.execute('SELECT (SELECT COUNT(*) FROM session_stats), (SELECT COUNT(*) FROM student_stats)').fetchone()
+        print(f"Attendance stats rebuilt: {sessions} sessions, {students} students")
+    finally:
+        conn.close()
 
 if __name__ == '__main__':
+    import sys
     init_db()
     print("Database initialized.")
+    # python database.py --backfill : recompute the aggregate tables from the attendance rows
+    if '--backfill' in sys.argv[1:]:
+        backfill_stats()
+    # python database.py --dedupe [--dry-run] : list, save and delete duplicate attendance rows
+    if '--dedupe' in sys.argv[1:]:
+        dedupe_attendance(dry_run='--dry-run' in sys.argv[1:])
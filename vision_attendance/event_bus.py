@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+from collections import deque
+
+class Subscriber:
+    # One open event stream. Events are queued per subscriber, so a slow or reconnecting client
+    # never takes events away from another one.
+    def __init__(self, channel, queue_size):
+        self.channel = channel
+        self.queue = deque(maxlen=queue_size) # Oldest events are dropped if the client stops reading
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+
+    def put(self, event):
+        with self.lock:
+            self.queue.append(event)
+        self.ready.set()
+
+    def get(self, timeout=15.0):
+        # Waits up to timeout for events; returns them all ([] on timeout, e.g. to send a keep-alive)
+        self.ready.wait(timeout)
+        with self.lock:
+            events = list(self.queue)
+            self.queue.clear()
+            self.ready.clear()
+        return events
+
+class EventBus:
+    # In-process publish/subscribe per channel (one channel per attendance session). Event IDs are
+    # increasing across the bus, and each channel keeps its last `history` events so a client that
+    # reconnects with Last-Event-ID receives what it missed. A channel nobody has subscribed to or
+    # published on for `idle` seconds is dropped with its history, as is one that is close()d.
+    def __init__(self, history=256, queue_size=64, idle=600):
+        self.history = history
+        self.queue_size = queue_size
+        self.idle = idle
+        self.lock = threading.Lock()
+        self.last_id = 0
+        # {channel: {'history': deque of (id, kind, data), 'subscribers': set, 'active': monotonic time}}
+        self.channels = {}
+        self.published = 0
+        self.pruned_at = time.monotonic()
+
+    def _channel(self, channel):
+        now = time.monotonic()
+        self._prune(now)
+        state = self.channels.get(channel)
+        if state is None:
+            state = self.channels[channel] = {'history': deque(maxlen=self.history), 'subscribers': set(), 'active': now}
+        state['active'] = now
+        return state
+
+    def _prune(self, now):
+        # Called with the lock held; scans the channels at most a few times per idle period
+        if now - self.pruned_at < self.idle / 4.0:
+            return
+        self.pruned_at = now
+        for channel, state in list(self.channels.items()):
+            if not state['subscribers'] and now - state['active'] > self.idle:
+                del self.channels[channel]
+
+    def close(self, channel):
+        # The channel's session ended: drop its history; open streams simply receive nothing more
+        with self.lock:
+            self.channels.pop(channel, None)
+
+    def publish(self, channel, kind, data):
+        with self.lock:
+            self.last_id += 1
+            event = (self.last_id, kind, data)
+            state = self._channel(channel)
+            state['history'].append(event)
+            subscribers = list(state['subscribers'])
+            self.published += 1
+        for subscriber in subscribers:
+            subscriber.put(event)
+        return event[0]
+
+    def subscribe(self, channel, last_event_id=None):
+        subscriber = Subscriber(channel, self.queue_size)
+        with self.lock:
+            state = self._channel(channel)
+            if last_event_id is not None:
+                for event in state['history']:
+                    if event[0] > last_event_id:
+                        subscriber.put(event)
+            state['subscribers'].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            state = self.channels.get(subscriber.channel)
+            if state is not None:
+                state['subscribers'].discard(subscriber)
+                # The history stays for `idle` seconds, for a client that reconnects
+                state['active'] = time.monotonic()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'channels': len(self.channels),
+                'subscribers': sum(len(s['subscribers']) for s in self.channels.values()),
+                'published': self.published,
+                'last_id': self.last_id
+            }
+
+def format_sse(event):
+    event_id, kind, data = event
+    return f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data)}\n\n"
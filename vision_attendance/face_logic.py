@@ -1,168 +1,1904 @@
 import cv2
+import json
 import os
 import numpy as np
 import pickle
+import struct
+import threading
 import time
+import uuid
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 
-class FaceRecognizer:
-    def __init__(self, dataset_path='uploads', model_dir='models'):
-        self.dataset_path = dataset_path
-        self.model_dir = model_dir
-        self.model_path = os.path.join(model_dir, 'trained_model.yml')
-        self.label_map_path = os.path.join(model_dir, 'label_map.pkl')
-        
+TEMPLATE_SIZE = (200, 200)
+
+# Binary model file (trained_model.bin): magic, format version and JSON header length, then the JSON
+# header (LBP parameters, label table, array offsets) and 64-byte aligned int32 labels, float64 row
+# sums and the float32 gallery in LBPHMatcher's bin-major layout, so it can be memory-mapped as is.
+MODEL_MAGIC = b'FACEREG\x00'
+MODEL_VERSION = 1
+MODEL_PREFIX = struct.Struct('<8sII')
+# Map the gallery instead of reading it. Windows cannot replace a file that is still mapped, so
+# there the model is read into memory and retraining can rename over it.
+MODEL_MMAP = os.name != 'nt'
+
+def _aligned(offset, to=64):
+    return (offset + to - 1) // to * to
+
+# Per-thread OpenCV objects and scratch arrays for the per-frame path. OpenCV objects such as CLAHE
+# are not thread-safe, and reusing buffers through dst=/out= keeps a frame from allocating
+# fresh arrays for every step.
+_thread_state = threading.local()
+
+def thread_buffer(name, shape, dtype=np.uint8):
+    # Reused while shape/dtype stay the same; callers use distinct names for arrays alive at once
+    buffers = getattr(_thread_state, 'buffers', None)
+    if buffers is None:
+        buffers = _thread_state.buffers = {}
+    buf = buffers.get(name)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+        buf = buffers[name] = np.empty(shape, dtype=dtype)
+    return buf
+
+def thread_clahe(clip_limit):
+    cache = getattr(_thread_state, 'clahe', None)
+    if cache is None:
+        cache = _thread_state.clahe = {}
+    clahe = cache.get(clip_limit)
+    if clahe is None:
+        clahe = cache[clip_limit] = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(8,8))
+    return clahe
+
+def is_student_folder(name):
+    # A student folder is a single plain name inside uploads/, never a path that could leave it
+    # ('..', 'a/b', 'a\\b' on Windows) when joined onto the dataset or template cache directory
+    return bool(name) and name not in ('.', '..') and '/' not in name and '\\' not in name \
+        and os.path.basename(name) == name
+
+def folder_entries(student_path):
+    # (file name, size, mtime) for every image in a student folder, in a stable order
+    entries = []
+    for img_name in sorted(os.listdir(student_path)):
+        st = os.stat(os.path.join(student_path, img_name))
+        entries.append((img_name, st.st_size, st.st_mtime_ns))
+    return entries
+
+def load_training_face(img_path, clahe):
+    img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+
+    # Standardize size for training (LBPH needs consistent sizing for best results)
+    img = cv2.resize(img, TEMPLATE_SIZE, interpolation=cv2.INTER_LANCZOS4)
+    # Normalization
+    img = clahe.apply(img)
+    return cv2.GaussianBlur(img, (3, 3), 0)
+
+def preprocess_batch(img_paths):
+    # Unit of work for the training pool: one chunk of image paths in, one list of templates (or None) out.
+    # Module-level so it can be pickled into worker processes.
+    clahe = thread_clahe(2.0)
+    return [load_training_face(img_path, clahe) for img_path in img_paths]
+
+def prepare_face(roi_gray, clahe, out=None):
+    # Live face crop -> recognizer input: 200x200, lighter CLAHE than detection to avoid
+    # over-sharpening noise, light blur. Intermediates use thread scratch; the result goes to
+    # `out` (e.g. a row of a preallocated stack) or a new array.
+    size = (TEMPLATE_SIZE[1], TEMPLATE_SIZE[0])
+    resized = cv2.resize(roi_gray, TEMPLATE_SIZE, dst=thread_buffer('face_resized', size), interpolation=cv2.INTER_LANCZOS4)
+    equalized = clahe.apply(resized, thread_buffer('face_equalized', size))
+    return cv2.GaussianBlur(equalized, (3, 3), 0, dst=out)
+
+def thread_stack(name, count, row_shape, dtype=np.uint8):
+    # First `count` rows of a per-thread (capacity,) + row_shape array; capacity grows in powers of two
+    stack = getattr(_thread_state, 'buffers', {}).get(name)
+    if stack is None or len(stack) < count or stack.shape[1:] != row_shape or stack.dtype != dtype:
+        capacity = 1
+        while capacity < count:
+            capacity *= 2
+        stack = thread_buffer(name, (capacity,) + row_shape, dtype)
+    return stack[:count]
+
+class TemplateCache:
+    # Persistent cache of preprocessed training templates: one uint8 (N, 200, 200) .npy per student.
+    # Rows are keyed by (file name, size, mtime) so unchanged images are never decoded twice,
+    # and cached arrays are memory-mapped instead of read into fresh buffers.
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, 'index.pkl')
+        self._index = None # Read on first use: only training needs it
+        self.dirty = False
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    @property
+    def index(self):
+        # {student_dir: {'entries': folder_entries(), 'rows': [key per cached row]}}
+        if self._index is None:
+            index = {}
+            if os.path.exists(self.index_path):
+                try:
+                    with open(self.index_path, 'rb') as f:
+                        index = pickle.load(f)
+                except Exception as e:
+                    print(f"Template cache index unreadable, rebuilding: {e}")
+            self._index = index
+        return self._index
+
+    def _array_path(self, student_dir):
+        return os.path.join(self.cache_dir, student_dir + '.npy')
+
+    def flush(self):
+        # The index is written once per training run rather than once per student
+        if not self.dirty:
+            return
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+        self.dirty = False
+
+    def _cached_rows(self, student_dir, entries):
+        # Returns (up_to_date, {key: row}) for what is already on disk for this student
+        record = self.index.get(student_dir)
+        if record is None or (record['rows'] and not os.path.exists(self._array_path(student_dir))):
+            return False, {}
+        rows = {key: i for i, key in enumerate(record['rows'])}
+        return record['entries'] == entries, rows
+
+    def missing(self, student_dir, student_path):
+        # Image paths that have to be decoded before this student's templates are current
+        entries = folder_entries(student_path)
+        up_to_date, rows = self._cached_rows(student_dir, entries)
+        if up_to_date:
+            return []
+        return [(key, os.path.join(student_path, key[0])) for key in entries if key not in rows]
+
+    def load(self, student_dir, student_path, decoded=None):
+        # decoded: optional {key: template or None} produced ahead of time (e.g. by the training pool)
+        array_path = self._array_path(student_dir)
+        entries = folder_entries(student_path)
+        up_to_date, rows = self._cached_rows(student_dir, entries)
+        if up_to_date:
+            # Folder unchanged: serve the mapped array as-is
+            if not rows:
+                return np.empty((0,) + TEMPLATE_SIZE, dtype=np.uint8)
+            return np.load(array_path, mmap_mode='r')
+        cached = np.load(array_path, mmap_mode='r') if rows else None
+
+        decoded = decoded or {}
+        clahe = None
+        templates = []
+        keys = []
+        for key in entries:
+            if key in rows:
+                templates.append(cached[rows[key]])
+                keys.append(key)
+                continue
+            if key in decoded:
+                img = decoded[key]
+            else:
+                if clahe is None:
+                    clahe = thread_clahe(2.0)
+                img = load_training_face(os.path.join(student_path, key[0]), clahe)
+            if img is None:
+                continue
+            templates.append(img)
+            keys.append(key)
+
+        if templates:
+            stacked = np.stack(templates)
+        else:
+            stacked = np.empty((0,) + TEMPLATE_SIZE, dtype=np.uint8)
+        # Release the old mapping before replacing the file (required on Windows)
+        del templates, cached
+
+        if len(stacked):
+            tmp_path = array_path + '.tmp.npy'
+            np.save(tmp_path, stacked)
+            os.replace(tmp_path, array_path)
+        elif os.path.exists(array_path):
+            os.remove(array_path)
+        # Undecodable files stay in 'entries' so they do not trigger a rebuild on every call
+        self.index[student_dir] = {'entries': entries, 'rows': keys}
+        self.dirty = True
+        return np.load(array_path, mmap_mode='r') if len(stacked) else stacked
+
+    def drop(self, student_dir):
+        array_path = self._array_path(student_dir)
+        if os.path.exists(array_path):
+            os.remove(array_path)
+        if self.index.pop(student_dir, None) is not None:
+            self.dirty = True
+
+    def prune(self, keep_dirs):
+        for student_dir in [d for d in self.index if d not in keep_dirs]:
+            self.drop(student_dir)
+
+class PrototypeIndex:
+    # Compact gallery for large rosters: k prototype histograms (medoids) per student. A probe is first
+    # matched against the prototypes only, then re-ranked against the full samples of the best
+    # `shortlist` students, so the exhaustive pass shrinks from ~20 samples per student to k.
+    def __init__(self, matcher, prototypes, shortlist):
+        self.matcher = matcher
+        self.k = prototypes
+        self.shortlist = shortlist
+        self.prototypes = {} # {label: (k, hist_size) float32}
+        self.rows = {} # {label: sorted row indices into matcher}
+        self.coarse = None
+
+    @classmethod
+    def build(cls, matcher, prototypes=3, shortlist=8, previous=None):
+        # previous: an index over an earlier gallery; prototypes of labels it already knows are reused
+        # (a label's samples never change without the label being reissued, see FaceRecognizer.enroll)
+        index = cls(matcher, prototypes, shortlist)
+        order = np.argsort(matcher.labels, kind='stable')
+        labels, starts = np.unique(matcher.labels[order], return_index=True)
+        for label, rows in zip(labels, np.split(order, starts[1:])):
+            label = int(label)
+            index.rows[label] = np.sort(rows)
+            if previous is not None and previous.k == prototypes and label in previous.prototypes:
+                index.prototypes[label] = previous.prototypes[label]
+            else:
+                # Column gather on the bin-major gallery: a student's rows sit next to each other
+                index.prototypes[label] = index._medoids(matcher.gallery[:, index.rows[label]].T)
+
+        proto_labels = [label for label, protos in index.prototypes.items() for _ in range(len(protos))]
+        proto_hists = [protos for protos in index.prototypes.values()]
+        index.coarse = matcher._derive(np.concatenate(proto_hists) if proto_hists
+                                       else np.empty((0, matcher.hist_size), dtype=np.float32), proto_labels)
+        return index
+
+    def _medoids(self, histograms):
+        # Most central sample first, then repeatedly the sample farthest from the chosen set (k-center)
+        histograms = np.ascontiguousarray(histograms)
+        if len(histograms) <= self.k:
+            return histograms
+        # Per-student sets are small, so plain dense chi-square row by row beats the sparse gallery path
+        pairwise = np.empty((len(histograms), len(histograms)), dtype=np.float64)
+        tiny = np.finfo(np.float32).tiny
+        for i, hist in enumerate(histograms):
+            diff = histograms - hist
+            np.square(diff, out=diff)
+            diff /= np.maximum(histograms + hist, tiny)
+            pairwise[i] = 2 * diff.sum(axis=1, dtype=np.float64)
+        chosen = [int(pairwise.sum(axis=1).argmin())]
+        nearest = pairwise[chosen[0]].copy()
+        while len(chosen) < self.k:
+            nxt = int(nearest.argmax())
+            chosen.append(nxt)
+            np.minimum(nearest, pairwise[nxt], out=nearest)
+        return histograms[chosen]
+
+    def __len__(self):
+        return len(self.coarse)
+
+    def predict_batch(self, images):
+        if len(images) == 0:
+            return []
+        if len(self.matcher) == 0:
+            return [(-1, np.finfo(np.float64).max)] * len(images)
+
+        histograms = self.matcher.compute_histograms(images, out=self.matcher.query_buffer(len(images)))
+        coarse = self.coarse.distances(histograms)
+        results = []
+        for q in range(len(histograms)):
+            # Students ranked by their closest prototype; keep the first `shortlist` distinct ones
+            candidates = []
+            for i in np.argsort(coarse[q], kind='stable'):
+                label = int(self.coarse.labels[i])
+                if label not in candidates:
+                    candidates.append(label)
+                    if len(candidates) == self.shortlist:
+                        break
+            # Exact re-rank; rows in gallery order keep OpenCV's first-minimum tie rule
+            rows = np.sort(np.concatenate([self.rows[label] for label in candidates]))
+            distances = self.matcher.distances(histograms[q], rows=rows)[0]
+            best = int(distances.argmin())
+            results.append((int(self.matcher.labels[rows[best]]), float(distances[best])))
+        return results
+
+    def predict(self, image):
+        return self.predict_batch([image])[0]
+
+# Cascade settings for detect_faces: the frame is resized to target_width, then detectMultiScale runs
+# with scale_factor and min_neighbors for faces between min_size and max_size pixels of the resized
+# image (max_size 0 = no upper bound). scale_factor sets the depth of the image pyramid and is most
+# of the detection cost. bench/detect_tuning.py sweeps these on a recorded clip.
+DetectionParams = namedtuple('DetectionParams', ['target_width', 'scale_factor', 'min_neighbors', 'min_size', 'max_size'], defaults=(0,))
+
+# Per-camera presets, chosen in app.py with FACEREG_DETECTION. Tuned with bench/detect_tuning.py on
+# its synthetic scenes; entries saved by the tuner (--save) in models/detection_presets.json are added.
+DETECTION_PRESETS = {
+    'default': DetectionParams(400, 1.05, 10, 40), # Settings of earlier releases
+    'hall': DetectionParams(640, 1.15, 6, 24), # Lecture hall: back-row faces are too small at 400 px
+    'kiosk': DetectionParams(320, 1.15, 10, 64) # One person close to the camera
+}
+
+def load_detection_presets(path):
+    # Built-in presets plus those saved by the tuner; a missing or unreadable file adds nothing
+    presets = dict(DETECTION_PRESETS)
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+        for name, values in saved.items():
+            presets[name] = DetectionParams(**values)
+    except (OSError, ValueError, TypeError) as e:
+        if os.path.exists(path):
+            print(f"Ignoring detection presets in {path}: {e}")
+    return presets
+
+def save_detection_preset(path, name, params):
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        saved = {}
+    saved[name] = params._asdict()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(saved, f, indent=2)
+    os.replace(tmp_path, path)
+
+# Face detector backends. detect(images, params) takes a batch of images (the frame regions a
+# MotionGate picked, or several uploaded frames) and returns one list of (x, y, w, h) boxes per
+# image, in that image's coordinates. `color` says whether the backend wants BGR images or
+# CLAHE-equalised gray ones. Every backend keeps one model instance per thread, since neither
+# CascadeClassifier nor a DNN net is safe to share between threads; load() creates this thread's.
+def _size_ok(w, params):
+    return w >= params.min_size and (not params.max_size or w <= params.max_size)
+
+def _clip_box(x, y, w, h, width, height):
+    x0, y0 = max(0, int(x)), max(0, int(y))
+    return (x0, y0, min(int(x + w), width) - x0, min(int(y + h), height) - y0)
+
+class CascadeDetector:
+    # OpenCV LBP/Haar cascade: fast, frontal faces only. Uses all of DetectionParams.
+    color = False
+
+    def __init__(self, path, name='cascade'):
+        self.path = path
+        self.name = name
+        self._local = threading.local()
+
+    def load(self):
+        cascade = getattr(self._local, 'cascade', None)
+        if cascade is None:
+            cascade = cv2.CascadeClassifier(self.path)
+            if cascade.empty():
+                raise RuntimeError(f"Cannot load face cascade {self.path}")
+            self._local.cascade = cascade
+        return cascade
+
+    def detect(self, images, params):
+        cascade = self.load()
+        min_size = (params.min_size, params.min_size)
+        max_size = (params.max_size, params.max_size)
+        return [list(cascade.detectMultiScale(image, params.scale_factor, params.min_neighbors,
+                                              minSize=min_size, maxSize=max_size)) for image in images]
+
+class YuNetDetector:
+    # OpenCV's FaceDetectorYN with the YuNet ONNX model on CPU: also finds tilted and partly turned
+    # faces. The network input is the image itself, so target_width sets the cost; scale_factor and
+    # min_neighbors do not apply, min_size/max_size filter the results. Images of a batch run one
+    # after another through the same instance (its input size is only reset when it changes).
+    color = True
+    name = 'yunet'
+
+    def __init__(self, model_path, score_threshold=0.8, nms_threshold=0.3, top_k=500):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"YuNet model not found: {model_path}")
+        self.model_path = model_path
+        self.score_threshold = score_threshold
+        self.nms_threshold = nms_threshold
+        self.top_k = top_k
+        self._local = threading.local()
+
+    def load(self):
+        detector = getattr(self._local, 'detector', None)
+        if detector is None:
+            detector = cv2.FaceDetectorYN.create(self.model_path, '', (320, 320), self.score_threshold,
+                                                 self.nms_threshold, self.top_k,
+                                                 cv2.dnn.DNN_BACKEND_OPENCV, cv2.dnn.DNN_TARGET_CPU)
+            self._local.detector = detector
+            self._local.size = (320, 320)
+        return detector
+
+    def detect(self, images, params):
+        detector = self.load()
+        results = []
+        for image in images:
+            height, width = image.shape[:2]
+            if self._local.size != (width, height):
+                detector.setInputSize((width, height))
+                self._local.size = (width, height)
+            _, faces = detector.detect(image)
+            # Rows: x, y, w, h, five landmarks (x, y), score
+            boxes = [] if faces is None else [_clip_box(f[0], f[1], f[2], f[3], width, height) for f in faces]
+            results.append([b for b in boxes if _size_ok(b[2], params)])
+        return results
+
+class SSDDetector:
+    # OpenCV DNN ResNet-10 SSD (Caffe) on CPU. Every image is resized to input_size x input_size,
+    # and a whole batch goes through the network in one forward pass. min_size/max_size filter
+    # the results; the other DetectionParams do not apply.
+    color = True
+    name = 'ssd'
+
+    def __init__(self, prototxt_path, weights_path, confidence=0.6, input_size=300):
+        for path in (prototxt_path, weights_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"SSD model file not found: {path}")
+        self.prototxt_path = prototxt_path
+        self.weights_path = weights_path
+        self.confidence = confidence
+        self.input_size = input_size
+        self._local = threading.local()
+
+    def load(self):
+        net = getattr(self._local, 'net', None)
+        if net is None:
+            net = cv2.dnn.readNetFromCaffe(self.prototxt_path, self.weights_path)
+            net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            self._local.net = net
+        return net
+
+    def detect(self, images, params):
+        if not len(images):
+            return []
+        net = self.load()
+        size = (self.input_size, self.input_size)
+        net.setInput(cv2.dnn.blobFromImages(images, 1.0, size, (104.0, 177.0, 123.0)))
+        # (1, 1, N, 7): image index, class, confidence, box corners as fractions of the image
+        detections = net.forward()
+        results = [[] for _ in images]
+        for index, _, confidence, x1, y1, x2, y2 in detections.reshape(-1, 7):
+            index = int(index)
+            if confidence < self.confidence or not 0 <= index < len(images):
+                continue
+            height, width = images[index].shape[:2]
+            box = _clip_box(x1 * width, y1 * height, (x2 - x1) * width, (y2 - y1) * height, width, height)
+            if box[2] > 0 and box[3] > 0 and _size_ok(box[2], params):
+                results[index].append(box)
+        return results
+
+# Model files of the DNN backends, looked up in the model directory. They are not shipped with
+# the application: YuNet is in the OpenCV model zoo (face_detection_yunet), the SSD in OpenCV's
+# samples/dnn/face_detector (deploy.prototxt and its res10 weights).
+DETECTOR_MODELS = {
+    'yunet': ('face_detection_yunet_2023mar.onnx',),
+    'ssd': ('deploy.prototxt', 'res10_300x300_ssd_iter_140000.caffemodel')
+}
+
+def make_detector(name='cascade', model_dir='models', threads=None):
+    # Detector backend by name: 'cascade' (LBP, or Haar where this OpenCV build lacks it), 'haar',
+    # 'yunet' or 'ssd'. threads sets OpenCV's thread pool, which is process-wide and also used by
+    # the DNN layers; None leaves OpenCV's default.
+    if threads:
+        cv2.setNumThreads(int(threads))
+    if name == 'cascade':
         # Using LBP Cascade for significantly faster detection compared to Haar
         # Fallback to Haar if LBP is unavailable
         lbp_path = cv2.data.haarcascades + 'lbpcascade_frontalface_improved.xml'
         if os.path.exists(lbp_path):
-            self.face_cascade = cv2.CascadeClassifier(lbp_path)
-        else:
-            self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        
+            return CascadeDetector(lbp_path)
+        return CascadeDetector(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    if name == 'haar':
+        return CascadeDetector(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml', name='haar')
+    if name in DETECTOR_MODELS:
+        paths = [os.path.join(model_dir, f) for f in DETECTOR_MODELS[name]]
+        return YuNetDetector(*paths) if name == 'yunet' else SSDDetector(*paths)
+    raise ValueError(f"Unknown face detector: {name}")
+
+# Everything recognition needs, published as one object so readers never see a model without its labels.
+# index is the optional PrototypeIndex over recognizer (compact gallery mode).
+ModelSnapshot = namedtuple('ModelSnapshot', ['version', 'recognizer', 'label_map', 'trained', 'index'], defaults=(None,))
+
+def lbp_sampling(radius, neighbors):
+    # Circular neighbourhood exactly as OpenCV's elbp(): offsets plus bilinear weights, in float32
+    one = np.float32(1)
+    points = []
+    for n in range(neighbors):
+        x = np.float32(radius * np.cos(2.0 * np.pi * n / float(neighbors)))
+        y = np.float32(-radius * np.sin(2.0 * np.pi * n / float(neighbors)))
+        fx, fy = int(np.floor(x)), int(np.floor(y))
+        cx, cy = int(np.ceil(x)), int(np.ceil(y))
+        tx, ty = x - np.float32(fx), y - np.float32(fy)
+        points.append((fx, fy, cx, cy, (one - tx) * (one - ty), tx * (one - ty), (one - tx) * ty, tx * ty))
+    return points
+
+class LBPHMatcher:
+    # NumPy re-implementation of OpenCV's LBPHFaceRecognizer with the same histograms, the same
+    # chi-square distance (to ~1e-5) and the same nearest-neighbour rule. The whole gallery is one
+    # contiguous float32 matrix, so a probe is scored against every sample in one vectorized pass
+    # and several faces can be predicted together. Models are saved with write_binary(); write()
+    # and read() keep OpenCV's YAML layout for interop and for converting older models.
+    def __init__(self, radius=1, neighbors=8, grid_x=8, grid_y=8, block_bins=128):
         # RADIUS=1, NEIGHBORS=8 is the standard set.
-        self.recognizer = cv2.face.LBPHFaceRecognizer_create(radius=1, neighbors=8, grid_x=8, grid_y=8)
-        self.trained = False
-        self.label_map = {} # {int_label: student_id}
-        self.last_train_time = 0 # Prevent excessive training calls
+        self.radius = radius
+        self.neighbors = neighbors
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.block_bins = block_bins # Histogram bins scored per pass; keeps scratch buffers cache-sized
+        self.hist_size = grid_x * grid_y * (2 ** neighbors)
+        self._sampling = lbp_sampling(radius, neighbors)
+        self.set_gallery(np.empty((0, self.hist_size), dtype=np.float32), np.empty(0, dtype=np.int32))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def set_gallery(self, histograms, labels):
+        # Stored bin-major, shape (hist_size, N): a query only touches the rows of its non-empty bins,
+        # and each of those rows is contiguous across the whole gallery
+        self.gallery = np.ascontiguousarray(np.asarray(histograms, dtype=np.float32).T)
+        self.labels = np.ascontiguousarray(labels, dtype=np.int32).ravel()
+        self.row_sums = self.gallery.sum(axis=0, dtype=np.float64)
+
+    @property
+    def histograms(self):
+        # (N, hist_size) view, one histogram per training image as OpenCV exposes them
+        return self.gallery.T
+
+    def _derive(self, histograms, labels):
+        matcher = LBPHMatcher(self.radius, self.neighbors, self.grid_x, self.grid_y, self.block_bins)
+        matcher.set_gallery(histograms, labels)
+        return matcher
+
+    def compute_histograms(self, images, batch_size=1, out=None):
+        # Spatial LBP histograms for a stack/list of equally sized grayscale images, shape (N, hist_size).
+        # One image per pass measured fastest: the float32 scratch planes then stay in cache.
+        # `out` may be a caller's scratch array for histograms that are only needed transiently.
+        if out is None:
+            out = np.empty((len(images), self.hist_size), dtype=np.float32)
+        for start in range(0, len(images), batch_size):
+            chunk = images[start:start + batch_size]
+            src = thread_buffer('lbp_src', (len(chunk),) + np.shape(chunk[0]), np.float32)
+            for i, image in enumerate(chunk):
+                src[i] = image
+            self._spatial_histograms(src, out[start:start + len(chunk)])
+        return out
+
+    def _spatial_histograms(self, src, out):
+        # Writes the normalised histograms of `src` (float32, (count, h, w)) into `out`. All planes
+        # are per-thread scratch arrays, so repeated calls allocate only bincount's result.
+        count, height, width = src.shape
+        r = self.radius
+        rows, cols = height - 2 * r, width - 2 * r
+        plane = (count, rows, cols)
+        center = src[:, r:r + rows, r:r + cols]
+        code_type = np.uint8 if self.neighbors <= 8 else np.int64
+        codes = thread_buffer('lbp_codes', plane, code_type)
+        codes.fill(0)
+        t = thread_buffer('lbp_t', plane, np.float32)
+        term = thread_buffer('lbp_term', plane, np.float32)
+        bit = thread_buffer('lbp_bit', plane, np.bool_)
+        near = thread_buffer('lbp_near', plane, np.bool_)
+        shifted = thread_buffer('lbp_shifted', plane, code_type)
+        eps = np.finfo(np.float32).eps
+        for n, (fx, fy, cx, cy, w1, w2, w3, w4) in enumerate(self._sampling):
+            # Same expression order as elbp() so float32 rounding matches bit for bit:
+            # ((w1*a + w2*b) + w3*c) + w4*d
+            np.multiply(w1, src[:, r + fy:r + fy + rows, r + fx:r + fx + cols], out=t)
+            np.multiply(w2, src[:, r + fy:r + fy + rows, r + cx:r + cx + cols], out=term)
+            t += term
+            np.multiply(w3, src[:, r + cy:r + cy + rows, r + fx:r + fx + cols], out=term)
+            t += term
+            np.multiply(w4, src[:, r + cy:r + cy + rows, r + cx:r + cx + cols], out=term)
+            t += term
+            # bit = (t > center) | (|t - center| < eps)
+            np.greater(t, center, out=bit)
+            np.subtract(t, center, out=term)
+            np.abs(term, out=term)
+            np.less(term, eps, out=near)
+            bit |= near
+            np.copyto(shifted, bit)
+            np.left_shift(shifted, n, out=shifted)
+            codes |= shifted
+
+        # Grid cells use integer division, so trailing rows/cols are ignored just like OpenCV
+        cell_h, cell_w = rows // self.grid_y, cols // self.grid_x
+        cells = self.grid_x * self.grid_y
+        patterns = 2 ** self.neighbors
+        codes = codes[:, :cell_h * self.grid_y, :cell_w * self.grid_x]
+        codes = codes.reshape(count, self.grid_y, cell_h, self.grid_x, cell_w).transpose(0, 1, 3, 2, 4)
+        # One bincount for the whole batch: offset every cell (and image) into its own bin range.
+        # Adding into an index buffer laid out cell by cell does the transpose in the same pass.
+        offsets = ((np.arange(self.grid_y)[:, None] * self.grid_x + np.arange(self.grid_x)[None, :]) * patterns)
+        offsets = offsets[None, :, :, None, None] + (np.arange(count) * self.hist_size)[:, None, None, None, None]
+        index = thread_buffer('lbp_index', (count, self.grid_y, self.grid_x, cell_h, cell_w), np.intp)
+        np.add(codes, offsets, out=index, casting='unsafe')
+        hist = np.bincount(index.ravel(), minlength=count * self.hist_size).reshape(count, self.hist_size)
+        np.multiply(hist, np.float32(1.0 / (cell_h * cell_w)), out=out, dtype=np.float32, casting='unsafe')
+        return out
+
+    def train(self, images, labels):
+        self.set_gallery(self.compute_histograms(images), labels)
+
+    def with_samples(self, images, labels):
+        # Copy-on-write update(): returns a new matcher, the current one stays valid for readers
+        histograms = self.compute_histograms(images)
+        return self._derive(np.concatenate([self.histograms, histograms]),
+                            np.concatenate([self.labels, np.asarray(labels, dtype=np.int32).ravel()]))
+
+    def without_label(self, label):
+        keep = self.labels != label
+        return self._derive(self.histograms[keep], self.labels[keep])
+
+    def distances(self, query_histograms, rows=None):
+        # Chi-square (HISTCMP_CHISQR_ALT) from each query to every gallery sample, shape (Q, N).
+        # Per bin, (g - q)^2 / (g + q) = g - 3q + 4q^2 / (g + q), and bins where the query is empty
+        # reduce to g. Summed: d = 2 * (row_sum - 3 * sum(q) + 4 * sum(q^2 / (g + q))) over the query's
+        # non-empty bins only, and the last sum is a matrix-vector product against 1 / (g + q).
+        # rows restricts scoring to a subset of gallery samples (columns of the result follow it).
+        query_histograms = np.asarray(query_histograms, dtype=np.float32).reshape(-1, self.hist_size)
+        row_sums = self.row_sums if rows is None else self.row_sums[rows]
+        result = np.empty((len(query_histograms), len(row_sums)), dtype=np.float64)
+        for q, query in enumerate(query_histograms):
+            support = np.flatnonzero(query)
+            values = query[support]
+            acc = row_sums - 3 * values.sum(dtype=np.float64)
+            for start in range(0, len(support), self.block_bins):
+                block = values[start:start + self.block_bins]
+                bins = support[start:start + self.block_bins]
+                if rows is None:
+                    # Gathered into thread scratch, which is then overwritten in place
+                    scratch = thread_buffer('chisq_block', (self.block_bins, len(row_sums)), np.float32)
+                    inv = np.take(self.gallery, bins, axis=0, out=scratch[:len(bins)])
+                else:
+                    # Fancy indexing: a private copy that can be overwritten in place
+                    inv = self.gallery[np.ix_(bins, rows)]
+                inv += block[:, None]
+                np.reciprocal(inv, out=inv)
+                acc += 4 * (np.square(block) @ inv)
+            result[q] = acc
+        result *= 2
+        # The expanded form can land a hair below zero on an exact match
+        np.maximum(result, 0, out=result)
+        return result
+
+    def query_buffer(self, count):
+        # Per-thread scratch for query histograms that are only needed during one call
+        return thread_stack('query_histograms', count, (self.hist_size,), np.float32)
+
+    def predict_batch(self, images):
+        # [(label, distance)] per image; (-1, DBL_MAX) with an empty gallery, like OpenCV
+        if len(images) == 0:
+            return []
+        if len(self.labels) == 0:
+            return [(-1, np.finfo(np.float64).max)] * len(images)
+        distances = self.distances(self.compute_histograms(images, out=self.query_buffer(len(images))))
+        best = distances.argmin(axis=1) # First minimum wins, as in OpenCV's strict '<' scan
+        return [(int(self.labels[i]), float(distances[q, i])) for q, i in enumerate(best)]
+
+    def predict(self, image):
+        return self.predict_batch([image])[0]
+
+    def write(self, path):
+        # Same layout as LBPHFaceRecognizer.write(), so OpenCV can read it back too
+        fs = cv2.FileStorage(path, cv2.FILE_STORAGE_WRITE)
+        fs.startWriteStruct('opencv_lbphfaces', cv2.FileNode_MAP)
+        fs.write('threshold', float(np.finfo(np.float64).max))
+        fs.write('radius', self.radius)
+        fs.write('neighbors', self.neighbors)
+        fs.write('grid_x', self.grid_x)
+        fs.write('grid_y', self.grid_y)
+        fs.startWriteStruct('histograms', cv2.FileNode_SEQ)
+        for hist in self.histograms:
+            fs.write('', np.ascontiguousarray(hist).reshape(1, -1))
+        fs.endWriteStruct()
+        fs.write('labels', self.labels.reshape(-1, 1))
+        fs.startWriteStruct('labelsInfo', cv2.FileNode_SEQ)
+        fs.endWriteStruct()
+        fs.endWriteStruct()
+        fs.release()
+
+    def write_binary(self, path, label_map):
+        # Writes the MODEL_MAGIC format next to `path` and renames it into place, so readers see
+        # either the old model or the new one, never a partial file. The label table goes in the
+        # same file, so the model and its student IDs always change together.
+        arrays = [
+            ('labels', np.ascontiguousarray(self.labels, dtype='<i4')),
+            ('row_sums', np.ascontiguousarray(self.row_sums, dtype='<f8')),
+            ('gallery', np.ascontiguousarray(self.gallery, dtype='<f4'))
+        ]
+        offsets, end = {}, 0
+        for name, array in arrays:
+            offsets[name] = end
+            end = _aligned(end + array.nbytes)
+        header = json.dumps({
+            'radius': self.radius, 'neighbors': self.neighbors, 'grid_x': self.grid_x, 'grid_y': self.grid_y,
+            'hist_size': self.hist_size, 'count': len(self.labels), 'offsets': offsets,
+            'label_table': sorted([int(label), student_id] for label, student_id in label_map.items())
+        }).encode('utf-8')
+        data_start = _aligned(MODEL_PREFIX.size + len(header))
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MODEL_PREFIX.pack(MODEL_MAGIC, MODEL_VERSION, len(header)))
+            f.write(header)
+            for name, array in arrays:
+                f.seek(data_start + offsets[name])
+                f.write(array.data)
+            f.truncate(data_start + end)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def read_binary(cls, path, mmap=True):
+        # Returns (matcher, label_map). With mmap the gallery stays in the file and pages in as
+        # recognition touches it; labels and row sums are small and always read.
+        with open(path, 'rb') as f:
+            magic, version, header_len = MODEL_PREFIX.unpack(f.read(MODEL_PREFIX.size))
+            if magic != MODEL_MAGIC:
+                raise ValueError(f"{path} is not a FaceReg model file")
+            if version > MODEL_VERSION:
+                raise ValueError(f"{path} uses model format {version}; this version reads up to {MODEL_VERSION}")
+            header = json.loads(f.read(header_len).decode('utf-8'))
+        data_start = _aligned(MODEL_PREFIX.size + header_len)
+        matcher = cls(header['radius'], header['neighbors'], header['grid_x'], header['grid_y'])
+        if header['hist_size'] != matcher.hist_size:
+            raise ValueError(f"{path}: histogram size {header['hist_size']} does not match its LBP parameters")
+        label_map = {label: student_id for label, student_id in header['label_table']}
+
+        count = header['count']
+        if count:
+            def array(name, dtype, shape):
+                offset = data_start + header['offsets'][name]
+                if mmap:
+                    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+                return np.fromfile(path, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+            matcher.labels = np.array(array('labels', '<i4', (count,)), dtype=np.int32)
+            matcher.row_sums = np.array(array('row_sums', '<f8', (count,)), dtype=np.float64)
+            matcher.gallery = array('gallery', '<f4', (matcher.hist_size, count))
+        return matcher, label_map
+
+    @classmethod
+    def read(cls, path):
+        # Parse with OpenCV's own loader so any model it wrote is accepted
+        recognizer = cv2.face.LBPHFaceRecognizer_create()
+        recognizer.read(path)
+        matcher = cls(recognizer.getRadius(), recognizer.getNeighbors(), recognizer.getGridX(), recognizer.getGridY())
+        histograms = recognizer.getHistograms()
+        if histograms:
+            matcher.set_gallery(np.vstack(histograms), recognizer.getLabels())
+        return matcher
+
+def convert_legacy_model(yaml_path, label_map_path, model_path):
+    # trained_model.yml + label_map.pkl -> trained_model.bin. The old files are left in place (the
+    # next save_model removes them), so a conversion can be repeated or rolled back.
+    recognizer = LBPHMatcher.read(yaml_path)
+    with open(label_map_path, 'rb') as f:
+        label_map = pickle.load(f)
+    recognizer.write_binary(model_path, label_map)
+    print(f"Converted {yaml_path} to {model_path} ({len(recognizer)} histograms, {len(label_map)} students)")
+    return recognizer, label_map
+
+class FaceRecognizer:
+    def __init__(self, dataset_path='uploads', model_dir='models', workers=1, pool='thread', chunk_size=32,
+                 prototypes=0, shortlist=8, metrics=None, lazy=False, detector=None):
+        self.dataset_path = dataset_path
+        self.model_dir = model_dir
+        # Compact gallery mode: prototypes > 0 keeps that many medoids per student for a two-stage search
+        self.prototypes = prototypes
+        self.shortlist = shortlist
+        # Training preprocessing fan-out: cv2 releases the GIL, so threads scale; 'process' is also available
+        self.workers = max(1, int(workers))
+        self.pool = pool
+        self.chunk_size = chunk_size
+        self.model_path = os.path.join(model_dir, 'trained_model.bin')
+        # Earlier releases saved OpenCV YAML plus a pickled label map; load_model converts them once
+        self.legacy_model_path = os.path.join(model_dir, 'trained_model.yml')
+        self.legacy_label_map_path = os.path.join(model_dir, 'label_map.pkl')
+        self.enrollment_path = os.path.join(model_dir, 'enrollment.pkl')
+        self.templates = TemplateCache(os.path.join(model_dir, 'templates'))
+        
+        # One detector for everything: the camera pipeline, uploads and the crops of enrolment captures
+        self.detector = detector or make_detector('cascade')
+        self.batcher = None # Optional RecognitionBatcher shared by all callers of recognize_faces
+        self.metrics = metrics # Optional metrics.Metrics; detection, recognition and model loads are timed when set
+        self.detection = DETECTION_PRESETS['default'] # Cascade settings when detect_faces gets none
+        self.generation = None # Optional model_share.ModelGeneration, bumped after each save so other processes reload
+        
+        # Recognition reads self.snapshot once per frame; training builds a new one off to the side and swaps it in
+        self.snapshot = ModelSnapshot(0, LBPHMatcher(), {}, False) # label_map: {int_label: student_id}
+        self.enrolled = {} # {student_id: image signature} of what the model currently holds
+        self._train_lock = threading.RLock() # Serialises train/enroll/remove/sync; recognition never takes it
+        # lazy: the saved model is loaded by warm_up() or by the first recognition/training call
+        # instead of here, so constructing the engine costs nothing at application start-up
+        self._model_ready = False
+        self._load_lock = threading.Lock()
         
         if not os.path.exists(self.model_dir):
             os.makedirs(self.model_dir)
             
-        self.load_model()
+        if not lazy:
+            self.detector.load() # Load once up front so a bad model path fails at startup
+            self.ensure_model()
+
+    # Read-only views of the current snapshot
+    @property
+    def recognizer(self):
+        return self.snapshot.recognizer
+
+    @property
+    def label_map(self):
+        return self.snapshot.label_map
+
+    @property
+    def trained(self):
+        return self.snapshot.trained
+
+    def _publish(self, recognizer, label_map, trained=True, incremental=False):
+        # A single attribute assignment, so the model and its labels change together.
+        # incremental: only some labels changed, so the prototype index can reuse the rest.
+        index = None
+        if self.prototypes and trained:
+            previous = self.snapshot.index if incremental else None
+            index = PrototypeIndex.build(recognizer, self.prototypes, self.shortlist, previous)
+        self.snapshot = ModelSnapshot(self.snapshot.version + 1, recognizer, label_map, trained, index)
+        return self.snapshot.version
+
+    def ensure_model(self):
+        # Loads the saved model once; later calls (and concurrent first callers) return straight away
+        if self._model_ready:
+            return
+        with self._load_lock:
+            if not self._model_ready:
+                self.load_model()
+                self._model_ready = True
+
+    def warm_up(self):
+        # Background start-up work for a lazy engine: load the model, check the detector loads,
+        # and read the mapped gallery once so its pages are resident before the first face
+        start = time.perf_counter()
+        self.ensure_model()
+        self.detector.load()
+        gallery = self.recognizer.gallery
+        if gallery.size:
+            gallery.sum(dtype=np.float64)
+        return time.perf_counter() - start
+
+    def dataset_changed(self):
+        # Cheap start-up check for a sync: has uploads/ changed since the model was saved? Adding or
+        # removing an image (or a student folder) updates the folder's mtime, so this costs one stat
+        # per student instead of one per image. Images overwritten in place are only seen by /train.
+        self.ensure_model()
+        if not os.path.exists(self.dataset_path):
+            return False
+        if not self.trained or not self.enrolled or not os.path.exists(self.model_path):
+            return True
+        saved = os.stat(self.model_path).st_mtime_ns
+        if os.stat(self.dataset_path).st_mtime_ns > saved:
+            return True
+        folders = 0
+        for entry in os.scandir(self.dataset_path):
+            if entry.is_dir():
+                folders += 1
+                if entry.name not in self.enrolled or entry.stat().st_mtime_ns > saved:
+                    return True
+        return folders != len(self.enrolled)
 
     def load_model(self):
-        if os.path.exists(self.model_path) and os.path.exists(self.label_map_path):
+        if (not os.path.exists(self.model_path) and os.path.exists(self.legacy_model_path)
+                and os.path.exists(self.legacy_label_map_path)):
+            try:
+                convert_legacy_model(self.legacy_model_path, self.legacy_label_map_path, self.model_path)
+            except Exception as e:
+                print(f"Error converting model: {e}")
+        if os.path.exists(self.model_path):
+            start = time.perf_counter()
             try:
-                self.recognizer.read(self.model_path)
-                with open(self.label_map_path, 'rb') as f:
-                    self.label_map = pickle.load(f)
-                self.trained = True
+                recognizer, label_map = LBPHMatcher.read_binary(self.model_path, mmap=MODEL_MMAP)
+                if os.path.exists(self.enrollment_path):
+                    with open(self.enrollment_path, 'rb') as f:
+                        self.enrolled = pickle.load(f)
+                self._publish(recognizer, label_map)
+                if self.metrics is not None:
+                    self.metrics.observe('facereg_model_load_seconds', time.perf_counter() - start)
                 print("Model loaded successfully.")
             except Exception as e:
                 print(f"Error loading model: {e}")
 
-    def save_model(self):
+    def save_model(self, recognizer=None, label_map=None):
+        # Defaults to the live snapshot; training passes the model it is about to publish
+        recognizer = recognizer if recognizer is not None else self.recognizer
+        label_map = label_map if label_map is not None else self.label_map
         try:
-            self.recognizer.write(self.model_path)
-            with open(self.label_map_path, 'wb') as f:
-                pickle.dump(self.label_map, f)
+            recognizer.write_binary(self.model_path, label_map)
+            tmp_path = self.enrollment_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(self.enrolled, f)
+            os.replace(tmp_path, self.enrollment_path)
+            # A legacy model left beside the new one would be stale
+            for path in (self.legacy_model_path, self.legacy_label_map_path):
+                if os.path.exists(path): os.remove(path)
+            if self.generation is not None:
+                self.generation.bump()
             print("Model saved to disk.")
         except Exception as e:
             print(f"Error saving model: {e}")
 
-    def train(self, force=False):
-        # Optimization: Cooldown to avoid CPU spikes on rapid registrations
-        current_time = time.time()
-        if not force and (current_time - self.last_train_time < 5):
-            print("Training skipped: Cooldown active.")
-            return True
-            
+    def _image_signature(self, student_path):
+        # Cheap fingerprint of a student's folder: changes whenever an image is added, removed or rewritten
+        return tuple(folder_entries(student_path))
+
+    def _load_student_faces(self, student_dir):
+        # Preprocessed templates come from the on-disk cache; only new or changed JPEGs are decoded
+        student_path = os.path.join(self.dataset_path, student_dir)
+        return list(self.templates.load(student_dir, student_path))
+
+    def _preload_templates(self, student_dirs):
+        # Decode and preprocess every uncached image of these students on the worker pool, in chunks,
+        # and write each student's templates into the cache as soon as all of its chunks are back.
+        jobs = []
+        for student_dir in student_dirs:
+            student_path = os.path.join(self.dataset_path, student_dir)
+            for key, img_path in self.templates.missing(student_dir, student_path):
+                jobs.append((student_dir, key, img_path))
+        if not jobs:
+            return
+
+        chunks = [jobs[i:i + self.chunk_size] for i in range(0, len(jobs), self.chunk_size)]
+        path_chunks = [[img_path for _, _, img_path in chunk] for chunk in chunks]
+        if self.workers > 1 and len(chunks) > 1:
+            executor_cls = ProcessPoolExecutor if self.pool == 'process' else ThreadPoolExecutor
+            executor = executor_cls(max_workers=self.workers)
+            batches = executor.map(preprocess_batch, path_chunks)
+        else:
+            executor = None
+            batches = map(preprocess_batch, path_chunks)
+
+        current_dir, decoded = None, {}
+        try:
+            # Jobs are grouped by student and map() yields in order, so a new student means the last one is done
+            for chunk, batch in zip(chunks, batches):
+                for (student_dir, key, _), template in zip(chunk, batch):
+                    if student_dir != current_dir:
+                        if current_dir is not None:
+                            self.templates.load(current_dir, os.path.join(self.dataset_path, current_dir), decoded)
+                        current_dir, decoded = student_dir, {}
+                    decoded[key] = template
+            if current_dir is not None:
+                self.templates.load(current_dir, os.path.join(self.dataset_path, current_dir), decoded)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def _label_for(self, student_dir):
+        for label, name in self.label_map.items():
+            if name == student_dir:
+                return label
+        return None
+
+    def _next_label(self):
+        # Labels are never renumbered, so a student keeps the same id across retrains and restarts
+        return max(self.label_map) + 1 if self.label_map else 0
+
+    def _clear_model(self):
+        self.enrolled = {}
+        for path in (self.model_path, self.legacy_model_path, self.legacy_label_map_path, self.enrollment_path):
+            if os.path.exists(path): os.remove(path)
+        if self.generation is not None:
+            self.generation.bump()
+        self._publish(LBPHMatcher(), {}, trained=False)
+
+    def reload_model(self):
+        # Picks up a model saved by another process; no file means that process cleared the model
+        with self._load_lock:
+            if os.path.exists(self.model_path):
+                self.load_model()
+            elif self.trained:
+                self._publish(LBPHMatcher(), {}, trained=False)
+            self._model_ready = True
+
+    def train(self):
+        self.ensure_model() # Label ids and enrolment state come from the saved model
+        with self._train_lock:
+            return self._train()
+
+    def _train(self):
         faces = []
         labels = []
-        current_id = 0
         new_label_map = {}
+        new_enrolled = {}
         
         if not os.path.exists(self.dataset_path):
             return False
 
+        # Keep the labels of students we already know; only newcomers get fresh ids
+        known_labels = {name: label for label, name in self.label_map.items()}
+        next_label = self._next_label()
+
         # CRITICAL: Sort directories to ensure consistent label mapping across retrains
         sorted_dirs = sorted(os.listdir(self.dataset_path))
+        self._preload_templates([d for d in sorted_dirs if os.path.isdir(os.path.join(self.dataset_path, d))])
         
         for student_dir in sorted_dirs:
             student_path = os.path.join(self.dataset_path, student_dir)
             if not os.path.isdir(student_path):
                 continue
-                
-            new_label_map[current_id] = student_dir
+
+            label = known_labels.get(student_dir)
+            if label is None:
+                label = next_label
+                next_label += 1
+            new_label_map[label] = student_dir
+            new_enrolled[student_dir] = self._image_signature(student_path)
             
             # Load images for training
-            img_list = os.listdir(student_path)
-            # Use only a representative sample if dataset is huge, but here we take all
-            for img_name in img_list:
-                img_path = os.path.join(student_path, img_name)
-                img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-                if img is None:
-                    continue
-                
-                # Standardize size for training (LBPH needs consistent sizing for best results)
-                img = cv2.resize(img, (200, 200), interpolation=cv2.INTER_LANCZOS4)
-                # Normalization
-                clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-                img = clahe.apply(img)
-                img = cv2.GaussianBlur(img, (3, 3), 0)
-                
-                faces.append(img)
-                labels.append(current_id)
-            
-            current_id += 1
+            student_faces = self._load_student_faces(student_dir)
+            faces.extend(student_faces)
+            labels.extend([label] * len(student_faces))
+
+        # Forget cached templates of students whose folders are gone
+        self.templates.prune(new_enrolled)
+        self.templates.flush()
             
         if len(faces) > 0:
-            # Recreate recognizer for clean training
-            self.recognizer = cv2.face.LBPHFaceRecognizer_create(radius=1, neighbors=8, grid_x=8, grid_y=8)
-            self.recognizer.train(faces, np.array(labels))
-            self.label_map = new_label_map
-            self.trained = True
-            self.save_model()
-            self.last_train_time = time.time()
+            # Recreate recognizer for clean training; the live one keeps serving until the swap
+            recognizer = LBPHMatcher()
+            recognizer.train(faces, labels)
+            self.enrolled = new_enrolled
+            self.save_model(recognizer, new_label_map)
+            self._publish(recognizer, new_label_map)
             print(f"Training complete: {len(new_label_map)} students, {len(faces)} images")
             return True
         else:
-            self.trained = False
-            if os.path.exists(self.model_path): os.remove(self.model_path)
-            if os.path.exists(self.label_map_path): os.remove(self.label_map_path)
+            self._clear_model()
             return False
 
-    def detect_and_recognize(self, frame, strict_threshold=38):
-        # target_width 400 for better detection.
-        target_width = 400 
+    def enroll(self, student_dir):
+        if not is_student_folder(student_dir):
+            print(f"Refusing to enroll {student_dir!r}: not a student folder name")
+            return False
+        self.ensure_model() # Label ids and enrolment state come from the saved model
+        with self._train_lock:
+            return self._enroll(student_dir)
+
+    def _enroll(self, student_dir):
+        # Incremental path: add one student's histograms to a copy of the model via update()
+        student_path = os.path.join(self.dataset_path, student_dir)
+        if not os.path.isdir(student_path):
+            return False
+        if not self.trained:
+            return self._train()
+
+        self._preload_templates([student_dir])
+        faces = self._load_student_faces(student_dir)
+        self.templates.flush()
+        if not faces:
+            return False
+
+        # Re-capture of a known student: drop the old samples first so they do not linger
+        if self._label_for(student_dir) is not None:
+            self._remove(student_dir)
+            if not self.trained:
+                return self._train()
+
+        # Copy-on-write: the live matcher keeps predicting while the extended copy is built
+        label = self._next_label()
+        recognizer = self.recognizer.with_samples(faces, [label] * len(faces))
+        label_map = dict(self.label_map)
+        label_map[label] = student_dir
+        self.enrolled[student_dir] = self._image_signature(student_path)
+        self.save_model(recognizer, label_map)
+        self._publish(recognizer, label_map, incremental=True)
+        print(f"Enrolled {student_dir}: {len(faces)} images")
+        return True
+
+    def remove(self, student_dir):
+        if not is_student_folder(student_dir):
+            print(f"Refusing to remove {student_dir!r}: not a student folder name")
+            return False
+        self.ensure_model() # Label ids and enrolment state come from the saved model
+        with self._train_lock:
+            return self._remove(student_dir)
+
+    def _remove(self, student_dir):
+        # Drops the student's gallery rows; no image on disk is touched
+        if not os.path.isdir(os.path.join(self.dataset_path, student_dir)):
+            self.templates.drop(student_dir)
+            self.templates.flush()
+
+        label = self._label_for(student_dir)
+        if label is None:
+            return False
+
+        recognizer = self.recognizer.without_label(label)
+        if not self.trained or len(recognizer) == 0:
+            self._clear_model()
+            return True
+
+        label_map = {k: v for k, v in self.label_map.items() if k != label}
+        self.enrolled.pop(student_dir, None)
+        self.save_model(recognizer, label_map)
+        self._publish(recognizer, label_map, incremental=True)
+        print(f"Removed {student_dir} from model")
+        return True
+
+    def sync(self):
+        self.ensure_model() # Label ids and enrolment state come from the saved model
+        with self._train_lock:
+            return self._sync()
+
+    def _sync(self):
+        # Reconcile the model with uploads/: enroll new or changed folders, remove deleted ones.
+        # Falls back to a full train when there is no model yet (or it predates enrollment tracking).
+        if not os.path.exists(self.dataset_path):
+            return False
+        if not self.trained or not self.enrolled:
+            return self._train()
+
+        on_disk = {}
+        for student_dir in sorted(os.listdir(self.dataset_path)):
+            student_path = os.path.join(self.dataset_path, student_dir)
+            if os.path.isdir(student_path):
+                on_disk[student_dir] = self._image_signature(student_path)
+
+        for student_dir in [d for d in self.enrolled if d not in on_disk]:
+            self._remove(student_dir)
+        for student_dir, signature in on_disk.items():
+            if self.enrolled.get(student_dir) != signature:
+                self._enroll(student_dir)
+        return self.trained
+
+    def detect_faces(self, frame, gate=None, hints=(), params=None):
+        # Face boxes (x, y, w, h) in full-frame coordinates. With a MotionGate only changed regions
+        # and the areas around `hints` (boxes of faces already being tracked) are scanned.
+        # params: DetectionParams for this call (a camera preset or ScaleAdapter), else self.detection
+        params = params or self.detection
+        metrics = self.metrics
+        if metrics is None:
+            return self._detect_faces(frame, gate, hints, params)
+        start = time.perf_counter()
+        faces = self._detect_faces(frame, gate, hints, params)
+        metrics.observe('facereg_detect_seconds', time.perf_counter() - start)
+        metrics.observe('facereg_faces_per_frame', len(faces))
+        return faces
+
+    def _detect_faces(self, frame, gate, hints, params):
+        detector = self.detector
         h, w = frame.shape[:2]
-        scale = target_width / float(w)
+        scale = params.target_width / float(w)
         
-        small_frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale)
-        gray = cv2.cvtColor(small_frame, cv2.COLOR_BGR2GRAY)
+        # Same output size resize() derives from fx/fy, so the scratch buffers are reused
+        small_shape = (int(round(h * scale)), int(round(w * scale)))
+        small_frame = cv2.resize(frame, (0, 0), dst=thread_buffer('small_frame', small_shape + frame.shape[2:]), fx=scale, fy=scale)
+        gray = None
+        if gate is not None or not detector.color:
+            gray = cv2.cvtColor(small_frame, cv2.COLOR_BGR2GRAY, dst=thread_buffer('small_gray', small_frame.shape[:2]))
         
-        # USE CLAHE for better light normalization
-        clahe = cv2.createCLAHE(clipLimit=1.5, tileGridSize=(8,8))
-        gray = clahe.apply(gray)
+        regions = None
+        if gate is not None:
+            regions = gate.regions(gray, [tuple(int(v * scale) for v in box) for box in hints])
+            if regions is not None and not regions:
+                return []
         
-        # Detection
-        faces = self.face_cascade.detectMultiScale(gray, 1.05, 10, minSize=(40, 40))
+        if detector.color:
+            image = small_frame
+        else:
+            # USE CLAHE for better light normalization
+            image = thread_clahe(1.5).apply(gray, thread_buffer('small_equalized', gray.shape))
+        
+        # Detection: the whole image, or the gate's regions as one batch
+        if regions is None:
+            faces = detector.detect([image], params)[0]
+        else:
+            faces = []
+            found = detector.detect([image[ry:ry+rh, rx:rx+rw] for (rx, ry, rw, rh) in regions], params)
+            for (rx, ry, _, _), boxes in zip(regions, found):
+                faces.extend((x + rx, y + ry, w_f, h_f) for (x, y, w_f, h_f) in boxes)
         
-        results = []
         inv_scale = 1.0 / scale
-        full_gray = None 
+        return [(int(x*inv_scale), int(y*inv_scale), int(w_f*inv_scale), int(h_f*inv_scale)) for (x, y, w_f, h_f) in faces]
+
+    def detect_faces_batch(self, frames, params=None):
+        # detect_faces for several frames (e.g. the frames of one upload) in a single detector call,
+        # which the SSD backend runs as one forward pass. No motion gate: the frames are unrelated.
+        params = params or self.detection
+        detector = self.detector
+        start = time.perf_counter()
+        images, scales = [], []
+        for frame in frames:
+            scale = params.target_width / float(frame.shape[1])
+            small_frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale)
+            if not detector.color:
+                small_frame = thread_clahe(1.5).apply(cv2.cvtColor(small_frame, cv2.COLOR_BGR2GRAY))
+            images.append(small_frame)
+            scales.append(scale)
+        found = detector.detect(images, params) if images else []
+        results = [[(int(x / scale), int(y / scale), int(w_f / scale), int(h_f / scale)) for (x, y, w_f, h_f) in boxes]
+                   for boxes, scale in zip(found, scales)]
+        metrics = self.metrics
+        if metrics is not None and frames:
+            # Per frame, like detect_faces: the batch time is split evenly
+            elapsed = (time.perf_counter() - start) / len(frames)
+            for boxes in results:
+                metrics.observe('facereg_detect_seconds', elapsed)
+                metrics.observe('facereg_faces_per_frame', len(boxes))
+        return results
+
+    def recognize_faces(self, frame, boxes, strict_threshold=38, snapshot=None):
+        # Scores the given boxes against one model snapshot (the current one unless passed in).
+        # With a RecognitionBatcher attached the crops are preprocessed and scored together with
+        # those of other concurrent callers.
+        if not self._model_ready:
+            self.ensure_model()
+        metrics = self.metrics
+        if metrics is None or not boxes:
+            return self._recognize_faces(frame, boxes, strict_threshold, snapshot)
+        start = time.perf_counter()
+        results = self._recognize_faces(frame, boxes, strict_threshold, snapshot)
+        metrics.observe('facereg_recognize_seconds', time.perf_counter() - start)
+        recognized = sum(1 for res in results if res['student_id'] != "Unknown")
+        if recognized:
+            metrics.inc('facereg_faces_recognized_total', recognized, result='recognized')
+        if len(results) > recognized:
+            metrics.inc('facereg_faces_recognized_total', len(results) - recognized, result='unknown')
+        return results
+
+    def _recognize_faces(self, frame, boxes, strict_threshold, snapshot):
+        snapshot = snapshot or self.snapshot
+        batcher = self.batcher
         
-        for (x, y, w_f, h_f) in faces:
-            orig_x, orig_y, orig_w, orig_h = int(x*inv_scale), int(y*inv_scale), int(w_f*inv_scale), int(h_f*inv_scale)
-            
-            student_id = "Unknown"
-            confidence_score = 0
-            
-            if self.trained:
-                if full_gray is None:
-                    full_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                
-                roi_gray = full_gray[orig_y:orig_y+orig_h, orig_x:orig_x+orig_w]
-                if roi_gray.size == 0: continue
-                
-                roi_gray = cv2.resize(roi_gray, (200, 200), interpolation=cv2.INTER_LANCZOS4)
-                # Apply lighter CLAHE on ROI to avoid over-sharpening noise
-                roi_gray = clahe.apply(roi_gray)
-                roi_gray = cv2.GaussianBlur(roi_gray, (3, 3), 0)
-                
-                label, confidence = self.recognizer.predict(roi_gray)
-                
-                # LBPH confidence is DISTANCE: 0 is perfect match.
-                # Threshold of 38 is VERY STRICT for LBPH to ensure zero mixing.
-                if confidence < strict_threshold: 
-                    student_id = self.label_map.get(label, "Unknown")
+        results = []
+        rois = []
+        if snapshot.trained and boxes:
+            # Only the face boxes are converted to gray, each into its own slice of one scratch
+            # array (the crops must stay valid until they are scored)
+            arena = thread_buffer('roi_gray', (frame.shape[0] * frame.shape[1],))
+            used = 0
+        
+        for (orig_x, orig_y, orig_w, orig_h) in boxes:
+            if snapshot.trained:
+                roi = frame[orig_y:orig_y+orig_h, orig_x:orig_x+orig_w]
+                if roi.size == 0: continue
                 
-                confidence_score = confidence
+                rh, rw = roi.shape[:2]
+                if used + rh * rw <= len(arena):
+                    dst = arena[used:used + rh * rw].reshape(rh, rw)
+                    used += rh * rw
+                else:
+                    dst = None # Overlapping boxes filled the arena
+                rois.append(cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY, dst=dst) if roi.ndim == 3 else roi)
             
             results.append({
                 'box': (orig_x, orig_y, orig_w, orig_h),
-                'student_id': student_id,
-                'confidence_raw': confidence_score,
-                'confidence': round(max(0, 100 - confidence_score), 2)
+                'student_id': "Unknown",
+                'confidence_raw': 0,
+                'confidence': 100
             })
+
+        # All faces of the frame are scored against the gallery in one batched pass
+        if rois:
+            matches = None
+            if batcher is not None:
+                try:
+                    matches = batcher.submit(rois, snapshot).result(timeout=batcher.timeout)
+                except Exception as e:
+                    # Batcher failed, stopped or stuck: score here instead of waiting on it
+                    batcher.fallbacks += 1
+                    print(f"Recognition batcher unavailable ({e!r}), scoring directly")
+            if matches is None:
+                clahe = thread_clahe(1.5)
+                prepared = thread_stack('faces', len(rois), (TEMPLATE_SIZE[1], TEMPLATE_SIZE[0]))
+                for roi, out in zip(rois, prepared):
+                    prepare_face(roi, clahe, out)
+                matcher = snapshot.index if snapshot.index is not None else snapshot.recognizer
+                matches = matcher.predict_batch(prepared)
+            for res, (label, confidence) in zip(results, matches):
+                # LBPH confidence is DISTANCE: 0 is perfect match.
+                # Threshold of 38 is VERY STRICT for LBPH to ensure zero mixing.
+                if confidence < strict_threshold: 
+                    res['student_id'] = snapshot.label_map.get(label, "Unknown")
+                
+                res['confidence_raw'] = confidence
+                res['confidence'] = round(max(0, 100 - confidence), 2)
         return results
+
+    def detect_and_recognize(self, frame, strict_threshold=38):
+        # One snapshot for the whole frame, even if training publishes a new one meanwhile
+        snapshot = self.snapshot
+        return self.recognize_faces(frame, self.detect_faces(frame), strict_threshold, snapshot)
+
+class RecognitionBatcher:
+    # Coalesces face crops from concurrent recognize_faces callers (camera workers, uploads):
+    # one thread collects crops for up to max_wait_ms or max_batch faces, preprocesses them in one
+    # loop and scores each snapshot's group with a single predict_batch call (one histogram pass
+    # and one gallery sweep instead of one per caller). Each caller waits on its own Future, for at
+    # most `timeout` seconds before scoring its faces itself (recognize_faces), so a stuck or dead
+    # batcher slows recognition down but never blocks it.
+    def __init__(self, max_batch=32, max_wait_ms=4, timeout=2.0):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.timeout = timeout
+        self.queue = deque() # [(rois, snapshot, future)]
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.batches = 0
+        self.faces = 0
+        self.fallbacks = 0 # Requests the callers scored themselves after an error or timeout
+        self.inflight = [] # Requests taken off the queue and not yet answered
+
+    def start(self):
+        with self.cond:
+            if self.running:
+                return self
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name='recognition-batcher', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+
+    def submit(self, rois, snapshot):
+        # rois: raw gray face crops. The Future resolves to [(label, distance)] in the same order.
+        future = Future()
+        with self.cond:
+            if not self.running:
+                future.set_exception(RuntimeError("RecognitionBatcher is not running"))
+                return future
+            self.queue.append((rois, snapshot, future))
+            self.cond.notify()
+        return future
+
+    def _collect(self):
+        # First request opens the batch; then wait up to max_wait for more, or until max_batch faces
+        with self.cond:
+            self.cond.wait_for(lambda: self.queue or not self.running)
+            if not self.queue:
+                return []
+            batch = self.inflight = [self.queue.popleft()]
+            faces = len(batch[0][0])
+            deadline = time.time() + self.max_wait
+            while faces < self.max_batch and self.running:
+                if not self.queue:
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or not self.cond.wait(remaining):
+                        break
+                    continue
+                if faces + len(self.queue[0][0]) > self.max_batch:
+                    break
+                item = self.queue.popleft()
+                batch.append(item)
+                faces += len(item[0])
+            return batch
+
+    def _fail(self, items, error):
+        for _, _, future in items:
+            if not future.done():
+                future.set_exception(error)
+
+    def _run(self):
+        try:
+            self._loop()
+        finally:
+            # Exiting for any reason: fail whatever is queued (the callers score it themselves) and
+            # refuse new requests, rather than leave futures nobody will resolve
+            with self.cond:
+                self.running = False
+                queued, self.queue = self.inflight + list(self.queue), deque()
+            self._fail(queued, RuntimeError("RecognitionBatcher stopped"))
+
+    def _loop(self):
+        clahe = thread_clahe(1.5)
+        while True:
+            try:
+                batch = self._collect()
+                if not batch:
+                    if not self.running:
+                        return
+                    continue
+                self._score(batch, clahe)
+            except Exception as e:
+                # Outside the per-group handling below: fail this batch, keep serving the next
+                print(f"Recognition batch failed: {e!r}")
+                self._fail(self.inflight, e)
+            self.inflight = []
+
+    def _score(self, batch, clahe):
+        # Requests made against different model snapshots are scored separately
+        groups = OrderedDict()
+        for item in batch:
+            groups.setdefault(id(item[1]), []).append(item)
+        for items in groups.values():
+            snapshot = items[0][1]
+            try:
+                crops = [roi for rois, _, _ in items for roi in rois]
+                prepared = thread_stack('batch_faces', len(crops), (TEMPLATE_SIZE[1], TEMPLATE_SIZE[0]))
+                for roi, out in zip(crops, prepared):
+                    prepare_face(roi, clahe, out)
+                matcher = snapshot.index if snapshot.index is not None else snapshot.recognizer
+                matches = matcher.predict_batch(prepared)
+            except Exception as e:
+                self._fail(items, e)
+                continue
+            offset = 0
+            for rois, _, future in items:
+                future.set_result(matches[offset:offset + len(rois)])
+                offset += len(rois)
+        self.batches += 1
+        self.faces += sum(len(item[0]) for item in batch)
+
+def box_iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = min(ax + aw, bx + bw) - max(ax, bx)
+    ih = min(ay + ah, by + bh) - max(ay, by)
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    return inter / float(aw * ah + bw * bh - inter)
+
+def merge_rects(rects):
+    # Unions overlapping rectangles until none overlap, so no pixel is scanned twice
+    rects = [list(r) for r in rects]
+    merged = True
+    while merged:
+        merged = False
+        out = []
+        for r in rects:
+            for o in out:
+                if r[0] < o[0] + o[2] and o[0] < r[0] + r[2] and r[1] < o[1] + o[3] and o[1] < r[1] + r[3]:
+                    x, y = min(r[0], o[0]), min(r[1], o[1])
+                    o[2], o[3] = max(r[0] + r[2], o[0] + o[2]) - x, max(r[1] + r[3], o[1] + o[3]) - y
+                    o[0], o[1] = x, y
+                    merged = True
+                    break
+            else:
+                out.append(r)
+        rects = out
+    return [tuple(r) for r in rects]
+
+class MotionGate:
+    # Decides where the cascade runs on the small detection image: regions that changed since the
+    # previous frame (frame differencing) plus padded boxes of known faces, with a full-frame
+    # rescan every `rescan_every` frames to pick up faces that walked in between.
+    def __init__(self, rescan_every=30, diff_threshold=25, min_area=40, pad=20, min_size=60, full_fraction=0.6):
+        self.rescan_every = rescan_every
+        self.diff_threshold = diff_threshold # Gray-level change that counts as motion
+        self.min_area = min_area # Ignore motion blobs smaller than this (sensor noise)
+        self.pad = pad
+        self.min_size = min_size # Regions are grown to at least this, above the default preset's 40px minSize
+        self.full_fraction = full_fraction # Past this share of the image a full scan is cheaper
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (7, 7))
+        self.previous = None
+        self.since_full = 0
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.full_scans = 0
+        self.scanned_total = 0.0 # Sum of per-frame scanned fractions
+        self.last_fraction = 1.0
+
+    def _grow(self, rect, width, height, pad):
+        x, y, w, h = rect
+        w2, h2 = max(w + 2 * pad, self.min_size), max(h + 2 * pad, self.min_size)
+        x0 = min(max(0, x - (w2 - w) // 2), max(0, width - w2))
+        y0 = min(max(0, y - (h2 - h) // 2), max(0, height - h2))
+        return (x0, y0, min(w2, width - x0), min(h2, height - y0))
+
+    def regions(self, gray, hints=()):
+        # None = scan the whole image; otherwise a (possibly empty) list of (x, y, w, h) regions
+        height, width = gray.shape[:2]
+        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+        with self.lock:
+            previous, self.previous = self.previous, blurred
+            self.frames += 1
+            self.since_full += 1
+            if previous is None or previous.shape != blurred.shape or self.since_full >= self.rescan_every:
+                return self._full()
+
+        diff = cv2.absdiff(blurred, previous)
+        _, mask = cv2.threshold(diff, self.diff_threshold, 255, cv2.THRESH_BINARY)
+        mask = cv2.dilate(mask, self.kernel, iterations=2)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        rects = [self._grow(cv2.boundingRect(c), width, height, self.pad)
+                 for c in contours if cv2.contourArea(c) >= self.min_area]
+        # Known faces get half their size as margin so they are re-found even if they moved
+        rects += [self._grow(box, width, height, max(self.pad, box[2] // 2)) for box in hints]
+        rects = merge_rects(rects)
+
+        fraction = sum(w * h for (_, _, w, h) in rects) / float(width * height)
+        with self.lock:
+            if fraction >= self.full_fraction:
+                return self._full()
+            self.scanned_total += fraction
+            self.last_fraction = fraction
+        return rects
+
+    def _full(self):
+        # Caller holds self.lock
+        self.since_full = 0
+        self.full_scans += 1
+        self.scanned_total += 1.0
+        self.last_fraction = 1.0
+        return None
+
+    def stats(self):
+        with self.lock:
+            return {
+                'frames': self.frames,
+                'full_scans': self.full_scans,
+                'scanned_fraction': round(self.scanned_total / self.frames, 4) if self.frames else 1.0,
+                'last_scanned_fraction': round(self.last_fraction, 4)
+            }
+
+class ScaleAdapter:
+    # Per camera: narrows the cascade's size range to the faces seen over the last `window` frames
+    # (back rows of a lecture hall and a kiosk close-up need very different pyramids) and raises the
+    # scale factor by `coarse_step` once no track has appeared or dropped for `stable_after` frames. Every
+    # `explore_every` frames, and whenever no face has been seen for a whole window, the camera's
+    # preset is used unchanged so faces of a new size are still found.
+    # The detection width is left alone: raising minSize already skips the large pyramid levels.
+    def __init__(self, preset, window=30, margin=0.35, stable_after=10, coarse_step=0.1, explore_every=30):
+        self.preset = preset
+        self.margin = margin # Share of the seen sizes added below and above the range
+        self.stable_after = stable_after
+        self.coarse_step = coarse_step
+        self.explore_every = explore_every
+        self.sizes = deque(maxlen=window) # Per frame: (smallest, largest) face width in detection pixels, or None
+        self.stable_frames = 0
+        self.since_explore = 0
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.explored = 0
+        self.narrowed = 0
+        self.coarse = 0
+        self.last = preset
+
+    def params(self):
+        # DetectionParams for the next frame
+        preset = self.preset
+        with self.lock:
+            self.frames += 1
+            self.since_explore += 1
+            seen = [s for s in self.sizes if s is not None]
+            if not seen or self.since_explore >= self.explore_every:
+                self.since_explore = 0
+                self.explored += 1
+                self.last = preset
+                return preset
+            smallest = min(s[0] for s in seen)
+            largest = max(s[1] for s in seen)
+            min_size = max(preset.min_size, int(smallest * (1 - self.margin)))
+            max_size = int(largest * (1 + self.margin)) + 1
+            if preset.max_size:
+                max_size = min(max_size, preset.max_size)
+            scale_factor = preset.scale_factor
+            if self.stable_frames >= self.stable_after and self.coarse_step > 0:
+                scale_factor = round(scale_factor + self.coarse_step, 3)
+                self.coarse += 1
+            if min_size > preset.min_size or max_size != preset.max_size:
+                self.narrowed += 1
+            self.last = preset._replace(scale_factor=scale_factor, min_size=min_size, max_size=max(max_size, min_size))
+            return self.last
+
+    def observe(self, boxes, frame_width, stable):
+        # boxes: this frame's detections (full-frame coordinates); stable: no track appeared or dropped
+        scale = self.preset.target_width / float(frame_width)
+        widths = [w * scale for (_, _, w, _) in boxes]
+        with self.lock:
+            self.sizes.append((min(widths), max(widths)) if widths else None)
+            self.stable_frames = self.stable_frames + 1 if stable and widths else 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'preset': self.preset._asdict(),
+                'frames': self.frames,
+                'explored': self.explored,
+                'narrowed': self.narrowed,
+                'coarse': self.coarse,
+                'last': self.last._asdict()
+            }
+
+class FaceTracker:
+    # Keeps a track per face across frames (greedy IoU association of detections) so a face is
+    # recognised once when it appears and then only re-verified now and then, instead of on every
+    # frame. The reported identity is a vote over the track's recent recognitions.
+    # One tracker per camera: update() assumes frames of a single source, in order (see seq).
+    def __init__(self, engine, iou_threshold=0.3, verify_every=15, retry_every=3, max_missed=5,
+                 votes=5, margin=5, gate=None, detection=None, scale=None):
+        self.engine = engine
+        self.gate = gate # Optional MotionGate restricting detection to changed areas and known faces
+        self.detection = detection # DetectionParams of this camera (None: the engine's)
+        self.scale = scale # Optional ScaleAdapter; when set it supplies the DetectionParams of every frame
+        self.iou_threshold = iou_threshold
+        self.verify_every = verify_every # Frames between re-checks of a confidently recognised track
+        self.retry_every = retry_every # ...of a track that is Unknown or matched within `margin` of the threshold
+        self.max_missed = max_missed # Frames a track survives without a matching detection
+        self.votes = votes # Recognitions kept per track for the identity vote
+        self.margin = margin
+        self.tracks = [] # [track dict]
+        self.next_id = 1
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.faces_seen = 0
+        self.faces_recognized = 0 # faces_seen - faces_recognized = recognitions saved
+        self.applied_seq = 0 # Newest frame seq applied to the tracks
+        self.frames_stale = 0 # Frames dropped because a newer one was applied first
+
+    def _associate(self, boxes):
+        # Greedy: highest-IoU (track, detection) pairs first
+        pairs = sorted(((box_iou(track['box'], box), t, d)
+                        for t, track in enumerate(self.tracks) for d, box in enumerate(boxes)), reverse=True)
+        matched = {} # {detection index: track}
+        used = set()
+        for iou, t, d in pairs:
+            if iou < self.iou_threshold:
+                break
+            if t in used or d in matched:
+                continue
+            used.add(t)
+            matched[d] = self.tracks[t]
+        return matched
+
+    def _needs_recognition(self, track, version, strict_threshold):
+        if track['version'] != version:
+            return True # New model (enrolment/removal): the old votes may be stale
+        age = self.frames - track['recognized_at']
+        if track['student_id'] == "Unknown" or track['last_distance'] >= strict_threshold - self.margin:
+            return age >= self.retry_every
+        return age >= self.verify_every
+
+    def _vote(self, track, result):
+        track['history'].append((result['student_id'], result['confidence_raw']))
+        track['last_distance'] = result['confidence_raw']
+        tally = {}
+        for student_id, distance in track['history']:
+            count, total = tally.get(student_id, (0, 0.0))
+            tally[student_id] = (count + 1, total + distance)
+        # Most votes wins; ties go to the identity with the closer average match
+        winner = min(tally, key=lambda k: (-tally[k][0], tally[k][1] / tally[k][0]))
+        count, total = tally[winner]
+        track['student_id'] = winner
+        track['distance'] = total / count if winner != "Unknown" else result['confidence_raw']
+
+    def update(self, frame, strict_threshold=38, boxes=None, seq=None):
+        # Same result dicts as detect_and_recognize, plus 'track_id'. Several workers may call this for
+        # one camera: with seq (the frame's capture number) a frame older than the last one applied
+        # is dropped and None returned, so tracks only ever move forward. Detection and recognition
+        # run outside the lock; only association and voting are serialised.
+        scale = None
+        if boxes is None:
+            with self.lock:
+                hints = [t['box'] for t in self.tracks]
+            scale = self.scale
+            params = scale.params() if scale is not None else self.detection
+            boxes = self.engine.detect_faces(frame, self.gate, hints, params)
+        snapshot = self.engine.snapshot
+
+        with self.lock:
+            if seq is not None:
+                if seq <= self.applied_seq:
+                    self.frames_stale += 1
+                    return None
+                self.applied_seq = seq
+            self.frames += 1
+            self.faces_seen += len(boxes)
+            matched = self._associate(boxes)
+
+            current = []
+            pending = []
+            for d, box in enumerate(boxes):
+                track = matched.get(d)
+                if track is None:
+                    track = {
+                        'id': self.next_id, 'box': box, 'missed': 0, 'version': None,
+                        'recognized_at': self.frames, 'student_id': "Unknown",
+                        'distance': 0, 'last_distance': 0, 'history': deque(maxlen=self.votes),
+                        'recognizing': False
+                    }
+                    self.next_id += 1
+                track['box'] = box
+                track['missed'] = 0
+                current.append(track)
+                if not track['recognizing'] and self._needs_recognition(track, snapshot.version, strict_threshold):
+                    # Claimed for this frame, so a concurrent update() does not recognise it as well
+                    track['recognizing'] = True
+                    pending.append(track)
+
+            # Unmatched tracks coast for a few frames so a missed detection does not reset the identity
+            seen = set(t['id'] for t in current)
+            dropped = 0
+            for track in self.tracks:
+                if track['id'] not in seen:
+                    track['missed'] += 1
+                    if track['missed'] <= self.max_missed:
+                        current.append(track)
+                    else:
+                        dropped += 1
+            if scale is not None:
+                # Stable: every detection continued a track and no track was lost (coasting is fine)
+                scale.observe(boxes, frame.shape[1], len(matched) == len(boxes) and not dropped)
+            self.tracks = current
+            # This frame's boxes; a newer frame may move the tracks before this one reports
+            shown = [(track, track['box']) for track in current if not track['missed']]
+            frame_no = self.frames
+
+        # Only new / due tracks are recognised, all in one batch
+        results = []
+        if pending:
+            try:
+                results = self.engine.recognize_faces(frame, [t['box'] for t in pending], strict_threshold, snapshot)
+            finally:
+                with self.lock:
+                    for track in pending:
+                        track['recognizing'] = False
+                    if len(results) == len(pending):
+                        for track, result in zip(pending, results):
+                            track['version'] = snapshot.version
+                            track['recognized_at'] = frame_no
+                            if snapshot.trained:
+                                self._vote(track, result)
+                        self.faces_recognized += len(pending)
+
+        with self.lock:
+            results = []
+            for track, box in shown:
+                distance = track['distance']
+                results.append({
+                    'box': box,
+                    'track_id': track['id'],
+                    'student_id': track['student_id'] if track['student_id'] != "Unknown" and distance < strict_threshold else "Unknown",
+                    'confidence_raw': distance,
+                    'confidence': round(max(0, 100 - distance), 2)
+                })
+            return results
+
+    def stats(self):
+        with self.lock:
+            return {
+                'tracks': len(self.tracks),
+                'frames': self.frames,
+                'faces_seen': self.faces_seen,
+                'faces_recognized': self.faces_recognized,
+                'frames_stale': self.frames_stale,
+                'detection': self.gate.stats() if self.gate is not None else None,
+                'scale': self.scale.stats() if self.scale is not None else None
+            }
+
+class BackgroundTrainer:
+    # Runs train/enroll/remove/sync for a FaceRecognizer on a single worker thread, so HTTP requests
+    # only enqueue work. A request already covered by a job that is still waiting joins that job.
+    def __init__(self, engine, history=200):
+        self.engine = engine
+        self.history = history
+        self.jobs = OrderedDict() # {job_id: job dict}, oldest first
+        self.pending = deque()
+        self.cond = threading.Condition()
+        self.thread = None
+
+    @staticmethod
+    def _covers(job, kind, target):
+        # A full train covers everything; a sync picks up any enroll/remove since it rescans uploads/
+        if job['kind'] == 'train':
+            return True
+        if job['kind'] == 'sync':
+            return kind in ('sync', 'enroll', 'remove')
+        return job['kind'] == kind and job['target'] == target
+
+    def submit(self, kind, target=None):
+        if kind not in ('train', 'sync', 'enroll', 'remove'):
+            raise ValueError(f"Unknown training job: {kind}")
+        with self.cond:
+            for job_id in self.pending:
+                if self._covers(self.jobs[job_id], kind, target):
+                    return job_id
+
+            job_id = uuid.uuid4().hex[:12]
+            self.jobs[job_id] = {
+                'id': job_id, 'kind': kind, 'target': target, 'status': 'queued',
+                'submitted': time.time(), 'started': None, 'finished': None,
+                'success': None, 'version': None, 'error': None
+            }
+            self.pending.append(job_id)
+            self._trim()
+
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='face-trainer', daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+            return job_id
+
+    def status(self, job_id):
+        with self.cond:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while job_id in self.jobs and self.jobs[job_id]['status'] in ('queued', 'running'):
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _trim(self):
+        # Keep a bounded history of finished jobs for /train/status
+        finished = [job_id for job_id, job in self.jobs.items() if job['status'] in ('done', 'failed')]
+        for job_id in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[job_id]
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                job = self.jobs[self.pending.popleft()]
+                job['status'] = 'running'
+                job['started'] = time.time()
+
+            success, error = False, None
+            start = time.perf_counter()
+            try:
+                if job['kind'] == 'train':
+                    success = self.engine.train()
+                elif job['kind'] == 'sync':
+                    success = self.engine.sync()
+                elif job['kind'] == 'enroll':
+                    success = self.engine.enroll(job['target'])
+                else:
+                    success = self.engine.remove(job['target'])
+            except Exception as e:
+                error = str(e)
+                print(f"Training job {job['id']} failed: {e}")
+
+            metrics = self.engine.metrics
+            if metrics is not None:
+                metrics.observe('facereg_training_seconds', time.perf_counter() - start, kind=job['kind'])
+                metrics.inc('facereg_training_jobs_total', kind=job['kind'], status='failed' if error else 'done')
+
+            with self.cond:
+                job['status'] = 'failed' if error else 'done'
+                job['success'] = bool(success)
+                job['error'] = error
+                job['version'] = self.engine.snapshot.version
+                job['finished'] = time.time()
+                self.cond.notify_all()
+
+
+if __name__ == '__main__':
+    # Offline model rebuild, e.g. python -m face_logic train --workers 16
+    import argparse
+
+    parser = argparse.ArgumentParser(description="FaceReg face engine maintenance")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    train_parser = subparsers.add_parser('train', help="rebuild the LBPH model from the dataset folder")
+    train_parser.add_argument('--dataset', default='uploads', help="folder with one sub-folder of images per student")
+    train_parser.add_argument('--model-dir', default='models', help="where the model, label map and template cache live")
+    train_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="preprocessing workers")
+    train_parser.add_argument('--pool', choices=['thread', 'process'], default='thread', help="worker pool type")
+    train_parser.add_argument('--chunk-size', type=int, default=32, help="images per work item")
+    convert_parser = subparsers.add_parser('convert', help="convert trained_model.yml + label_map.pkl to trained_model.bin")
+    convert_parser.add_argument('--model-dir', default='models', help="folder holding the old model files")
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        engine = FaceRecognizer(dataset_path=args.dataset, model_dir=args.model_dir,
+                                workers=args.workers, pool=args.pool, chunk_size=args.chunk_size)
+        start = time.time()
+        ok = engine.train()
+        print(f"Finished in {time.time() - start:.2f}s")
+        raise SystemExit(0 if ok else 1)
+
+    if args.command == 'convert':
+        yaml_path = os.path.join(args.model_dir, 'trained_model.yml')
+        model_path = os.path.join(args.model_dir, 'trained_model.bin')
+        start = time.time()
+        convert_legacy_model(yaml_path, os.path.join(args.model_dir, 'label_map.pkl'), model_path)
+        print(f"Finished in {time.time() - start:.2f}s: {os.path.getsize(yaml_path) / 2**20:.1f} MiB YAML -> "
+              f"{os.path.getsize(model_path) / 2**20:.1f} MiB binary")
@@ -0,0 +1,136 @@
+import bisect
+import math
+import threading
+
+# Process metrics in the Prometheus text format, served from /metrics when FACEREG_METRICS is set.
+# Components take an optional `metrics` attribute and only time themselves when it is attached,
+# so with metrics off the hot path pays one `is None` check per hook.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 20, 30, 50)
+
+# name: (type, help, buckets). Every metric the app records is declared here.
+DEFINITIONS = {
+    'facereg_capture_read_seconds': ('histogram', "Time to read one frame from a camera", LATENCY_BUCKETS),
+    'facereg_analysis_seconds': ('histogram', "Detection, tracking and recognition of one analysed frame", LATENCY_BUCKETS),
+    'facereg_detect_seconds': ('histogram', "Face detection on one frame", LATENCY_BUCKETS),
+    'facereg_recognize_seconds': ('histogram', "Recognition of the faces of one frame", LATENCY_BUCKETS),
+    'facereg_encode_seconds': ('histogram', "Annotating and JPEG-encoding one stream frame", LATENCY_BUCKETS),
+    'facereg_db_write_seconds': ('histogram', "One batched attendance write transaction", LATENCY_BUCKETS),
+    'facereg_model_load_seconds': ('histogram', "Loading the saved model from disk", SLOW_BUCKETS),
+    'facereg_training_seconds': ('histogram', "Training jobs (train, sync, enroll, remove)", SLOW_BUCKETS),
+    'facereg_faces_per_frame': ('histogram', "Faces found by one detection pass", COUNT_BUCKETS),
+    'facereg_faces_recognized_total': ('counter', "Recognition attempts by outcome", None),
+    'facereg_attendance_marks_total': ('counter', "Attendance marks from recognition by outcome", None),
+    'facereg_db_rows_written_total': ('counter', "Attendance rows committed by the writer", None),
+    'facereg_training_jobs_total': ('counter', "Finished training jobs by kind and status", None),
+}
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+def _format_labels(key, extra=None):
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = ('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last slot: above the largest bucket
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self, name, key):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            yield name + '_bucket' + _format_labels(key, ('le', _format_value(bound))), cumulative
+        yield name + '_sum' + _format_labels(key), total
+        yield name + '_count' + _format_labels(key), cumulative
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, key):
+        yield name + _format_labels(key), self.value
+
+class Metrics:
+    # Registry of the metrics in DEFINITIONS, one series per label combination, plus collectors:
+    # callables run at scrape time that report values other components already keep (queue
+    # depths, drop counters), so those cost nothing between scrapes.
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.series = {name: {} for name in DEFINITIONS} # {name: {label key: Histogram | Counter}}
+        self.collectors = [] # callable() -> [(name, type, help, [(labels dict, value)])]
+        self.lock = threading.Lock()
+
+    def _get(self, name, labels):
+        key = _label_key(labels)
+        series = self.series[name]
+        metric = series.get(key)
+        if metric is None:
+            with self.lock:
+                metric = series.get(key)
+                if metric is None:
+                    kind, _, buckets = DEFINITIONS[name]
+                    metric = Histogram(buckets) if kind == 'histogram' else Counter()
+                    series[key] = metric
+        return metric
+
+    def observe(self, name, value, **labels):
+        self._get(name, labels).observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        self._get(name, labels).inc(amount)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for name, (kind, help_text, _) in DEFINITIONS.items():
+            series = self.series[name]
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, metric in sorted(series.items()):
+                lines.extend(f"{sample} {_format_value(value)}" for sample, value in metric.samples(name, key))
+        for collector in self.collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is not None:
+                        lines.append(f"{name}{_format_labels(_label_key(labels))} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
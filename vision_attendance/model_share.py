@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from face_logic import BackgroundTrainer
+
+try:
+    import fcntl
+except ImportError: # Windows: no multi-worker servers there, so sharing is not needed
+    fcntl = None
+
+# Model sharing between the worker processes of a multi-process server (e.g. gunicorn -w 4).
+#
+# The saved model is a memory-mapped file (see face_logic.MODEL_MAGIC), so every process that loads
+# it maps the same page-cache pages and memory stays flat as workers are added. One process at a
+# time is the trainer: it holds an flock on models/trainer.lock, runs the BackgroundTrainer, and
+# bumps a generation counter after every save. The others only follow: they watch the counter and
+# re-map the new file, never training themselves. Training jobs submitted to any worker are spooled
+# as files under models/jobs/, picked up by the trainer, and their status is written back there so
+# /train/status works from every worker. If the trainer process exits, its lock is released and
+# another worker takes over.
+
+class ModelGeneration:
+    # 8-byte counter in a memory-mapped file shared by every process serving the model
+    def __init__(self, path):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < 8:
+                os.ftruncate(fd, 8)
+        finally:
+            os.close(fd)
+        self.counter = np.memmap(path, dtype='<u8', mode='r+', shape=(1,))
+
+    def value(self):
+        return int(self.counter[0])
+
+    def bump(self):
+        # Only the trainer writes, and it is a single process, so no cross-process lock is needed here
+        self.counter[0] += 1
+        self.counter.flush()
+        return int(self.counter[0])
+
+class ModelCoordinator:
+    # Drop-in replacement for BackgroundTrainer (submit/status) in multi-process deployments
+    def __init__(self, engine, poll_interval=0.5, history=200):
+        if fcntl is None:
+            raise RuntimeError("Shared model serving needs fcntl (Linux/macOS)")
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.history = history
+        self.generation = ModelGeneration(os.path.join(engine.model_dir, 'generation'))
+        self.jobs_dir = os.path.join(engine.model_dir, 'jobs')
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self.lock_file = open(os.path.join(engine.model_dir, 'trainer.lock'), 'a')
+        self.trainer = None # BackgroundTrainer once this process holds the trainer lock
+        self.tracking = {} # {spooled job id: BackgroundTrainer job id}
+        self.seen = None # Generation of the model this process loaded; None until the first load
+        self.reloads = 0
+        self.thread = None
+        self.running = False
+
+    @property
+    def is_trainer(self):
+        return self.trainer is not None
+
+    def start(self):
+        # Election, the first model load and any start-up sync all happen on the coordinator thread
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='model-coordinator', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+
+    def _elect(self):
+        if self.trainer is not None:
+            return True
+        try:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        # Pick up whatever the previous trainer saved before taking over
+        self._follow()
+        self.engine.generation = self.generation
+        self.trainer = BackgroundTrainer(self.engine)
+        if self.engine.dataset_changed():
+            self.trainer.submit('sync')
+        print(f"Process {os.getpid()} is the model trainer")
+        return True
+
+    def _run(self):
+        while self.running:
+            try:
+                if self._elect():
+                    self._take_jobs()
+                    self._write_statuses()
+                    # Our own saves bump the counter; the in-process snapshot is already current
+                    self.seen = self.generation.value()
+                else:
+                    self._follow()
+            except Exception as e:
+                print(f"Model coordinator error: {e}")
+            time.sleep(self.poll_interval)
+
+    def _follow(self):
+        generation = self.generation.value()
+        if generation != self.seen:
+            # Read the counter before loading: a save that lands meanwhile triggers another reload
+            first = self.seen is None
+            self.seen = generation
+            self.engine.reload_model()
+            if not first:
+                self.reloads += 1
+
+    # Job spool: <jobs_dir>/<submit time>-<id>.job requests, <id>.status results
+    def _write_json(self, path, data):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def submit(self, kind, target=None):
+        if kind not in ('train', 'sync', 'enroll', 'remove'):
+            raise ValueError(f"Unknown training job: {kind}")
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            'id': job_id, 'kind': kind, 'target': target, 'status': 'queued',
+            'submitted': time.time(), 'started': None, 'finished': None,
+            'success': None, 'version': None, 'error': None
+        }
+        self._write_json(os.path.join(self.jobs_dir, f'{job_id}.status'), job)
+        self._write_json(os.path.join(self.jobs_dir, f'{time.time_ns()}-{job_id}.job'), job)
+        return job_id
+
+    def status(self, job_id):
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(os.path.join(self.jobs_dir, f'{job_id}.status')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _take_jobs(self):
+        for name in sorted(n for n in os.listdir(self.jobs_dir) if n.endswith('.job')):
+            path = os.path.join(self.jobs_dir, name)
+            try:
+                with open(path) as f:
+                    job = json.load(f)
+                os.remove(path)
+            except (OSError, ValueError):
+                continue
+            self.tracking[job['id']] = self.trainer.submit(job['kind'], job['target'])
+
+    def _write_statuses(self):
+        for job_id, local_id in list(self.tracking.items()):
+            job = self.trainer.status(local_id)
+            if job is None:
+                continue
+            job['id'] = job_id
+            self._write_json(os.path.join(self.jobs_dir, f'{job_id}.status'), job)
+            if job['status'] in ('done', 'failed'):
+                del self.tracking[job_id]
+                self._trim()
+
+    def _trim(self):
+        # Keep a bounded history of finished job statuses, like BackgroundTrainer
+        statuses = [os.path.join(self.jobs_dir, n) for n in os.listdir(self.jobs_dir) if n.endswith('.status')]
+        if len(statuses) <= self.history:
+            return
+        statuses.sort(key=os.path.getmtime)
+        for path in statuses[:len(statuses) - self.history]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            'pid': os.getpid(),
+            'role': 'trainer' if self.is_trainer else 'follower',
+            'generation': self.generation.value(),
+            'loaded_generation': self.seen,
+            'reloads': self.reloads,
+            'model_version': self.engine.snapshot.version
+        }
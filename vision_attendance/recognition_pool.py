@@ -0,0 +1,61 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+def decode_frame(data):
+    # JPEG/WebP bytes -> BGR image, or None. frombuffer wraps the request bytes without copying them.
+    if not data:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+class RecognitionPool:
+    # Bounded worker pool for uploaded frames. At most `max_pending` jobs are queued or running;
+    # submit() returns None instead of queueing more, so the caller can answer 429 and the
+    # client backs off rather than piling up requests the server cannot serve in time.
+    def __init__(self, workers=2, max_pending=16):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='recognize-upload')
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            return None
+        with self.lock:
+            self.pending += 1
+        try:
+            future = self.executor.submit(fn, *args)
+        except RuntimeError:
+            # Pool shut down (process exiting)
+            self._done(None)
+            return None
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self.lock:
+            self.pending -= 1
+            if future is not None:
+                self.completed += 1
+        self.slots.release()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self.pending,
+                'completed': self.completed,
+                'rejected': self.rejected
+            }
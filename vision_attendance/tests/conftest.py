@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# Run from vision_attendance: python -m pytest -q tests
+# The modules are imported flat, as app.py does, from the vision_attendance directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'attendance.db')
+    database.init_db(path)
+    return path
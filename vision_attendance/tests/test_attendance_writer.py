@@ -0,0 +1,105 @@
+import sqlite3
+import time
+
+import pytest
+
+from attendance_writer import AttendanceWriter
+
+
+def add_student(path, student_id, name):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute('INSERT INTO students (student_id, name) VALUES (?, ?)', (student_id, name))
+    conn.close()
+
+
+def attendance(path, session_id):
+    conn = sqlite3.connect(path)
+    try:
+        return sorted(row[0] for row in conn.execute('SELECT student_id FROM attendance WHERE session_id = ?', (session_id,)))
+    finally:
+        conn.close()
+
+
+def wait_until(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def writer(db_path):
+    add_student(db_path, 'CS/1', 'Ann')
+    add_student(db_path, 'CS/2', 'Bo')
+    writer = AttendanceWriter(db_path, flush_ms=20)
+    writer.start()
+    yield writer
+    writer.stop()
+
+
+def test_waited_mark_reports_a_row_written_before_a_restart(db_path, writer):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("INSERT INTO attendance (student_id, session_id) VALUES ('CS/1', 5)")
+    conn.close()
+    # No open_session: the session's rows are loaded only after this mark was queued
+    assert writer.mark('CS-1', 5, wait=2) == ('Ann', 'already_marked')
+    assert writer.mark('CS-2', 5, wait=2) == ('Bo', 'marked')
+    assert attendance(db_path, 5) == ['CS/1', 'CS/2']
+    assert writer.waits == {}
+
+
+def test_waited_mark_reports_a_row_written_by_another_process(db_path, writer):
+    writer.open_session(6)
+    wait_until(lambda: 6 not in writer.to_load)
+    # Written after this writer loaded the session: only the insert can find it
+    other = AttendanceWriter(db_path, flush_ms=20)
+    other.start()
+    try:
+        assert other.mark('CS/1', 6, wait=2) == ('Ann', 'marked')
+    finally:
+        other.stop()
+    assert writer.mark('CS/1', 6, wait=2) == ('Ann', 'already_marked')
+    assert writer.mark('CS/1', 6, wait=2) == ('Ann', 'already_marked')
+    assert writer.rows_written == 0
+    assert attendance(db_path, 6) == ['CS/1']
+
+
+def test_unregistered_and_unwaited_marks(db_path, writer):
+    assert writer.mark('nobody', 7) is None
+    assert writer.mark('CS-2', 7) == ('Bo', 'marked')
+    assert writer.mark('CS/2', 7) == ('Bo', 'already_marked')
+    writer.stop()
+    assert attendance(db_path, 7) == ['CS/2']
+
+
+def test_open_session_loads_before_the_flush_window(db_path):
+    add_student(db_path, 'CS/1', 'Ann')
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("INSERT INTO attendance (student_id, session_id) VALUES ('CS/1', 8)")
+    conn.close()
+    writer = AttendanceWriter(db_path, flush_ms=5000)
+    writer.start()
+    try:
+        writer.open_session(8)
+        wait_until(lambda: 8 not in writer.to_load, timeout=1)
+        # Loaded: an unwaited mark is already reliable
+        assert writer.mark('CS/1', 8) == ('Ann', 'already_marked')
+    finally:
+        writer.stop()
+
+
+def test_unwaited_marks_queued_before_the_session_load_are_not_written_twice(db_path, writer):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("INSERT INTO attendance (student_id, session_id) VALUES ('CS/1', 9)")
+    conn.close()
+    # Documented: before the load, 'marked' only means queued
+    assert writer.mark('CS/1', 9) == ('Ann', 'marked')
+    assert writer.mark('CS/2', 9) == ('Bo', 'marked')
+    writer.stop()
+    assert attendance(db_path, 9) == ['CS/1', 'CS/2']
+    assert writer.rows_written == 1
+    assert writer.marked[9] == {'CS/1', 'CS/2'}
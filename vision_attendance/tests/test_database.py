@@ -0,0 +1,140 @@
+import glob
+import random
+import sqlite3
+
+import pytest
+
+import database
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def stats(path):
+    conn = connect(path)
+    try:
+        return {table: sorted(tuple(row) for row in conn.execute(f'SELECT * FROM {table}'))
+                for table in ('session_stats', 'student_stats', 'counters')}
+    finally:
+        conn.close()
+
+
+def indexes(path):
+    conn = connect(path)
+    try:
+        return set(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'attendance'"))
+    finally:
+        conn.close()
+
+
+def random_history(path, rng, operations=600, unique=True):
+    # Inserts and deletes of every kind the app issues, in random order. Without the unique index
+    # (a database that still holds duplicates) a student can be marked twice in one session.
+    conn = connect(path)
+    with conn:
+        if not unique:
+            conn.execute('DROP INDEX uq_attendance_session_student')
+            conn.execute('CREATE INDEX idx_attendance_session_student ON attendance(session_id, student_id)')
+        conn.executemany('INSERT INTO students (student_id, name) VALUES (?, ?)', [(f'S{i}', f'n{i}') for i in range(12)])
+        conn.executemany('INSERT INTO sessions (lecturer_id, session_token) VALUES (?, ?)', [(f'L{i % 2}', f't{i}') for i in range(8)])
+    for _ in range(operations):
+        op = rng.random()
+        with conn:
+            if op < 0.7:
+                day = f'2026-10-{rng.randint(1, 9):02d}'
+                clock = f'{rng.randint(8, 17):02d}:{rng.randint(0, 59):02d}:00'
+                conn.execute('INSERT OR IGNORE INTO attendance (student_id, session_id, date, time) VALUES (?, ?, ?, ?)',
+                             (f'S{rng.randint(0, 11)}', rng.randint(1, 8), day, clock))
+            elif op < 0.93:
+                conn.execute('DELETE FROM attendance WHERE id IN (SELECT id FROM attendance ORDER BY random() LIMIT 1)')
+            elif op < 0.98:
+                conn.execute('DELETE FROM attendance WHERE session_id = ?', (rng.randint(1, 8),))
+            else:
+                conn.execute('DELETE FROM students WHERE student_id = ?', (f'S{rng.randint(0, 11)}',))
+    conn.close()
+
+
+@pytest.mark.parametrize('unique', [True, False])
+def test_triggers_keep_the_same_stats_as_a_backfill(db_path, unique):
+    random_history(db_path, random.Random(0), unique=unique)
+    kept = stats(db_path)
+    assert kept['session_stats'] # The history left something to count
+    database.backfill_stats(db_path)
+    assert stats(db_path) == kept
+
+
+def test_deleting_everything_empties_the_stats(db_path):
+    random_history(db_path, random.Random(1), operations=200)
+    conn = connect(db_path)
+    with conn:
+        conn.execute('DELETE FROM attendance')
+    conn.close()
+    assert stats(db_path)['session_stats'] == [] and stats(db_path)['student_stats'] == []
+
+
+def test_unique_index_makes_repeat_marks_a_no_op(db_path):
+    assert 'uq_attendance_session_student' in indexes(db_path)
+    conn = connect(db_path)
+    with conn:
+        first = conn.execute("INSERT OR IGNORE INTO attendance (student_id, session_id) VALUES ('S1', 1)").rowcount
+        second = conn.execute("INSERT OR IGNORE INTO attendance (student_id, session_id) VALUES ('S1', 1)").rowcount
+    assert (first, second) == (1, 0)
+    assert conn.execute('SELECT present FROM session_stats WHERE session_id = 1').fetchone()[0] == 1
+    conn.close()
+
+
+def duplicated_database(path):
+    # A database from before the unique index, with a student marked three times in one session
+    database.init_db(path)
+    conn = connect(path)
+    with conn:
+        conn.execute('DROP INDEX uq_attendance_session_student')
+        rows = [('S1', 1, '09:00:00'), ('S1', 1, '09:05:00'), ('S2', 1, '09:01:00'), ('S1', 1, '09:10:00'), ('S1', 2, '10:00:00')]
+        conn.executemany("INSERT INTO attendance (student_id, session_id, date, time) VALUES (?, ?, '2026-10-01', ?)", rows)
+    conn.close()
+
+
+def test_init_db_keeps_duplicates_and_skips_the_unique_index(tmp_path, capsys):
+    path = str(tmp_path / 'old.db')
+    duplicated_database(path)
+    database.init_db(path)
+    assert 'python database.py --dedupe' in capsys.readouterr().out
+    conn = connect(path)
+    assert conn.execute('SELECT COUNT(*) FROM attendance').fetchone()[0] == 5
+    conn.close()
+    assert 'uq_attendance_session_student' not in indexes(path)
+    assert 'idx_attendance_session_student' in indexes(path)
+
+
+def test_dedupe_keeps_the_earliest_mark_and_saves_the_rest(tmp_path):
+    path = str(tmp_path / 'old.db')
+    duplicated_database(path)
+    database.init_db(path)
+    before = stats(path)
+
+    assert database.dedupe_attendance(path, dry_run=True) == 2
+    assert glob.glob(path + '.duplicates-*.csv') == []
+    assert database.dedupe_attendance(path) == 2
+
+    conn = connect(path)
+    assert [tuple(row) for row in conn.execute('SELECT student_id, session_id, time FROM attendance ORDER BY id')] == \
+        [('S1', 1, '09:00:00'), ('S2', 1, '09:01:00'), ('S1', 2, '10:00:00')]
+    conn.close()
+    assert 'uq_attendance_session_student' in indexes(path)
+    assert 'idx_attendance_session_student' not in indexes(path)
+    [backup] = glob.glob(path + '.duplicates-*.csv')
+    with open(backup) as f:
+        assert len(f.read().strip().splitlines()) == 3 # Header and the two deleted rows
+
+    # Counts were per distinct pair all along; only the last_seen values of session 1 and S1 move back
+    assert before['session_stats'][0] == (1, 2, '2026-10-01 09:00:00', '2026-10-01 09:10:00')
+    after = stats(path)
+    assert after['session_stats'] == [(1, 2, '2026-10-01 09:00:00', '2026-10-01 09:01:00'),
+                                      (2, 1, '2026-10-01 10:00:00', '2026-10-01 10:00:00')]
+    assert after['student_stats'] == before['student_stats'] # S1's last row is in session 2
+    database.backfill_stats(path)
+    assert stats(path) == after
+    assert database.dedupe_attendance(path) == 0
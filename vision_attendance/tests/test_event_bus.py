@@ -0,0 +1,35 @@
+import time
+
+from event_bus import EventBus
+
+
+def test_reconnect_receives_missed_events():
+    bus = EventBus()
+    first = bus.publish(1, 'recognition', {'name': 'Ann'})
+    bus.publish(1, 'recognition', {'name': 'Bo'})
+    subscriber = bus.subscribe(1, last_event_id=first)
+    assert [event[2]['name'] for event in subscriber.get(0)] == ['Bo']
+
+
+def test_idle_channels_are_dropped_but_subscribed_ones_kept():
+    bus = EventBus(idle=0.05)
+    bus.publish(1, 'recognition', {})
+    subscriber = bus.subscribe(2)
+    bus.publish(2, 'recognition', {})
+    time.sleep(0.1)
+    bus.publish(3, 'recognition', {}) # Any later use prunes
+    assert sorted(bus.channels) == [2, 3]
+    bus.unsubscribe(subscriber)
+    time.sleep(0.1)
+    bus.publish(3, 'recognition', {})
+    assert sorted(bus.channels) == [3]
+
+
+def test_closed_channel_forgets_its_history():
+    bus = EventBus()
+    subscriber = bus.subscribe(1)
+    bus.publish(1, 'recognition', {})
+    bus.close(1)
+    assert bus.stats()['channels'] == 0
+    assert bus.subscribe(1, last_event_id=0).get(0) == []
+    bus.unsubscribe(subscriber)
@@ -0,0 +1,56 @@
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+
+from face_logic import FaceTracker
+
+FRAME = np.zeros((240, 320, 3), dtype=np.uint8)
+
+
+class Engine:
+    # Stands in for FaceRecognizer: fixed boxes, every face recognised as S1
+    def __init__(self, boxes, recognize_gate=None):
+        self.boxes = boxes
+        self.snapshot = SimpleNamespace(version=1, trained=True)
+        self.recognize_gate = recognize_gate # threading.Event the first recognition waits for
+        self.entered = threading.Event()
+        self.recognized = []
+
+    def detect_faces(self, frame, gate=None, hints=None, params=None):
+        return list(self.boxes)
+
+    def recognize_faces(self, frame, boxes, strict_threshold, snapshot):
+        self.recognized.append(list(boxes))
+        self.entered.set()
+        if self.recognize_gate is not None:
+            self.recognize_gate.wait(5)
+        return [{'student_id': 'S1', 'confidence_raw': 10.0} for _ in boxes]
+
+
+def test_frame_older_than_the_applied_one_is_dropped():
+    tracker = FaceTracker(Engine([(10, 10, 50, 50)]))
+    first = tracker.update(FRAME, seq=5)
+    assert [r['student_id'] for r in first] == ['S1']
+    assert tracker.update(FRAME, seq=3) is None
+    assert tracker.update(FRAME, seq=5) is None
+    assert tracker.frames == 1 and tracker.stats()['frames_stale'] == 2
+    assert tracker.update(FRAME, seq=6)[0]['track_id'] == first[0]['track_id']
+
+
+def test_recognition_runs_outside_the_lock():
+    gate = threading.Event()
+    engine = Engine([(10, 10, 50, 50)], recognize_gate=gate)
+    tracker = FaceTracker(engine)
+    slow = threading.Thread(target=tracker.update, args=(FRAME,), kwargs={'seq': 1})
+    slow.start()
+    assert engine.entered.wait(5)
+    # The first frame is still being recognised: the next one is applied meanwhile and does not
+    # recognise the same, already claimed track a second time
+    second = tracker.update(FRAME, seq=2)
+    assert [r['student_id'] for r in second] == ['Unknown']
+    assert len(engine.recognized) == 1
+    gate.set()
+    slow.join(5)
+    assert tracker.update(FRAME, seq=3)[0]['student_id'] == 'S1'
+    assert tracker.faces_recognized == 1
@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+import pytest
+
+from face_logic import LBPHMatcher
+from bench.common import student_base, synthetic_face
+
+STUDENTS = 11
+SAMPLES = 5
+
+
+@pytest.fixture(scope='module')
+def faces():
+    rng = np.random.default_rng(0)
+    bases = [student_base(rng) for _ in range(STUDENTS)]
+    gallery = [synthetic_face(rng, base) for base in bases for _ in range(SAMPLES)]
+    labels = np.repeat(np.arange(STUDENTS, dtype=np.int32), SAMPLES)
+    probes = [synthetic_face(rng, base) for base in bases for _ in range(SAMPLES)]
+    return gallery, labels, probes
+
+
+def test_predictions_match_opencv_lbph(faces):
+    gallery, labels, probes = faces
+    reference = cv2.face.LBPHFaceRecognizer_create()
+    reference.train(gallery, labels)
+    matcher = LBPHMatcher()
+    matcher.train(gallery, labels)
+
+    expected = [reference.predict(p) for p in probes]
+    assert [m[0] for m in matcher.predict_batch(probes)] == [e[0] for e in expected]
+    for (_, distance), (_, opencv_distance) in zip(matcher.predict_batch(probes), expected):
+        assert distance == pytest.approx(opencv_distance, rel=1e-4)
+    assert [matcher.predict(p) for p in probes[:5]] == matcher.predict_batch(probes[:5])
+
+
+def test_yaml_model_is_readable_by_opencv(faces, tmp_path):
+    gallery, labels, probes = faces
+    matcher = LBPHMatcher()
+    matcher.train(gallery, labels)
+    path = str(tmp_path / 'model.yml')
+    matcher.write(path)
+    reference = cv2.face.LBPHFaceRecognizer_create()
+    reference.read(path)
+    assert [reference.predict(p)[0] for p in probes] == [m[0] for m in matcher.predict_batch(probes)]
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_binary_model_round_trip(faces, tmp_path, mmap):
+    gallery, labels, probes = faces
+    matcher = LBPHMatcher()
+    matcher.train(gallery, labels)
+    label_map = {i: f'CS-{i}' for i in range(STUDENTS)}
+    path = str(tmp_path / 'model.bin')
+    matcher.write_binary(path, label_map)
+    loaded, loaded_map = LBPHMatcher.read_binary(path, mmap=mmap)
+    assert loaded_map == label_map
+    assert loaded.predict_batch(probes) == matcher.predict_batch(probes)
+
+
+def test_copy_on_write_updates(faces):
+    gallery, labels, probes = faces
+    matcher = LBPHMatcher()
+    matcher.train(gallery[:-SAMPLES], labels[:-SAMPLES])
+    extended = matcher.with_samples(gallery[-SAMPLES:], labels[-SAMPLES:])
+    assert len(matcher) == len(gallery) - SAMPLES and len(extended) == len(gallery)
+    assert [m[0] for m in extended.predict_batch(probes[-SAMPLES:])] == [STUDENTS - 1] * SAMPLES
+    removed = extended.without_label(0)
+    assert 0 not in [m[0] for m in removed.predict_batch(probes)]
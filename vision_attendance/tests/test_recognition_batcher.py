@@ -0,0 +1,67 @@
+import threading
+
+import numpy as np
+import pytest
+
+from face_logic import RecognitionBatcher
+
+
+class Snapshot:
+    # Stands in for a model snapshot: every face is label 1 at distance 12
+    index = None
+
+    def __init__(self):
+        self.recognizer = self
+
+    def predict_batch(self, faces):
+        return [(1, 12.0)] * len(faces)
+
+
+ROIS = [np.full((60, 60), 128, dtype=np.uint8)]
+
+
+def test_batches_resolve_each_caller():
+    batcher = RecognitionBatcher().start()
+    try:
+        assert batcher.submit(ROIS * 2, Snapshot()).result(timeout=2) == [(1, 12.0)] * 2
+    finally:
+        batcher.stop()
+
+
+def test_error_outside_a_batch_fails_it_and_keeps_serving():
+    batcher = RecognitionBatcher().start()
+    collect = batcher._collect
+    calls = []
+
+    def broken_collect():
+        batch = collect()
+        if not calls:
+            calls.append(1)
+            raise RuntimeError("collect failed")
+        return batch
+
+    batcher._collect = broken_collect
+    try:
+        failed = batcher.submit(ROIS, Snapshot())
+        assert isinstance(failed.exception(timeout=2), RuntimeError)
+        assert batcher.submit(ROIS, Snapshot()).result(timeout=2) == [(1, 12.0)]
+    finally:
+        batcher.stop()
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_dead_thread_fails_queued_requests_and_refuses_new_ones():
+    batcher = RecognitionBatcher()
+    gate = threading.Event()
+
+    def dying_loop():
+        gate.wait(2)
+        raise SystemExit
+
+    batcher._loop = dying_loop
+    batcher.start()
+    queued = batcher.submit(ROIS, Snapshot())
+    gate.set()
+    batcher.thread.join(2)
+    assert isinstance(queued.exception(timeout=2), RuntimeError)
+    assert isinstance(batcher.submit(ROIS, Snapshot()).exception(timeout=0), RuntimeError)